@@ -0,0 +1,341 @@
+import csv
+import heapq
+import itertools
+import numpy
+import report_handler
+
+
+class AnalyticsHandler():
+
+  """This class computes the language analytics of a report
+
+  The report is gone through in chunks of rows, which are loaded as a dense
+  NumPy matrix of the language sizes (a row per repository, a column per
+  language), so the memory used is bounded by the chunk size whatever the
+  size of the report. Each chunk is folded into running aggregates with
+  vectorized operations: the total bytes and number of repositories of each
+  language, the number of repositories each language is the primary (largest)
+  language of, the co-occurrence matrix of the languages (the number of
+  repositories using both), and a heap of the largest repositories. The size
+  percentiles come from histograms with logarithmic bins (8 per doubling of
+  the size), so they are within 5% of the exact values.
+
+  """
+
+  # The number of histogram bins per doubling of the size
+  _BINS_PER_OCTAVE = 8
+
+  # The number of histogram bins (enough for any 64 bit size)
+  _BIN_COUNT = 64 * _BINS_PER_OCTAVE
+
+  # List of all recognized GitHub languages
+  _languages = None
+
+  # The number of the largest repositories kept
+  _topCount = None
+
+  # The number of repositories (with content) gone through
+  _repositories = 0
+
+  # The total bytes of each language
+  _totals = None
+
+  # The number of repositories of each language
+  _counts = None
+
+  # The number of repositories each language is the primary language of
+  _primary = None
+
+  # The number of repositories using both languages (a matrix)
+  _cooccurrence = None
+
+  # The size histograms of each language (a matrix)
+  _histograms = None
+
+  # The size histogram of the repositories
+  _totalHistogram = None
+
+  # The heap of the largest repositories as (size, name) tuples
+  _top = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, languages, logger, topCount=10):
+    """Constructor that sets up the aggregates
+
+    Args:
+      languages: The list of languages as fields for the report
+      logger: The custom logger to be used for this execution
+      topCount: The number of the largest repositories kept
+
+    """
+
+    self._languages = languages
+    self._logger = logger
+    self._topCount = topCount
+    self._repositories = 0
+
+    languageCount = len(languages)
+    self._totals = numpy.zeros(languageCount, numpy.uint64)
+    self._counts = numpy.zeros(languageCount, numpy.int64)
+    self._primary = numpy.zeros(languageCount, numpy.int64)
+    self._cooccurrence = numpy.zeros((languageCount, languageCount),
+                                     numpy.int64)
+    self._histograms = numpy.zeros((languageCount, self._BIN_COUNT),
+                                   numpy.int64)
+    self._totalHistogram = numpy.zeros(self._BIN_COUNT, numpy.int64)
+    self._top = []
+
+  def analyzeReport(self, fileNames, chunkRows=65536):
+    """Goes through the reports, chunk by chunk
+
+    Args:
+      fileNames: The list of the file names of the reports, CSV or NPZ (by
+                 their extension)
+      chunkRows: The number of rows of a chunk
+
+    """
+
+    for fileName in fileNames:
+      self._logger.info("Analyzing report %s" %fileName)
+
+      if fileName.endswith(".npz"):
+        chunks = self._npzChunks(fileName, chunkRows)
+      else:
+        chunks = self._csvChunks(fileName, chunkRows)
+
+      for sizes, names in chunks:
+        self.addChunk(sizes, names)
+
+    self._logger.info("Analyzed %d repositories" %self._repositories)
+
+  def addChunk(self, sizes, names):
+    """Folds a chunk of repositories into the aggregates
+
+    Args:
+      sizes: The matrix of the language sizes (a row per repository, a column
+             per language)
+      names: The sequence of the names of the repositories
+
+    """
+
+    sizes = sizes.astype(numpy.uint64, copy=False)
+    repositoryTotals = sizes.sum(axis=1)
+    content = repositoryTotals > 0
+    if not content.all():
+      sizes = sizes[content]
+      repositoryTotals = repositoryTotals[content]
+      names = [name for name, hasContent in itertools.izip(names, content)
+               if hasContent]
+
+    if len(sizes) == 0:
+      return
+
+    used = sizes > 0
+    usedCounts = used.astype(numpy.int64)
+
+    self._repositories += len(sizes)
+    self._totals += sizes.sum(axis=0, dtype=numpy.uint64)
+    self._counts += usedCounts.sum(axis=0)
+    self._primary += numpy.bincount(sizes.argmax(axis=1),
+                                    minlength=len(self._languages))
+    self._cooccurrence += usedCounts.T.dot(usedCounts)
+
+    # The histograms of every language at once, through flat bin numbers
+    rows, languages = used.nonzero()
+    bins = self._bins(sizes[rows, languages])
+    self._histograms += numpy.bincount(languages * self._BIN_COUNT + bins,
+        minlength=self._histograms.size).reshape(self._histograms.shape)
+    self._totalHistogram += numpy.bincount(self._bins(repositoryTotals),
+                                           minlength=self._BIN_COUNT)
+
+    # Only the largest repositories of the chunk can make the top
+    candidates = numpy.arange(len(sizes))
+    if len(sizes) > self._topCount:
+      candidates = numpy.argpartition(-repositoryTotals.astype(numpy.float64),
+                                      self._topCount)[:self._topCount]
+
+    for index in candidates:
+      entry = (int(repositoryTotals[index]), names[index])
+      if len(self._top) < self._topCount:
+        heapq.heappush(self._top, entry)
+      elif entry > self._top[0]:
+        heapq.heapreplace(self._top, entry)
+
+  def results(self, percentiles=(50, 90, 99)):
+    """Forms the results of the aggregates
+
+    Args:
+      percentiles: The percentiles of the sizes (between 0 and 100)
+
+    Returns:
+      A dictionary of the number of 'repositories', the 'languages' (a list
+      of dictionaries of the 'language', its 'bytes', 'share' of the bytes,
+      number of 'repositories', 'primary' repositories, 'primaryShare' of the
+      repositories and size 'percentiles'), the size 'percentiles' of the
+      repositories, the 'cooccurrence' matrix (as lists, in the order of the
+      languages) and the 'top' repositories as (name, size) tuples
+
+    """
+
+    grandTotal = float(self._totals.sum()) or 1.0
+    repositories = float(self._repositories) or 1.0
+    languages = []
+
+    for index, language in enumerate(self._languages):
+      languages.append({
+          'language': language,
+          'bytes': int(self._totals[index]),
+          'share': float(self._totals[index]) / grandTotal,
+          'repositories': int(self._counts[index]),
+          'primary': int(self._primary[index]),
+          'primaryShare': float(self._primary[index]) / repositories,
+          'percentiles': self._percentiles(self._histograms[index],
+                                           percentiles)})
+
+    return {'repositories': self._repositories, 'languages': languages,
+            'percentiles': self._percentiles(self._totalHistogram,
+                                             percentiles),
+            'cooccurrence': self._cooccurrence.tolist(),
+            'top': [(name, size) for size, name in
+                    sorted(self._top, reverse=True)]}
+
+  def _bins(self, sizes):
+    """Determines the histogram bins of sizes
+
+    Args:
+      sizes: The array of the sizes (all above 0)
+
+    Returns:
+      The array of the bin numbers
+
+    """
+
+    bins = numpy.log2(sizes.astype(numpy.float64)) * self._BINS_PER_OCTAVE
+    return numpy.minimum(bins.astype(numpy.int64), self._BIN_COUNT - 1)
+
+  def _percentiles(self, histogram, percentiles):
+    """Estimates the percentiles of the sizes counted by a histogram
+
+    Args:
+      histogram: The array of the counts of each bin
+      percentiles: The percentiles (between 0 and 100)
+
+    Returns:
+      A dictionary of the estimated size (the geometric middle of its bin) by
+      percentile, empty when nothing was counted
+
+    """
+
+    counted = histogram.sum()
+    if counted == 0:
+      return {}
+
+    cumulative = numpy.cumsum(histogram)
+    ranks = numpy.ceil(numpy.asarray(percentiles, numpy.float64) / 100 *
+                       counted).clip(1, counted)
+    bins = numpy.searchsorted(cumulative, ranks)
+    sizes = numpy.exp2((bins + 0.5) / self._BINS_PER_OCTAVE)
+
+    return dict((percentile, int(round(size)))
+                for percentile, size in itertools.izip(percentiles, sizes))
+
+  def _csvChunks(self, fileName, chunkRows):
+    """Reads a CSV report in chunks
+
+    Args:
+      fileName: The file name of the report
+      chunkRows: The number of rows of a chunk
+
+    Returns:
+      A generator of (language sizes matrix, repository names) tuples
+
+    """
+
+    languageCount = len(self._languages)
+
+    with open(fileName, 'rb') as reportFile:
+      reader = csv.reader(reportFile)
+      header = next(reader, None)
+      if header == None:
+        return
+
+      if header[:languageCount] != list(self._languages):
+        raise ValueError("The languages of %s don't match" %fileName)
+
+      owner = header.index("owner", languageCount)
+      name = header.index("name", languageCount)
+
+      while True:
+        rows = list(itertools.islice(reader, chunkRows))
+        if len(rows) == 0:
+          break
+
+        sizes = numpy.array([row[:languageCount] for row in rows],
+                            numpy.float64)
+        yield sizes, ["%s/%s" %(row[owner], row[name]) for row in rows]
+
+  def _npzChunks(self, fileName, chunkRows):
+    """Reads an NPZ report in chunks
+
+    The (small) chunks of the report are gathered into chunks of about the
+    requested number of rows.
+
+    Args:
+      fileName: The file name of the report
+      chunkRows: The number of rows of a chunk
+
+    Returns:
+      A generator of (language sizes matrix, repository names) tuples
+
+    """
+
+    gathered = []
+    gatheredRows = 0
+
+    for chunk in report_handler.iterateNPZReport([fileName],
+                                                 ["owner", "name"]):
+      if chunk['languages'] != list(self._languages):
+        raise ValueError("The languages of %s don't match" %fileName)
+
+      gathered.append(chunk)
+      gatheredRows += chunk['rows']
+
+      if gatheredRows >= chunkRows:
+        yield self._denseChunk(gathered, gatheredRows)
+        gathered = []
+        gatheredRows = 0
+
+    if gatheredRows > 0:
+      yield self._denseChunk(gathered, gatheredRows)
+
+  def _denseChunk(self, chunks, rows):
+    """Forms the dense matrix of the language sizes of NPZ report chunks
+
+    Args:
+      chunks: The list of the chunks (see report_handler.iterateNPZReport)
+      rows: The total number of rows of the chunks
+
+    Returns:
+      A tuple of the language sizes matrix and the repository names
+
+    """
+
+    sizes = numpy.zeros((rows, len(self._languages)), numpy.uint64)
+    names = []
+    firstRow = 0
+
+    for chunk in chunks:
+      data, indices, indptr = chunk['languageSizes']
+      rowNumbers = numpy.repeat(numpy.arange(firstRow,
+                                             firstRow + chunk['rows']),
+                                numpy.diff(indptr))
+      sizes[rowNumbers, indices] = data
+
+      names.extend("%s/%s" %(owner, name) for owner, name in
+                   itertools.izip(chunk['columns']['owner'],
+                                  chunk['columns']['name']))
+      firstRow += chunk['rows']
+
+    return sizes, names
@@ -1,6 +1,11 @@
+import httplib
 import logging
+import socket
 import time
-import urllib2
+import loop_handler
+import metrics_handler
+import rate_handler
+import stream_handler
 try: import simplejson as json
 except ImportError: import json
 
@@ -13,7 +18,13 @@ class APIHandler():
   acquire the next page of repositories given the search criteria, that is 100
   repositories) at a time. The second one is used to acquire the size of each
   of the languages used in the repository. Error handling is used to retry API
-  calls if the rate limit is reached or bad connection occurs.
+  calls if the rate limit is reached or bad connection occurs. The API calls
+  are paced by a RateHandler, whose budget is shared with every other API
+  handler in the process, and failed calls back off depending on the kind of
+  failure (rate limit, server error or network error). When a cache is
+  given, the responses are kept on disk and revalidated using conditional
+  requests, so unchanged responses don't have to be downloaded again. The
+  requests go over the persistent connections of a ConnectionHandler.
 
   """
 
@@ -23,15 +34,41 @@ class APIHandler():
   # Logger being used for this execution
   logger = None
 
-  def __init__(self, logger):
-    """Constructor that just makes a log entry
+  # The rate handler pacing the API calls
+  _rateHandler = None
+
+  # The on-disk cache of API responses (None if caching is disabled)
+  _cacheHandler = None
+
+  # The pool of persistent connections the API calls are made over
+  _connectionHandler = None
+
+  # The metrics of the API calls
+  _metricsHandler = None
+
+  def __init__(self, logger, rateHandler, connectionHandler,
+               cacheHandler=None, apiUrl=None):
+    """Constructor that sets the handlers and makes a log entry
 
       Args:
         logger: The custom logger to be used for this executing process
+        rateHandler: The RateHandler pacing the API calls
+        connectionHandler: The ConnectionHandler the API calls are made over
+        cacheHandler: The CacheHandler storing the API responses (optional)
+        apiUrl: The URL the API calls are made to, ending with a '/' (by
+                default the one of GitHub)
 
     """
 
+    if apiUrl != None:
+      self.API_CALL = apiUrl
+
     self._logger = logger
+    self._rateHandler = rateHandler
+    self._connectionHandler = connectionHandler
+    self._cacheHandler = cacheHandler
+    self._metricsHandler = metrics_handler.getMetricsHandler()
+
     self._logger.info("API Handler is ready for use")
 
   def getNextPage(self, nextPage, language, keywords):
@@ -47,17 +84,34 @@ class APIHandler():
 
     """
 
-    self._logger.info("Acquiring new list of repositories from page %d"
-                      %nextPage)
-    APICall = self.API_CALL + "search/\"%s\"?language=%s&start_page=%d" \
-              %(keywords, language, nextPage)
-    results = self._makeAPICall(APICall) 
-    
+    results = self._makeAPICall(self._pageCall(nextPage, language, keywords))
+
     if results == None:
       return None
     else:
       return results['repositories']
 
+  def streamNextPage(self, nextPage, language, keywords, outcome):
+    """API call that streams the next page of repositories
+
+    The repositories are decoded one at a time while the page is still being
+    received, so they can be handled before the rest of the page arrives.
+
+    Args:
+      nextPage: The next page number of the repository search
+      language: The language for the search being conducted
+      keywords: The keywords for the search being conducted
+      outcome: The dictionary whose 'complete' flag is set once the whole
+               page is received (it stays unset if the call fails)
+
+    Returns:
+      A generator of the repositories from the specified repository page
+
+    """
+
+    return self._streamAPICall(self._pageCall(nextPage, language, keywords),
+                               'repositories', outcome)
+
   def getLanguages(self, repository):
     """API call that requests the language->size values of a repository
 
@@ -69,22 +123,56 @@ class APIHandler():
 
     """
 
-    self._logger.info("Acquiring language information from repository %s"
-                      %repository['uniqueName'])
-    APICall = self.API_CALL + "show/%s/%s/languages" %(repository['owner'],
-              repository['name'])
-    results = self._makeAPICall(APICall) 
-    
+    results = self._makeAPICall(self._languagesCall(repository))
+
     if results == None:
       return None
     else:
       return results['languages']
 
+  def _pageCall(self, nextPage, language, keywords):
+    """Forms the API call of a page of repositories
+
+    Args:
+      nextPage: The next page number of the repository search
+      language: The language for the search being conducted
+      keywords: The keywords for the search being conducted
+
+    Returns:
+      The API call
+
+    """
+
+    self._logger.info("Acquiring new list of repositories from page %d"
+                      %nextPage)
+    return self.API_CALL + "search/\"%s\"?language=%s&start_page=%d" \
+           %(keywords, language, nextPage)
+
+  def _languagesCall(self, repository):
+    """Forms the API call of the languages of a repository
+
+    Args:
+      repository: The the repository currently being examined
+
+    Returns:
+      The API call
+
+    """
+
+    self._logger.info("Acquiring language information from repository %s"
+                      %repository['uniqueName'])
+    return self.API_CALL + "show/%s/%s/languages" %(repository['owner'],
+           repository['name'])
+
   def _makeAPICall(self, apiCall):
     """Makes the actual API request given the specified apiCall.
 
-    The API call will retry after waiting the 60 second API rate reset. The
-    retrying process will occur 5 times, in which after that it stop.
+    The API call will retry after backing off, for longer when the rate limit
+    is reached than on server or network errors. The retrying process will
+    occur 10 times, in which after that it stop. Client errors (such as a
+    missing repository) are not retried. If the response of the API call is
+    cached, the request is made conditional and the cached response is used
+    when GitHub reports it as not modified.
 
     Args:
       apiCall: The custom formated API call to be used
@@ -95,32 +183,347 @@ class APIHandler():
     """
 
     currentAttempt = 0
-    maxAttempts = 10  # The number of attempts to retry the API call
-    successful = False
-    data = None
+    requestHeaders, cached = self._conditionalRequest(apiCall)
 
     # Keep trying to complete a successful API call (up to maxAttempts times)
-    while not successful:
+    while True:
+      self._metricsHandler.observe("api.rate_wait",
+                                   self._rateHandler.acquire())
+      headers = None
+
+      try:
+        with self._metricsHandler.timer("api.request"):
+          status, headers, body = self._connectionHandler.request(apiCall,
+              requestHeaders)
+        self._countCall(len(body))
+        done, data, errorClass = self._handleResponse(apiCall, status,
+                                                      headers, body, cached)
+        if done:
+          return data
+      except (socket.error, httplib.HTTPException, ValueError), e:
+        self._logger.warn("Unsuccessful API call -> Error: %s" %e)
+        errorClass = rate_handler.NETWORK_ERROR
+
+      currentAttempt += 1
+
+      if not self._retrying(currentAttempt):
+        return None
+      self._rateHandler.backoff(currentAttempt, errorClass, headers)
+
+  def _streamAPICall(self, apiCall, key, outcome):
+    """Makes an API request and generates the elements of an array as they
+    arrive
+
+    The API call is retried like with _makeAPICall. When a retry happens
+    after some of the elements were already generated, those elements are
+    skipped. When caching, the whole response is kept to be stored once it
+    has been received.
+
+    Args:
+      apiCall: The custom formated API call to be used
+      key: The key of the array in the JSON result
+      outcome: The dictionary whose 'complete' flag is set once the whole
+               array is received
+
+    Returns:
+      A generator of the elements of the array
+
+    """
+
+    currentAttempt = 0
+    generated = 0
+    requestHeaders, cached = self._conditionalRequest(apiCall)
+
+    while True:
+      self._metricsHandler.observe("api.rate_wait",
+                                   self._rateHandler.acquire())
+      headers = None
+
+      try:
+        startTime = time.time()
+        status, headers, chunks = self._connectionHandler.stream(apiCall,
+            requestHeaders)
+
+        try:
+          if status == 200:
+            self._rateHandler.update(headers)
+            decoder = stream_handler.ArrayStreamDecoder(key)
+            body = [] if self._cacheHandler != None else None
+            index = 0
+            received = 0
+
+            for chunk in chunks:
+              received += len(chunk)
+              if body != None:
+                body.append(chunk)
+
+              for element in decoder.feed(chunk):
+                index += 1
+                if index > generated:
+                  generated += 1
+                  yield element
+
+            decoder.close()
+            self._metricsHandler.observe("api.request",
+                                         time.time() - startTime)
+            self._countCall(received)
+
+            if body != None:
+              self._cacheHandler.store(apiCall, "".join(body),
+                                       headers.getheader("ETag"),
+                                       headers.getheader("Last-Modified"))
+            outcome['complete'] = True
+            return
+
+          body = "".join(chunks)
+          self._metricsHandler.observe("api.request", time.time() - startTime)
+          self._countCall(len(body))
+          done, data, errorClass = self._handleResponse(apiCall, status,
+              headers, body, cached)
+        finally:
+          chunks.close()
+
+        if done:
+          if data != None:
+            for element in data.get(key, [])[generated:]:
+              yield element
+            outcome['complete'] = True
+          return
+      except (socket.error, httplib.HTTPException, ValueError), e:
+        self._logger.warn("Unsuccessful API call -> Error: %s" %e)
+        errorClass = rate_handler.NETWORK_ERROR
+
+      currentAttempt += 1
+
+      if not self._retrying(currentAttempt):
+        return
+      self._rateHandler.backoff(currentAttempt, errorClass, headers)
+
+  def _conditionalRequest(self, apiCall):
+    """Forms the headers that revalidate a cached response of the API call
+
+    Args:
+      apiCall: The custom formated API call to be used
+
+    Returns:
+      A tuple of the dictionary of request headers, and the cached response
+      (or None)
+
+    """
+
+    requestHeaders = {}
+    cached = None
+
+    # Revalidate a cached response instead of downloading it again
+    if self._cacheHandler != None:
+      cached = self._cacheHandler.lookup(apiCall)
+
+      if cached != None:
+        if cached['etag'] != None:
+          requestHeaders["If-None-Match"] = cached['etag']
+        if cached['lastModified'] != None:
+          requestHeaders["If-Modified-Since"] = cached['lastModified']
+
+    return requestHeaders, cached
+
+  def _handleResponse(self, apiCall, status, headers, body, cached):
+    """Handles the response of an API call
+
+    Args:
+      apiCall: The custom formated API call to be used
+      status: The status code of the response
+      headers: The headers of the response
+      body: The body of the response
+      cached: The cached response of the API call (or None)
+
+    Returns:
+      A tuple of whether the API call is done, its JSON result (None if it
+      can't succeed) and the class of error to back off for when it isn't
+      done
+
+    Raises:
+      ValueError: The body of the response isn't valid JSON
+
+    """
+
+    self._rateHandler.update(headers)
+
+    if status == 200:
+      data = json.loads(body)
+
+      if self._cacheHandler != None:
+        self._cacheHandler.store(apiCall, body, headers.getheader("ETag"),
+                                 headers.getheader("Last-Modified"))
+      return True, data, None
+    elif status == 304 and cached != None:
+      self._logger.info("Using cached response of API call")
+      self._metricsHandler.increment("api.cache_hits")
+      self._cacheHandler.refresh(apiCall)
+      return True, json.loads(cached['body']), None
+
+    self._logger.warn("Unsuccessful API call -> HTTP Error: %s" %status)
+
+    if status in (403, 429):
+      return False, None, rate_handler.RATE_LIMITED
+    elif status >= 500:
+      return False, None, rate_handler.SERVER_ERROR
+
+    self._logger.warn("API call can't succeed, not retrying")
+    return True, None, None
+
+  def _retrying(self, currentAttempt):
+    """Determines if a failed API call is retried
+
+    Args:
+      currentAttempt: The number of the failed attempt (starting at 1)
+
+    Returns:
+      True if the API call is retried, otherwise False
+
+    """
+
+    maxAttempts = 10  # The number of attempts to retry the API call
+
+    if currentAttempt <= maxAttempts:
+      self._metricsHandler.increment("api.retries")
+      self._logger.info("Retrying API call %d/%d" %(currentAttempt,
+                        maxAttempts))
+      return True
+
+    self._logger.warn("API call attempts exceeded")
+    self._metricsHandler.increment("api.failures")
+    return False
+
+  def _countCall(self, size):
+    """Counts an API call that received a response in the metrics
+
+    Args:
+      size: The size of the body of the response in bytes
+
+    """
+
+    self._metricsHandler.increment("api.calls")
+    self._metricsHandler.increment("api.bytes", size)
+
+
+class AsyncAPIHandler(APIHandler):
+
+  """This class handles the calls to the GitHub API on an event loop
+
+  The API calls work like those of the APIHandler, except that they are
+  coroutines running on an EventLoop, over an AsyncConnectionHandler. Waiting
+  for the rate budget or backing off only holds up the API call itself, so
+  any number of API calls can be in flight within a single thread. The rate
+  budget is the same RateHandler shared with every other API handler in the
+  process.
+
+  """
+
+  # The event loop the API calls run on
+  _loop = None
+
+  def __init__(self, logger, rateHandler, connectionHandler, loop,
+               cacheHandler=None, apiUrl=None):
+    """Constructor that sets the handlers and makes a log entry
+
+      Args:
+        logger: The custom logger to be used for this executing process
+        rateHandler: The RateHandler pacing the API calls
+        connectionHandler: The AsyncConnectionHandler the API calls are made
+                           over
+        loop: The EventLoop the API calls run on
+        cacheHandler: The CacheHandler storing the API responses (optional)
+        apiUrl: The URL the API calls are made to, ending with a '/' (by
+                default the one of GitHub)
+
+    """
+
+    APIHandler.__init__(self, logger, rateHandler, connectionHandler,
+                        cacheHandler, apiUrl)
+    self._loop = loop
+
+  def getNextPage(self, nextPage, language, keywords):
+    """API call that requests the next page of repositories (a coroutine)
+
+    Args:
+      nextPage: The next page number of the repository search
+      language: The language for the search being conducted
+      keywords: The keywords for the search being conducted
+
+    Returns:
+      A list of repositories from the specified repository page
+
+    """
+
+    results = yield self._makeAPICall(self._pageCall(nextPage, language,
+                                                     keywords))
+
+    if results == None:
+      raise loop_handler.Return(None)
+    else:
+      raise loop_handler.Return(results['repositories'])
+
+  def getLanguages(self, repository):
+    """API call that requests the language->size values of a repository (a
+    coroutine)
+
+    Args:
+      repository: The the repository currently being examined
+
+    Returns:
+      A list of language->size values of the specified repository
+
+    """
+
+    results = yield self._makeAPICall(self._languagesCall(repository))
+
+    if results == None:
+      raise loop_handler.Return(None)
+    else:
+      raise loop_handler.Return(results['languages'])
+
+  def _makeAPICall(self, apiCall):
+    """Makes the actual API request given the specified apiCall (a coroutine)
+
+    Args:
+      apiCall: The custom formated API call to be used
+
+    Returns:
+      The JSON result of the API call or None if call fails
+
+    """
+
+    currentAttempt = 0
+    requestHeaders, cached = self._conditionalRequest(apiCall)
+
+    while True:
+      waited = 0.0
+      delay = self._rateHandler.reserve()
+      while delay > 0:
+        yield self._loop.sleep(delay)
+        waited += delay
+        delay = self._rateHandler.reserve()
+
+      self._metricsHandler.observe("api.rate_wait", waited)
+      headers = None
 
-      # If the API call doesn't succeed wait 60 seconds and try again
       try:
-        data = json.load(urllib2.urlopen(apiCall))
-        successful = True
-      except urllib2.URLError, e:
-        if hasattr(e, 'reason'):
-          self._logger.warn("Unsuccessful API call -> URL Error: %s" %e.reason)
-        elif hasattr(e, 'code'):
-          self._logger.warn("Unsuccessful API call -> HTTP Error: %s" %e.code)
-
-        currentAttempt += 1
-
-        if currentAttempt <= maxAttempts:
-          self._logger.info("Retrying API call %d/%d" %(currentAttempt,
-                            maxAttempts))
-          self._logger.info("Waiting 60 seconds")
-          time.sleep(60)
-        else:
-          self._logger.warn("API call attempts exceeded")
-          return None
-
-    return data
+        startTime = time.time()
+        status, headers, body = yield self._connectionHandler.request(
+            apiCall, requestHeaders)
+        self._metricsHandler.observe("api.request", time.time() - startTime)
+        self._countCall(len(body))
+        done, data, errorClass = self._handleResponse(apiCall, status,
+                                                      headers, body, cached)
+        if done:
+          raise loop_handler.Return(data)
+      except (socket.error, httplib.HTTPException, ValueError), e:
+        self._logger.warn("Unsuccessful API call -> Error: %s" %e)
+        errorClass = rate_handler.NETWORK_ERROR
+
+      currentAttempt += 1
+
+      if not self._retrying(currentAttempt):
+        raise loop_handler.Return(None)
+      yield self._loop.sleep(self._rateHandler.backoffDelay(currentAttempt,
+          errorClass, headers))
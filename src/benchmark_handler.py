@@ -0,0 +1,433 @@
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import clone_handler
+try: import simplejson as json
+except ImportError: import json
+
+
+class StubAPIHandler():
+
+  """This class serves a local stand-in of the GitHub API for benchmarks
+
+  The stand-in answers the two API calls of the crawl: the search pages (100
+  repositories each, an empty page past the last repository) and the
+  languages of a repository. Each response takes the configured latency
+  (with up to half of it again as random jitter), carries the rate-limit
+  headers of GitHub, and is answered with a 403 once the calls of the current
+  minute exceed the rate limit. A share of the responses can be turned into
+  server errors. The randomness is seeded, so a benchmark can be repeated.
+  ETags are sent, so conditional requests of the API cache get 304s.
+
+  """
+
+  # The number of repositories on a search page
+  PAGE_SIZE = 100
+
+  # The repositories served, as dictionaries of their search fields and
+  # their 'languages'
+  _repositories = None
+
+  # The repositories by 'owner/name'
+  _repositoriesByName = None
+
+  # The number of seconds each response takes (before the jitter)
+  _latency = None
+
+  # The maximum number of API calls per minute (0 is unlimited)
+  _rateLimit = None
+
+  # The share of the API calls answered with a server error
+  _errorRate = None
+
+  # The random generator of the jitter and the errors
+  _random = None
+
+  # The counts of the 'calls', 'searches', 'languages', 'limited' and
+  # 'errors' answered
+  _counts = None
+
+  # The start of the current rate-limit window and its number of calls
+  _window = None
+
+  # The HTTP server
+  _server = None
+
+  # Lock guarding the counts, the window and the random generator
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, repositories, logger, latency=0.0, rateLimit=0,
+               errorRate=0.0, seed=0):
+    """Constructor that sets up the stand-in (which still has to be started)
+
+    Args:
+      repositories: The list of the repositories served (see makeRepositories)
+      logger: The custom logger to be used for the stand-in
+      latency: The number of seconds each response takes (before the jitter)
+      rateLimit: The maximum number of API calls per minute (0 is unlimited)
+      errorRate: The share of the API calls answered with a server error
+      seed: The seed of the jitter and the errors
+
+    """
+
+    self._repositories = repositories
+    self._repositoriesByName = dict(("%s/%s" %(repository['owner'],
+                                                repository['name']),
+                                     repository)
+                                    for repository in repositories)
+    self._latency = latency
+    self._rateLimit = rateLimit
+    self._errorRate = errorRate
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._logger = logger
+    self.resetCounts()
+
+  @property
+  def url(self):
+    """The URL of the API calls (for the --api-url option of the crawl)"""
+
+    return "http://127.0.0.1:%d/api/v2/json/repos/" %self._server.server_port
+
+  def start(self, port=0):
+    """Starts serving the API calls in the background
+
+    Args:
+      port: The port of the stand-in (by default a free one)
+
+    """
+
+    self._server = _ThreadingHTTPServer(("127.0.0.1", port),
+                                        _StubRequestHandler)
+    self._server.stubAPIHandler = self
+
+    thread = threading.Thread(target=self._server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self._logger.info("Stub API is served on %s" %self.url)
+
+  def close(self):
+    """Stops serving the API calls"""
+
+    self._server.shutdown()
+    self._server.server_close()
+
+  def resetCounts(self):
+    """Starts the counts (and the rate-limit window) over"""
+
+    with self._lock:
+      self._counts = {'calls': 0, 'searches': 0, 'languages': 0,
+                      'limited': 0, 'errors': 0}
+      self._window = [time.time(), 0]
+
+  def counts(self):
+    """Acquires the counts of the API calls answered
+
+    Returns:
+      A dictionary of the number of 'calls', 'searches', 'languages',
+      'limited' (rate-limited) and 'errors' (server errors)
+
+    """
+
+    with self._lock:
+      return dict(self._counts)
+
+  def respond(self, path):
+    """Forms the response of an API call
+
+    Args:
+      path: The path of the API call
+
+    Returns:
+      A tuple of the status, the dictionary of the headers and the body
+
+    """
+
+    with self._lock:
+      now = time.time()
+      self._counts['calls'] += 1
+
+      if now - self._window[0] >= 60:
+        self._window = [now, 0]
+      self._window[1] += 1
+
+      delay = self._latency * (1 + self._random.random() / 2)
+      error = self._random.random() < self._errorRate
+      limited = self._rateLimit > 0 and self._window[1] > self._rateLimit
+
+      headers = {}
+      if self._rateLimit > 0:
+        headers = {"X-RateLimit-Limit": str(self._rateLimit),
+                   "X-RateLimit-Remaining": str(max(0, self._rateLimit -
+                                                    self._window[1])),
+                   "X-RateLimit-Reset": str(int(self._window[0] + 60))}
+
+      if limited:
+        self._counts['limited'] += 1
+      elif error:
+        self._counts['errors'] += 1
+
+    time.sleep(delay)
+
+    if limited:
+      return 403, headers, '{"error": "Rate Limit Exceeded"}'
+    elif error:
+      return 500, headers, '{"error": "Internal Server Error"}'
+
+    match = re.search(r"/search/[^?]*\?.*start_page=(\d+)", path)
+    if match != None:
+      page = int(match.group(1))
+      first = (page - 1) * self.PAGE_SIZE
+      with self._lock:
+        self._counts['searches'] += 1
+      return 200, headers, json.dumps({'repositories': [
+          dict((key, value) for key, value in repository.iteritems()
+               if key != 'languages')
+          for repository in self._repositories[first:first +
+                                               self.PAGE_SIZE]]})
+
+    match = re.search(r"/show/([^/]+)/([^/]+)/languages$", path)
+    if match != None and "%s/%s" %match.groups() in self._repositoriesByName:
+      with self._lock:
+        self._counts['languages'] += 1
+      return 200, headers, json.dumps({'languages': self._repositoriesByName[
+          "%s/%s" %match.groups()]['languages']})
+
+    return 404, headers, '{"error": "Not Found"}'
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+
+  """This class is an HTTP server handling each connection in a thread"""
+
+  daemon_threads = True
+
+
+class _StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  """This class answers the API calls made to the stand-in"""
+
+  # Persistent connections, as the connection pool of the crawl expects
+  protocol_version = "HTTP/1.1"
+
+  def do_GET(self):
+    """Answers an API call, or a 304 when its ETag still matches"""
+
+    status, headers, body = self.server.stubAPIHandler.respond(self.path)
+
+    etag = '"%s"' %hashlib.sha1(body).hexdigest()
+    if status == 200 and self.headers.getheader("If-None-Match") == etag:
+      status = 304
+      body = ""
+
+    self.send_response(status)
+    for name, value in headers.iteritems():
+      self.send_header(name, value)
+    if status in (200, 304):
+      self.send_header("ETag", etag)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *arguments):
+    pass  # The API calls aren't logged
+
+
+def makeRepositories(count, languages, fixtures=None, seed=0):
+  """Makes up the repositories served by the stand-in of the API
+
+  Each repository gets the search fields of the API (ex: its 'size',
+  'watchers' and 'pushed_at') and 1 to 4 languages with their sizes. When
+  fixtures are given, the repositories are cloned from them (in turn, so
+  there can be fewer fixtures than repositories) and take their languages.
+
+  Args:
+    count: The number of repositories
+    languages: The list of languages the languages are taken from
+    fixtures: The list of fixtures (see makeFixtures), by default the
+              repositories can't be cloned
+    seed: The seed of the made up fields
+
+  Returns:
+    The list of the repositories, as dictionaries of their search fields and
+    their 'languages'
+
+  """
+
+  generator = random.Random(seed)
+  languages = [language for language in languages if language != ""]
+  repositories = []
+
+  for index in range(count):
+    owner = "owner%d" %(index % 97)
+    name = "repository%d" %index
+    repositoryLanguages = dict((language, generator.randint(1, 1 << 20))
+                               for language in generator.sample(languages,
+                                   generator.randint(1, 4)))
+    url = "https://github.com/%s/%s" %(owner, name)
+    size = sum(repositoryLanguages.itervalues()) / 1024
+
+    if fixtures:
+      fixture = fixtures[index % len(fixtures)]
+      url = fixture['url']
+      repositoryLanguages = fixture['languages']
+      size = fixture['size']
+
+    repositories.append({
+        'name': name, 'owner': owner, 'username': owner, 'url': url,
+        'type': "repo", 'description': "Benchmark repository %d" %index,
+        'homepage': "", 'language': max(repositoryLanguages,
+                                        key=repositoryLanguages.get),
+        'size': size, 'watchers': generator.randint(0, 5000),
+        'followers': generator.randint(0, 5000),
+        'forks': generator.randint(0, 500),
+        'open_issues': generator.randint(0, 100),
+        'fork': generator.random() < 0.2, 'private': False,
+        'has_downloads': True, 'has_issues': True, 'has_wiki': True,
+        'master_branch': "master", 'score': generator.random() * 10,
+        'created': "2010-%02d-01T10:00:00Z" %generator.randint(1, 12),
+        'created_at': "2010/%02d/01 10:00:00 -0700"
+                      %generator.randint(1, 12),
+        'pushed': "2011-%02d-01T10:00:00Z" %generator.randint(1, 12),
+        'pushed_at': "2011/%02d/01 10:00:00 -0700" %generator.randint(1, 12),
+        'languages': repositoryLanguages})
+
+  return repositories
+
+
+def makeFixtures(directory, count, files, fileSize, statement, logger,
+                 seed=0):
+  """Makes the bare git repositories that the benchmarks clone (over file://)
+
+  Each fixture is a bare repository with a single commit of source files of
+  its languages, a share of which contain the source statement. The fixtures
+  are written with git fast-import, and are reused by later benchmarks as
+  long as they were made with the same arguments.
+
+  Args:
+    directory: The directory of the fixtures
+    count: The number of fixtures
+    files: The number of source files of each fixture
+    fileSize: The size of each source file (in bytes)
+    statement: The source statement found in a third of the fixtures
+    logger: The custom logger to be used for this execution
+    seed: The seed of the contents of the fixtures
+
+  Returns:
+    The list of the fixtures, as dictionaries of their 'url', 'languages'
+    and 'size' (in KB)
+
+  """
+
+  manifestPath = os.path.join(directory, "fixtures.json")
+  arguments = [count, files, fileSize, statement, seed]
+
+  try:
+    with open(manifestPath) as manifestFile:
+      manifest = json.load(manifestFile)
+    if manifest['arguments'] == arguments:
+      return manifest['fixtures']
+  except (IOError, ValueError, KeyError):
+    pass
+
+  logger.info("Making %d fixtures in %s" %(count, directory))
+  generator = random.Random(seed)
+  languages = [language for language in clone_handler.LANGUAGE_EXTENSIONS
+               if language != ""]
+  fixtures = []
+
+  for index in range(count):
+    path = os.path.abspath(os.path.join(directory, "fixture%d.git" %index))
+    primary = generator.choice(languages)
+    secondary = generator.choice(languages)
+    matching = index % 3 == 0
+    stream = []
+    sizes = {}
+
+    for number in range(files):
+      language = primary if number % 4 != 3 else secondary
+      extension = clone_handler.LANGUAGE_EXTENSIONS[language][0]
+      content = _sourceFile(generator, fileSize,
+                            statement if matching and number == files - 1
+                            else None)
+      sizes[language] = sizes.get(language, 0) + len(content)
+      stream.append("M 644 inline src/file%d.%s\ndata %d\n%s\n"
+                    %(number, extension, len(content), content))
+
+    message = "Fixture %d\n" %index
+    stream.insert(0, "commit refs/heads/master\ncommitter Benchmark "
+                     "<benchmark@example.com> 1300000000 +0000\ndata %d\n%s"
+                     %(len(message), message))
+
+    _git(['init', '--bare', '--quiet', path])
+    _git(['--git-dir', path, 'fast-import', '--quiet'], "".join(stream))
+    _git(['--git-dir', path, 'symbolic-ref', 'HEAD', 'refs/heads/master'])
+
+    fixtures.append({'url': "file://" + path, 'languages': sizes,
+                     'size': files * fileSize / 1024})
+
+  with open(manifestPath, 'w') as manifestFile:
+    json.dump({'arguments': arguments, 'fixtures': fixtures}, manifestFile)
+
+  return fixtures
+
+
+def _sourceFile(generator, size, statement):
+  """Makes up the content of a source file
+
+  Args:
+    generator: The random generator of the content
+    size: The size of the content (in bytes)
+    statement: The source statement the content contains (or None)
+
+  Returns:
+    The content
+
+  """
+
+  words = ["int", "value", "return", "for", "index", "count", "if", "else",
+           "while", "result", "buffer", "length", "name", "item", "next"]
+  lines = []
+  length = 0
+
+  while length < size:
+    line = " ".join(generator.choice(words)
+                    for word in range(generator.randint(3, 10))) + ";"
+    lines.append(line)
+    length += len(line) + 1
+
+  if statement != None:
+    lines[len(lines) / 2] = "%s (lock) { count++; }" %statement
+
+  return "\n".join(lines)[:size]
+
+
+def _git(arguments, standardInput=None):
+  """Runs a git command
+
+  Args:
+    arguments: The arguments of the git command
+    standardInput: The data written to the standard input (optional)
+
+  Raises:
+    OSError: The git command failed
+
+  """
+
+  process = subprocess.Popen(['git'] + arguments, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  output, error = process.communicate(standardInput)
+
+  if process.returncode != 0:
+    raise OSError("git %s failed -> %s" %(arguments[0], error.strip()))
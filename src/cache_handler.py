@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+try: import simplejson as json
+except ImportError: import json
+
+# The fraction of the size limit that an eviction brings the cache down to,
+# so that the following stores don't each walk the cache again
+_EVICTION_TARGET = 0.9
+
+
+class CacheHandler():
+
+  """This class handles the on-disk cache of GitHub API responses
+
+  Each API response is stored in its own file, named after the SHA-1 of the
+  API call that produced it. A cache file holds a single line of metadata (the
+  API call, the ETag and Last-Modified validators and the time it was stored)
+  followed by the raw response body. Cached responses are revalidated with a
+  conditional request before being reused, and a revalidation only touches
+  the modification time of the file. Entries whose modification time is older
+  than the time to live are dropped, and the least recently used entries are
+  evicted whenever the cache grows past its size limit. The cache directory
+  can be shared by concurrent executions as files are only ever replaced
+  atomically.
+
+  """
+
+  # The directory where the cached responses are stored
+  _directory = None
+
+  # The number of seconds a cached response is kept
+  _timeToLive = None
+
+  # The maximum number of bytes the cache is allowed to take
+  _maxBytes = None
+
+  # The approximate number of bytes the cache currently takes
+  _currentBytes = 0
+
+  # Lock guarding the size bookkeeping and eviction
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, directory, timeToLive, maxBytes, logger):
+    """Constructor that prepares the cache directory
+
+    Args:
+      directory: The directory where the cached responses are stored
+      timeToLive: The number of seconds a cached response is kept
+      maxBytes: The maximum number of bytes the cache is allowed to take
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._directory = directory
+    self._timeToLive = timeToLive
+    self._maxBytes = maxBytes
+    self._lock = threading.Lock()
+    self._logger = logger
+
+    if not os.path.isdir(directory):
+      try: os.makedirs(directory)
+      except OSError: pass  # Another execution might have just created it
+
+    self._currentBytes = sum(size for path, size, mtime in self._entries())
+    self._logger.info("Cache Handler is ready for use (%d bytes cached)"
+                      %self._currentBytes)
+
+  def lookup(self, apiCall):
+    """Looks up the cached response of the API call
+
+    Args:
+      apiCall: The API call whose response is being looked up
+
+    Returns:
+      A dictionary with the 'body', 'etag' and 'lastModified' of the cached
+      response, or None if there is no usable cached response
+
+    """
+
+    path = self._path(apiCall)
+
+    try:
+      with open(path, 'rb') as cacheFile:
+        modified = os.fstat(cacheFile.fileno()).st_mtime
+        metadata = json.loads(cacheFile.readline())
+        body = cacheFile.read()
+    except (IOError, OSError, ValueError):
+      return None
+
+    # Drop responses that have outlived their time to live since they were
+    # stored or last revalidated
+    if time.time() - modified > self._timeToLive or \
+       metadata['apiCall'] != apiCall:
+      self._remove(path)
+      return None
+
+    return {'body': body, 'etag': metadata['etag'],
+            'lastModified': metadata['lastModified']}
+
+  def store(self, apiCall, body, etag, lastModified):
+    """Stores the response of the API call in the cache
+
+    Args:
+      apiCall: The API call that produced the response
+      body: The raw body of the response
+      etag: The ETag header of the response (or None)
+      lastModified: The Last-Modified header of the response (or None)
+
+    """
+
+    if etag == None and lastModified == None:
+      return  # Without validators the response can't be revalidated
+
+    path = self._path(apiCall)
+    metadata = json.dumps({'apiCall': apiCall, 'etag': etag,
+                           'lastModified': lastModified, 'stored': time.time()})
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+      try: os.makedirs(directory)
+      except OSError: pass
+
+    # Write to a temporary file first so readers never see a partial entry
+    descriptor, temporaryPath = tempfile.mkstemp(dir=directory)
+    with os.fdopen(descriptor, 'wb') as cacheFile:
+      cacheFile.write(metadata + "\n")
+      cacheFile.write(body)
+
+    # An overwritten response no longer takes its bytes
+    try: replacedBytes = os.stat(path).st_size
+    except OSError: replacedBytes = 0
+    os.rename(temporaryPath, path)
+
+    with self._lock:
+      self._currentBytes += len(metadata) + 1 + len(body) - replacedBytes
+
+    if self._currentBytes > self._maxBytes:
+      self._evict()
+
+  def refresh(self, apiCall):
+    """Marks the cached response of the API call as still being valid
+
+    Args:
+      apiCall: The API call whose cached response was revalidated
+
+    """
+
+    try: os.utime(self._path(apiCall), None)
+    except OSError: pass  # Evicted in the meantime
+
+  def _evict(self):
+    """Evicts the least recently used responses until the cache is down to
+    a fraction of its size limit (see _EVICTION_TARGET)
+
+    The size of the cache is recounted from disk first, since other executions
+    might be sharing the same cache directory.
+
+    """
+
+    with self._lock:
+      entries = sorted(self._entries(), key=lambda entry: entry[2])
+      self._currentBytes = sum(size for path, size, mtime in entries)
+
+      evicted = 0
+      for path, size, mtime in entries:
+        if self._currentBytes <= self._maxBytes * _EVICTION_TARGET:
+          break
+        self._remove(path)
+        self._currentBytes -= size
+        evicted += 1
+
+    self._logger.info("Evicted %d responses from the cache" %evicted)
+
+  def _entries(self):
+    """Lists the cached responses that are currently on disk
+
+    Returns:
+      A list of (path, size, modification time) tuples of the cache files
+
+    """
+
+    entries = []
+
+    for root, directories, files in os.walk(self._directory):
+      for name in files:
+        path = os.path.join(root, name)
+        try:
+          status = os.stat(path)
+          entries.append((path, status.st_size, status.st_mtime))
+        except OSError:
+          pass  # Removed by another execution in the meantime
+
+    return entries
+
+  def _remove(self, path):
+    """Removes a cached response, ignoring ones that are already gone
+
+    Args:
+      path: The path of the cache file to remove
+
+    """
+
+    try: os.remove(path)
+    except OSError: pass
+
+  def _path(self, apiCall):
+    """Determines the cache file of the API call
+
+    Args:
+      apiCall: The API call to find the cache file of
+
+    Returns:
+      The path of the cache file, which is spread over 256 subdirectories
+
+    """
+
+    key = hashlib.sha1(apiCall).hexdigest()
+    return os.path.join(self._directory, key[:2], key)
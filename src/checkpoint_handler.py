@@ -0,0 +1,234 @@
+import hashlib
+import os
+import threading
+import time
+import report_handler
+try: import simplejson as json
+except ImportError: import json
+
+
+class CheckpointHandler():
+
+  """This class handles the journal that makes a crawl resumable
+
+  Every step of the crawl is recorded in a journal file, one JSON record per
+  line: the pages that are claimed, the pages whose data is written to the
+  report, the end of the search results, and the outcome of each repository
+  (examined along with its report row, skipped, cloned, matched, cleaned).
+  When a crawl is resumed, the journal of the earlier crawl is loaded so the
+  finished work can be skipped: written pages are not requested again, and
+  repositories of the other pages reuse their examined data and are not
+  cloned again once their handling was completed. The journal is tied to the
+  search criteria, records of another search are ignored. Each fresh crawl
+  starts with a start record, so only the records of the last crawl of the
+  search are resumed (separately started processes share the journal).
+
+  """
+
+  # The outcomes that complete the handling of a repository
+  FINAL_OUTCOMES = ("skipped", "matched", "cleaned")
+
+  # The path of the journal file
+  _path = None
+
+  # The identifier of the search criteria the journal belongs to
+  _search = None
+
+  # Flag that indicates that an earlier crawl is being resumed
+  resuming = None
+
+  # The pages whose data was written to the report in the earlier crawl
+  _writtenPages = None
+
+  # The first page past the end of the search results (or None)
+  endPage = None
+
+  # The outcomes of the repositories in the earlier crawl, by unique name
+  _outcomes = None
+
+  # The report records of the examined repositories in the earlier crawl
+  _rows = None
+
+  # The file descriptor the journal is appended to
+  _descriptor = None
+
+  # Lock guarding the writes to the journal
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, path, language, keywords, resume, restart, start,
+               logger):
+    """Constructor that loads the earlier journal (when resuming)
+
+    Args:
+      path: The path of the journal file
+      language: The language for the search being conducted
+      keywords: The keywords for the search being conducted
+      resume: Flag that indicates that the earlier crawl is resumed
+      restart: Flag that indicates that the journal is started over (when not
+               resuming); separately started processes share the journal, so
+               they must not start it over themselves
+      start: Flag that indicates that this execution starts the crawl (when
+             not resuming), which is journaled so the records of the earlier
+             crawls aren't resumed (the first of the separately started
+             processes does this)
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._path = path
+    self._search = hashlib.sha1(language + "\n" + keywords).hexdigest()
+    self.resuming = resume
+    self._writtenPages = set()
+    self._outcomes = {}
+    self._rows = {}
+    self._lock = threading.Lock()
+    self._logger = logger
+
+    if resume:
+      self._load()
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+    if restart and not resume:
+      flags |= os.O_TRUNC
+    self._descriptor = os.open(path, flags, 0644)
+
+    if start and not resume:
+      self._record({'event': "start", 'time': int(time.time())})
+
+  def isPageWritten(self, page):
+    """Determines if the data of the page was written in the earlier crawl
+
+    Args:
+      page: The number of the page
+
+    Returns:
+      True if the page can be skipped, otherwise False
+
+    """
+
+    return page in self._writtenPages
+
+  def examinedRow(self, repository):
+    """Acquires the report record of a repository examined in the earlier
+    crawl
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      The RepositoryRecord of the repository, or None if it wasn't examined
+
+    """
+
+    return self._rows.get(repository['uniqueName'])
+
+  def outcome(self, repository):
+    """Acquires the outcome of a repository in the earlier crawl
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      The last recorded outcome of the repository, or None if there is none
+
+    """
+
+    return self._outcomes.get(repository['uniqueName'])
+
+  def recordPage(self, processNumber, page, event):
+    """Records an event of a page
+
+    Args:
+      processNumber: The ID of the process recording the event
+      page: The number of the page
+      event: The event of the page ('claimed', 'written' or 'end')
+
+    """
+
+    self._record({'worker': processNumber, 'page': page, 'event': event})
+
+  def recordOutcome(self, processNumber, page, repository, outcome, row=None):
+    """Records the outcome of handling a repository
+
+    Args:
+      processNumber: The ID of the process recording the outcome
+      page: The number of the page the repository is on
+      repository: The repository information in a JSON format (dictionary)
+      outcome: The outcome ('examined', 'skipped', 'cloned', 'matched',
+               'cleaned' or 'handled')
+      row: The RepositoryRecord of the repository (when it was examined)
+
+    """
+
+    record = {'worker': processNumber, 'page': page,
+              'repository': repository['uniqueName'], 'outcome': outcome}
+    if row != None:
+      record['record'] = row.toJournal()
+
+    self._record(record)
+
+  def close(self):
+    """Closes the journal"""
+
+    os.close(self._descriptor)
+
+  def _record(self, record):
+    """Appends a record to the journal with a single write
+
+    Args:
+      record: The dictionary of the record
+
+    """
+
+    record['search'] = self._search
+    line = json.dumps(record) + "\n"
+
+    with self._lock:
+      os.write(self._descriptor, line)
+
+  def _load(self):
+    """Loads the records of the earlier crawl from the journal"""
+
+    try:
+      journal = open(self._path, 'r')
+    except IOError:
+      self._logger.warn("There is no journal to resume the crawl from")
+      return
+
+    for line in journal:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue  # The last record might be cut off by the crash
+
+      if record.get('search') != self._search:
+        continue
+
+      # Only the records of the last crawl of the search are resumed
+      if record.get('event') == "start":
+        self._writtenPages.clear()
+        self._outcomes.clear()
+        self._rows.clear()
+        self.endPage = None
+        continue
+
+      if 'outcome' in record:
+        name = record['repository']
+        self._outcomes[name] = record['outcome']
+
+        if 'record' in record:
+          self._rows[name] = report_handler.RepositoryRecord.fromJournal(
+              record['record'])
+      elif record['event'] == "written":
+        self._writtenPages.add(record['page'])
+      elif record['event'] == "end":
+        if self.endPage == None or record['page'] < self.endPage:
+          self.endPage = record['page']
+
+    journal.close()
+    self._logger.info("Resuming crawl: %d pages written, %d repositories "
+                      "handled" %(len(self._writtenPages),
+                                  len(self._outcomes)))
@@ -0,0 +1,256 @@
+import re
+import subprocess
+
+# The source file extensions of each GitHub language
+LANGUAGE_EXTENSIONS = {
+    "ActionScript": ["as"], "Ada": ["adb", "ads", "ada"], "Arc": ["arc"],
+    "ASP": ["asp", "asax", "ascx", "ashx", "asmx", "aspx", "axd"],
+    "Assembly": ["asm", "s", "S"], "Boo": ["boo"], "C": ["c", "h"],
+    "C#": ["cs"], "C++": ["cpp", "cc", "cxx", "c++", "hpp", "hh", "hxx", "h"],
+    "Clojure": ["clj", "cljs"], "CoffeeScript": ["coffee"],
+    "ColdFusion": ["cfm", "cfc"], "Common Lisp": ["lisp", "lsp", "cl"],
+    "D": ["d", "di"], "Delphi": ["pas", "dpr", "dfm"],
+    "Duby": ["duby", "mirah"],
+    "Eiffel": ["e"], "Emacs Lisp": ["el"], "Erlang": ["erl", "hrl"],
+    "F#": ["fs", "fsi", "fsx"], "Factor": ["factor"],
+    "FORTRAN": ["f", "for", "f77", "f90", "f95"], "Go": ["go"],
+    "Groovy": ["groovy", "gvy", "gradle"], "Haskell": ["hs", "lhs"],
+    "HaXe": ["hx"], "Io": ["io"], "Java": ["java"], "JavaScript": ["js"],
+    "Lua": ["lua"], "Max/FMSP": ["mxt", "maxpat"], "Nu": ["nu"],
+    "Objective-C": ["m", "h"], "Objective-J": ["j", "sj"],
+    "OCaml": ["ml", "mli"], "ooc": ["ooc"], "Perl": ["pl", "pm", "t"],
+    "PHP": ["php", "php3", "php4", "php5", "phtml"], "Pure Data": ["pd"],
+    "Python": ["py", "pyw"], "R": ["r", "R"], "Racket": ["rkt", "rktl"],
+    "Ruby": ["rb", "rake", "gemspec"], "Scala": ["scala"],
+    "Scheme": ["scm", "ss"], "sclang": ["sc", "scd"], "Self": ["self"],
+    "Shell": ["sh", "bash", "zsh"], "Smalltalk": ["st"],
+    "SuperCollider": ["sc", "scd"], "Tcl": ["tcl"], "Vala": ["vala", "vapi"],
+    "Verilog": ["v", "vh"], "VHDL": ["vhd", "vhdl"], "VimL": ["vim"],
+    "Visual Basic": ["vb", "bas", "frm", "cls"], "XQuery": ["xq", "xquery"]}
+
+
+class CloneHandler():
+
+  """This class performs the git commands that clone a repository
+
+  In the full mode a shallow clone checks out every file of the repository.
+  In the sparse mode the clone is partial, the server leaves out the blobs
+  above the blob limit, and the checkout is sparse, restricted to the source
+  files of the primary language (or to every file when there is no primary
+  language). The paths of the left out blobs are excluded from the checkout as
+  well, so they are never fetched. This cuts the bytes transferred and written
+  for each repository when only its source is being searched. When a
+  MirrorHandler is given, the repository is cloned from its local mirror
+  instead, which only fetches what changed since the mirror was last used.
+
+  """
+
+  # The clone modes
+  FULL = "full"
+  SPARSE = "sparse"
+
+  # The clone mode being used
+  _mode = None
+
+  # The blob size limit of sparse clones (in git's notation, ex: 1m)
+  _blobLimit = None
+
+  # The sparse checkout patterns of the source files (or None for all files)
+  _sourcePatterns = None
+
+  # The mirror handler of the local store of mirrors (or None)
+  _mirrorHandler = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, mode, blobLimit, primaryLanguage, logger,
+               mirrorHandler=None):
+    """Constructor that sets the clone mode
+
+    Args:
+      mode: The clone mode (FULL or SPARSE)
+      blobLimit: The blob size limit of sparse clones (ex: 1m)
+      primaryLanguage: The primary language of the repositories (unescaped)
+      logger: The custom logger to be used for this executing process
+      mirrorHandler: The MirrorHandler of the local store of mirrors that the
+                     repositories are cloned from (by default they are
+                     cloned from their URL)
+
+    """
+
+    self._mode = mode
+    self._blobLimit = blobLimit
+    self._mirrorHandler = mirrorHandler
+    self._logger = logger
+
+    if primaryLanguage in LANGUAGE_EXTENSIONS:
+      self._sourcePatterns = ["*." + extension for extension in
+                              LANGUAGE_EXTENSIONS[primaryLanguage]]
+
+  def clone(self, url, directory, name=None):
+    """Clones a repository into a directory
+
+    Args:
+      url: The URL of the repository
+      directory: The directory the repository is cloned into
+      name: The name of the repository as 'owner/name', which is the name of
+            its mirror (required when there is a mirror handler)
+
+    Returns:
+      None if the clone succeeded, otherwise the error output of git
+
+    """
+
+    if self._mirrorHandler != None:
+      return self._mirrorClone(url, directory, name)
+
+    if self._mode == self.SPARSE:
+      return self._sparseClone(url, directory)
+
+    return self._git(['clone', '--depth', '1', url, directory])
+
+  def _sparseClone(self, url, directory):
+    """Makes a partial clone with a sparse checkout of the source files
+
+    Args:
+      url: The URL of the repository
+      directory: The directory the repository is cloned into
+
+    Returns:
+      None if the clone succeeded, otherwise the error output of git
+
+    """
+
+    error = self._git(['clone', '--depth', '1', '--no-checkout',
+                       '--filter=blob:limit=' + self._blobLimit, url,
+                       directory])
+    if error != None:
+      return error
+
+    # The blobs left out by the server are the ones above the blob limit
+    output, error = self._gitOutput(['-C', directory, 'rev-list', '--objects',
+                                     '--missing=print', 'HEAD'])
+    if error != None:
+      return error
+    missing = set(line[1:] for line in output.splitlines()
+                  if line.startswith("?"))
+
+    output, error = self._gitOutput(['-C', directory, 'ls-tree', '-r', '-z',
+                                     'HEAD'])
+    if error != None:
+      return error
+
+    excludedPaths = []
+    for entry in output.split("\0"):
+      if "\t" not in entry:
+        continue
+
+      information, path = entry.split("\t", 1)
+      if information.split()[2] in missing:
+        excludedPaths.append(path)
+
+    self._logger.info("Sparse checkout leaves out %d large files"
+                      %len(missing))
+
+    return self._sparseCheckout(directory, excludedPaths)
+
+  def _mirrorClone(self, url, directory, name):
+    """Clones a repository from its local mirror
+
+    The mirror is brought up to date first. The local clone hard links the
+    objects of the mirror, and its origin is pointed back at the URL. In the
+    sparse mode only the checkout is sparse, as the mirror has every blob.
+
+    Args:
+      url: The URL of the repository
+      directory: The directory the repository is cloned into
+      name: The name of the repository as 'owner/name'
+
+    Returns:
+      None if the clone succeeded, otherwise the error output of git
+
+    """
+
+    mirror, error = self._mirrorHandler.acquire(url, name)
+    if error != None:
+      return error
+
+    try:
+      arguments = ['clone', '--local', '--quiet', mirror, directory]
+      if self._mode == self.SPARSE:
+        arguments.insert(1, '--no-checkout')
+
+      error = self._git(arguments)
+    finally:
+      self._mirrorHandler.release(name)
+
+    if error != None:
+      return error
+
+    error = self._git(['-C', directory, 'remote', 'set-url', 'origin', url])
+    if error != None or self._mode != self.SPARSE:
+      return error
+
+    return self._sparseCheckout(directory, [])
+
+  def _sparseCheckout(self, directory, excludedPaths):
+    """Checks out the source files of a clone made without a checkout
+
+    Args:
+      directory: The directory of the clone
+      excludedPaths: The paths of the files left out of the checkout
+
+    Returns:
+      None if the checkout succeeded, otherwise the error output of git
+
+    """
+
+    patterns = list(self._sourcePatterns or ["/*"])
+    for path in excludedPaths:
+      patterns.append("!/" + re.sub(r"([\\*?\[!#])", r"\\\1", path))
+
+    error = self._git(['-C', directory, 'sparse-checkout', 'set', '--no-cone',
+                       '--stdin'], "\n".join(patterns) + "\n")
+    if error != None:
+      return error
+
+    return self._git(['-C', directory, 'checkout'])
+
+  def _git(self, arguments, input=None):
+    """Runs a git command
+
+    Args:
+      arguments: The list of arguments of the git command
+      input: The standard input of the git command (optional)
+
+    Returns:
+      None if the command succeeded, otherwise its error output
+
+    """
+
+    output, error = self._gitOutput(arguments, input)
+    return error
+
+  def _gitOutput(self, arguments, input=None):
+    """Runs a git command and captures its output
+
+    Args:
+      arguments: The list of arguments of the git command
+      input: The standard input of the git command (optional)
+
+    Returns:
+      A tuple of the standard output, and None if the command succeeded or
+      otherwise its error output
+
+    """
+
+    process = subprocess.Popen(['git'] + arguments, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               shell=False)
+    output, error = process.communicate(input)
+
+    if process.returncode != 0:
+      return output, error or "git exited with %d" %process.returncode
+
+    return output, None
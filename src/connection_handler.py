@@ -0,0 +1,954 @@
+import collections
+import cStringIO
+import errno
+import httplib
+import os
+import socket
+import ssl
+import threading
+import time
+import urlparse
+import loop_handler
+
+# The connection handler shared by everything in this process
+_sharedConnectionHandler = None
+
+# Lock guarding the creation of the shared connection handler
+_sharedLock = threading.Lock()
+
+
+def getConnectionHandler(poolSize, idleTimeout, logger):
+  """Acquires the connection handler that is shared by the whole process
+
+  The first caller creates the connection handler, every later caller receives
+  that same connection handler so all the executions in the process share the
+  persistent connections.
+
+  Args:
+    poolSize: The maximum number of connections per host
+    idleTimeout: The number of seconds an idle connection is kept open
+    logger: The custom logger to be used by the connection handler
+
+  Returns:
+    The ConnectionHandler shared by the whole process
+
+  """
+
+  global _sharedConnectionHandler
+
+  with _sharedLock:
+    if _sharedConnectionHandler == None:
+      _sharedConnectionHandler = ConnectionHandler(poolSize, idleTimeout,
+                                                   logger)
+
+  return _sharedConnectionHandler
+
+
+class ConnectionHandler():
+
+  """This class handles the persistent HTTP(S) connections to GitHub
+
+  Each host has its own pool of keep-alive connections, so the TCP and TLS
+  handshakes are only paid once per connection instead of once per request.
+  The number of connections per host is bounded by the pool size (callers
+  wait for a connection when they are all in use), and connections that have
+  been idle longer than the idle timeout are closed instead of being reused.
+  The handler is safe to share between threads, and it counts how many
+  requests reused a connection versus how many needed a new one.
+
+  """
+
+  # The number of bytes read at a time when streaming a response
+  _CHUNK_SIZE = 16384
+
+  # The maximum number of connections per host
+  _poolSize = None
+
+  # The number of seconds an idle connection is kept open
+  _idleTimeout = None
+
+  # The idle connections of each host, as (connection, last used) tuples
+  _idleConnections = None
+
+  # The semaphore of each host, bounding the connections to the pool size
+  _hostSemaphores = None
+
+  # The number of requests made over a new connection
+  _createdConnections = 0
+
+  # The number of requests made over a reused connection
+  _reusedConnections = 0
+
+  # Lock guarding the pools and the counters
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, poolSize, idleTimeout, logger):
+    """Constructor that sets up the empty pools
+
+    Args:
+      poolSize: The maximum number of connections per host
+      idleTimeout: The number of seconds an idle connection is kept open
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._poolSize = max(1, poolSize)
+    self._idleTimeout = idleTimeout
+    self._idleConnections = {}
+    self._hostSemaphores = {}
+    self._lock = threading.Lock()
+    self._logger = logger
+
+  def request(self, url, headers=None, maxRedirects=5):
+    """Makes a GET request over a pooled connection
+
+    Redirects are followed, and a request that fails on a reused connection
+    (that the server might have closed in the meantime) is retried once on a
+    new connection.
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers (optional)
+      maxRedirects: The maximum number of redirects to follow
+
+    Returns:
+      A tuple of the status code, the response headers (httplib.HTTPMessage)
+      and the response body
+
+    Raises:
+      socket.error: The connection to the host failed
+      httplib.HTTPException: The response of the host was invalid
+
+    """
+
+    for redirect in range(maxRedirects + 1):
+      status, responseHeaders, body = self._request(url, headers or {})
+
+      if status in (301, 302, 303, 307) and \
+         responseHeaders.getheader("Location") != None:
+        url = urlparse.urljoin(url, responseHeaders.getheader("Location"))
+      else:
+        break
+
+    return status, responseHeaders, body
+
+  def stream(self, url, headers=None, maxRedirects=5):
+    """Makes a GET request whose body is read in chunks as it arrives
+
+    Redirects are followed like with request. The connection is held until
+    the chunks are exhausted, or the generator of the chunks is closed (which
+    closes the connection instead of reusing it).
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers (optional)
+      maxRedirects: The maximum number of redirects to follow
+
+    Returns:
+      A tuple of the status code, the response headers (httplib.HTTPMessage)
+      and a generator of the chunks of the response body
+
+    Raises:
+      socket.error: The connection to the host failed
+      httplib.HTTPException: The response of the host was invalid
+
+    """
+
+    for redirect in range(maxRedirects + 1):
+      host, connection, response = self._open(url, headers or {})
+      chunks = self._chunks(host, connection, response)
+
+      if response.status in (301, 302, 303, 307) and \
+         response.getheader("Location") != None and redirect < maxRedirects:
+        "".join(chunks)
+        url = urlparse.urljoin(url, response.getheader("Location"))
+      else:
+        break
+
+    return response.status, response.msg, chunks
+
+  def statistics(self):
+    """Acquires the connection counters
+
+    Returns:
+      A dictionary with the number of 'created' and 'reused' connections
+
+    """
+
+    with self._lock:
+      return {'created': self._createdConnections,
+              'reused': self._reusedConnections}
+
+  def _request(self, url, headers):
+    """Makes a single GET request over a pooled connection
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers
+
+    Returns:
+      A tuple of the status code, the response headers and the response body
+
+    """
+
+    host, connection, response = self._open(url, headers)
+    body = "".join(self._chunks(host, connection, response))
+    return response.status, response.msg, body
+
+  def _open(self, url, headers):
+    """Sends a GET request over a pooled connection and reads its headers
+
+    The host's slot stays taken until the body is read by _chunks.
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers
+
+    Returns:
+      A tuple of the host, the connection and the response
+
+    """
+
+    parts = urlparse.urlsplit(url)
+    host = (parts.scheme, parts.hostname, parts.port)
+    path = parts.path or "/"
+    if parts.query:
+      path += "?" + parts.query
+
+    self._hostSemaphore(host).acquire()
+
+    try:
+      connection, reused = self._acquireConnection(host)
+
+      try:
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+      except (httplib.HTTPException, IOError):
+        connection.close()
+
+        if not reused:
+          raise
+
+        # The server closed the idle connection, so retry on a new one
+        connection, reused = self._newConnection(host), False
+        try:
+          connection.request("GET", path, headers=headers)
+          response = connection.getresponse()
+        except:
+          connection.close()
+          raise
+    except:
+      self._hostSemaphore(host).release()
+      raise
+
+    return host, connection, response
+
+  def _chunks(self, host, connection, response):
+    """Reads the body of a response in chunks, then releases the connection
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+      connection: The connection the response is read from
+      response: The response
+
+    Returns:
+      The iterator of the chunks of the body (a _ResponseChunks)
+
+    """
+
+    def release(complete):
+      if complete and not response.will_close:
+        self._releaseConnection(host, connection)
+      else:
+        connection.close()
+
+      self._hostSemaphore(host).release()
+
+    return _ResponseChunks(response, self._CHUNK_SIZE, release)
+
+  def _hostSemaphore(self, host):
+    """Acquires the semaphore that bounds the connections to a host
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    Returns:
+      The semaphore of the host
+
+    """
+
+    with self._lock:
+      if host not in self._hostSemaphores:
+        self._hostSemaphores[host] = threading.BoundedSemaphore(self._poolSize)
+      return self._hostSemaphores[host]
+
+  def _acquireConnection(self, host):
+    """Acquires an idle connection to the host, or opens a new one
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    Returns:
+      A tuple of the connection and whether it is being reused
+
+    """
+
+    expired = []
+
+    with self._lock:
+      idleConnections = self._idleConnections.setdefault(host, [])
+
+      while len(idleConnections) > 0:
+        connection, lastUsed = idleConnections.pop()
+
+        if time.time() - lastUsed < self._idleTimeout:
+          self._reusedConnections += 1
+          break
+
+        expired.append(connection)
+      else:
+        connection = None
+
+    for expiredConnection in expired:
+      expiredConnection.close()
+
+    if connection != None:
+      return connection, True
+    else:
+      return self._newConnection(host), False
+
+  def _newConnection(self, host):
+    """Opens a new connection to the host
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    Returns:
+      The new (not yet connected) connection
+
+    """
+
+    scheme, hostname, port = host
+
+    with self._lock:
+      self._createdConnections += 1
+
+    self._logger.debug("Opening new connection to %s" %hostname)
+
+    if scheme == "https":
+      return httplib.HTTPSConnection(hostname, port, timeout=60)
+    else:
+      return httplib.HTTPConnection(hostname, port, timeout=60)
+
+  def _releaseConnection(self, host, connection):
+    """Returns a connection to the pool of idle connections of the host
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+      connection: The connection that can be reused
+
+    """
+
+    with self._lock:
+      idleConnections = self._idleConnections.setdefault(host, [])
+
+      if len(idleConnections) < self._poolSize:
+        idleConnections.append((connection, time.time()))
+        return
+
+    connection.close()
+
+
+class _ResponseChunks():
+
+  """This class iterates over the chunks of a response body as they arrive
+
+  Once the body is read (or the iteration is closed before that, or fails)
+  the connection is handed back exactly once: kept for reuse when the body
+  was read completely, otherwise closed.
+
+  """
+
+  # The response being read
+  _response = None
+
+  # The number of bytes read at a time
+  _chunkSize = None
+
+  # The function releasing the connection, given whether the body was read
+  _release = None
+
+  def __init__(self, response, chunkSize, release):
+    """Constructor that sets the response being read
+
+    Args:
+      response: The response being read
+      chunkSize: The number of bytes read at a time
+      release: The function releasing the connection, given whether the body
+               was read completely
+
+    """
+
+    self._response = response
+    self._chunkSize = chunkSize
+    self._release = release
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    """Reads the next chunk of the body
+
+    Returns:
+      The next chunk (StopIteration is raised once the body is read)
+
+    """
+
+    if self._release == None:
+      raise StopIteration()
+
+    try:
+      chunk = self._response.read(self._chunkSize)
+    except:
+      self._finish(False)
+      raise
+
+    if not chunk:
+      self._finish(True)
+      raise StopIteration()
+
+    return chunk
+
+  def close(self):
+    """Stops reading the body, closing the connection if it isn't read"""
+
+    self._finish(False)
+
+  def _finish(self, complete):
+    """Releases the connection once
+
+    Args:
+      complete: Flag that indicates the body was read completely
+
+    """
+
+    if self._release != None:
+      release, self._release = self._release, None
+      release(complete)
+
+
+class AsyncConnectionHandler():
+
+  """This class handles the persistent HTTP(S) connections of an event loop
+
+  This connection handler works like the ConnectionHandler, except that its
+  requests are coroutines running on an EventLoop, over non-blocking
+  sockets. Requests beyond the pool size of a host wait in line for a
+  connection without holding a thread, so any number of requests can be in
+  flight while the number of connections stays bounded. Host names are
+  resolved before connecting, which blocks the loop briefly for each new
+  connection.
+
+  """
+
+  # The number of seconds a socket operation may take
+  _TIMEOUT = 60
+
+  # The event loop the requests run on
+  _loop = None
+
+  # The maximum number of connections per host
+  _poolSize = None
+
+  # The number of seconds an idle connection is kept open
+  _idleTimeout = None
+
+  # The idle connections of each host, as (connection, last used) tuples
+  _idleConnections = None
+
+  # The number of connections in use of each host
+  _busyConnections = None
+
+  # The requests waiting for a connection of each host (futures)
+  _waiters = None
+
+  # The number of requests made over a new connection
+  _createdConnections = 0
+
+  # The number of requests made over a reused connection
+  _reusedConnections = 0
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, loop, poolSize, idleTimeout, logger):
+    """Constructor that sets up the empty pools
+
+    Args:
+      loop: The EventLoop the requests run on
+      poolSize: The maximum number of connections per host
+      idleTimeout: The number of seconds an idle connection is kept open
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._loop = loop
+    self._poolSize = max(1, poolSize)
+    self._idleTimeout = idleTimeout
+    self._idleConnections = {}
+    self._busyConnections = {}
+    self._waiters = {}
+    self._logger = logger
+
+  def request(self, url, headers=None, maxRedirects=5):
+    """Makes a GET request over a pooled connection (a coroutine)
+
+    Redirects are followed, and a request that fails on a reused connection
+    (that the server might have closed in the meantime) is retried once on a
+    new connection.
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers (optional)
+      maxRedirects: The maximum number of redirects to follow
+
+    Returns:
+      A tuple of the status code, the response headers (httplib.HTTPMessage)
+      and the response body
+
+    Raises:
+      socket.error: The connection to the host failed
+      httplib.HTTPException: The response of the host was invalid
+
+    """
+
+    for redirect in range(maxRedirects + 1):
+      status, responseHeaders, body = yield self._request(url, headers or {})
+
+      if status in (301, 302, 303, 307) and \
+         responseHeaders.getheader("Location") != None:
+        url = urlparse.urljoin(url, responseHeaders.getheader("Location"))
+      else:
+        break
+
+    raise loop_handler.Return((status, responseHeaders, body))
+
+  def statistics(self):
+    """Acquires the connection counters
+
+    Returns:
+      A dictionary with the number of 'created' and 'reused' connections
+
+    """
+
+    return {'created': self._createdConnections,
+            'reused': self._reusedConnections}
+
+  def _request(self, url, headers):
+    """Makes a single GET request over a pooled connection (a coroutine)
+
+    Args:
+      url: The URL to request
+      headers: The dictionary of extra request headers
+
+    Returns:
+      A tuple of the status code, the response headers and the response body
+
+    """
+
+    parts = urlparse.urlsplit(url)
+    host = (parts.scheme, parts.hostname, parts.port)
+    path = parts.path or "/"
+    if parts.query:
+      path += "?" + parts.query
+
+    lines = ["GET %s HTTP/1.1" %path, "Host: %s" %parts.netloc,
+             "Accept-Encoding: identity"]
+    lines.extend("%s: %s" %header for header in headers.items())
+    request = "\r\n".join(lines) + "\r\n\r\n"
+
+    connection, reused = yield self._acquireConnection(host)
+
+    try:
+      try:
+        yield connection.sendAll(request)
+        response = yield connection.readResponse()
+      except (httplib.HTTPException, IOError):
+        connection.close()
+
+        if not reused:
+          raise
+
+        # The server closed the idle connection, so retry on a new one
+        connection, reused = self._newConnection(host), False
+        yield connection.sendAll(request)
+        response = yield connection.readResponse()
+    except Exception:
+      connection.close()
+      self._releaseSlot(host)
+      raise
+
+    status, responseHeaders, body, willClose = response
+
+    if willClose:
+      connection.close()
+      self._releaseSlot(host)
+    else:
+      self._releaseConnection(host, connection)
+
+    raise loop_handler.Return((status, responseHeaders, body))
+
+  def _acquireConnection(self, host):
+    """Acquires an idle connection to the host, or a new one (a coroutine)
+
+    When every connection of the host is in use, the request waits in line
+    until one is released.
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    Returns:
+      A tuple of the connection and whether it is being reused
+
+    """
+
+    if self._busyConnections.get(host, 0) >= self._poolSize:
+      waiter = loop_handler.Future()
+      self._waiters.setdefault(host, collections.deque()).append(waiter)
+      yield waiter  # The releasing request hands its slot over
+    else:
+      self._busyConnections[host] = self._busyConnections.get(host, 0) + 1
+
+    idleConnections = self._idleConnections.setdefault(host, [])
+
+    while len(idleConnections) > 0:
+      connection, lastUsed = idleConnections.pop()
+
+      if time.time() - lastUsed < self._idleTimeout:
+        self._reusedConnections += 1
+        raise loop_handler.Return((connection, True))
+
+      connection.close()
+
+    raise loop_handler.Return((self._newConnection(host), False))
+
+  def _newConnection(self, host):
+    """Makes a new connection to the host (connected on its first request)
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    Returns:
+      The new connection
+
+    """
+
+    self._createdConnections += 1
+    self._logger.debug("Opening new connection to %s" %host[1])
+
+    return _AsyncConnection(self._loop, host, self._TIMEOUT)
+
+  def _releaseConnection(self, host, connection):
+    """Returns a connection to the pool of idle connections of the host
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+      connection: The connection that can be reused
+
+    """
+
+    idleConnections = self._idleConnections.setdefault(host, [])
+
+    if len(idleConnections) < self._poolSize:
+      idleConnections.append((connection, time.time()))
+    else:
+      connection.close()
+
+    self._releaseSlot(host)
+
+  def _releaseSlot(self, host):
+    """Releases a connection slot of the host, to the next request in line
+
+    Args:
+      host: The (scheme, hostname, port) tuple of the host
+
+    """
+
+    waiters = self._waiters.get(host)
+
+    if waiters:
+      waiters.popleft().setResult(None)
+    else:
+      self._busyConnections[host] -= 1
+
+
+class _AsyncConnection():
+
+  """This class is a single non-blocking HTTP(S) connection to a host
+
+  The connection is made on the first request, and its responses are read
+  through a buffer. Every method that does I/O is a coroutine.
+
+  """
+
+  # The event loop the connection runs on
+  _loop = None
+
+  # The (scheme, hostname, port) tuple of the host
+  _host = None
+
+  # The number of seconds a socket operation may take
+  _timeout = None
+
+  # The socket of the connection (None until it is connected)
+  _socket = None
+
+  # The data received but not read yet
+  _buffer = ""
+
+  def __init__(self, loop, host, timeout):
+    """Constructor that sets the host of the connection
+
+    Args:
+      loop: The EventLoop the connection runs on
+      host: The (scheme, hostname, port) tuple of the host
+      timeout: The number of seconds a socket operation may take
+
+    """
+
+    self._loop = loop
+    self._host = host
+    self._timeout = timeout
+
+  def close(self):
+    """Closes the connection"""
+
+    if self._socket != None:
+      self._socket.close()
+      self._socket = None
+
+  def sendAll(self, data):
+    """Sends all the data, connecting first if needed (a coroutine)
+
+    Args:
+      data: The data to send
+
+    """
+
+    if self._socket == None:
+      yield self._connect()
+
+    while data:
+      try:
+        data = data[self._socket.send(data):]
+      except socket.error, e:
+        yield self._waitFor(e)
+
+  def readResponse(self):
+    """Reads a response (a coroutine)
+
+    Returns:
+      A tuple of the status code, the response headers (httplib.HTTPMessage),
+      the response body and whether the connection must be closed
+
+    Raises:
+      httplib.HTTPException: The response is invalid
+
+    """
+
+    statusLine = yield self._readLine()
+    try:
+      version, status = statusLine.split(None, 2)[:2]
+      status = int(status)
+      if not version.startswith("HTTP/"):
+        raise ValueError()
+    except ValueError:
+      raise httplib.BadStatusLine(statusLine)
+
+    headerLines = []
+    while True:
+      line = yield self._readLine()
+      if line in ("\r\n", "\n", ""):
+        break
+      headerLines.append(line)
+
+    headers = httplib.HTTPMessage(cStringIO.StringIO("".join(headerLines)))
+    connection = (headers.getheader("Connection") or "").lower()
+    willClose = "close" in connection or \
+                (version == "HTTP/1.0" and "keep-alive" not in connection)
+
+    if status in (204, 304) or 100 <= status < 200:
+      body = ""
+    elif "chunked" in (headers.getheader("Transfer-Encoding") or "").lower():
+      body = yield self._readChunked()
+    elif headers.getheader("Content-Length") != None:
+      try:
+        length = int(headers.getheader("Content-Length"))
+      except ValueError:
+        raise httplib.HTTPException("Invalid Content-Length")
+      body = yield self._readExactly(length)
+    else:
+      body = yield self._readUntilClose()
+      willClose = True
+
+    raise loop_handler.Return((status, headers, body, willClose))
+
+  def _connect(self):
+    """Connects to the host, with a TLS handshake for https (a coroutine)"""
+
+    scheme, hostname, port = self._host
+    if port == None:
+      port = 443 if scheme == "https" else 80
+
+    family, socketType, protocol, name, address = socket.getaddrinfo(
+        hostname, port, 0, socket.SOCK_STREAM)[0]
+    connection = socket.socket(family, socketType, protocol)
+    connection.setblocking(0)
+    self._socket = connection
+
+    error = connection.connect_ex(address)
+    if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+      raise socket.error(error, os.strerror(error))
+
+    yield self._loop.waitWritable(connection.fileno(), self._timeout)
+    error = connection.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if error != 0:
+      raise socket.error(error, os.strerror(error))
+
+    if scheme == "https":
+      self._socket = ssl.create_default_context().wrap_socket(connection,
+          server_hostname=hostname, do_handshake_on_connect=False)
+
+      while True:
+        try:
+          self._socket.do_handshake()
+          break
+        except socket.error, e:
+          yield self._waitFor(e)
+
+  def _waitFor(self, error):
+    """Waits for the socket to be ready after a non-blocking operation
+
+    Args:
+      error: The error of the operation that couldn't be completed
+
+    Returns:
+      A future that is done once the socket is ready (the error is raised
+      again when it isn't about the operation blocking)
+
+    """
+
+    if isinstance(error, ssl.SSLWantWriteError):
+      return self._loop.waitWritable(self._socket.fileno(), self._timeout)
+    elif isinstance(error, ssl.SSLWantReadError):
+      return self._loop.waitReadable(self._socket.fileno(), self._timeout)
+    elif error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+      return self._loop.waitWritable(self._socket.fileno(), self._timeout)
+
+    raise error
+
+  def _receive(self):
+    """Receives more data into the buffer (a coroutine)
+
+    Returns:
+      False if the host closed the connection, otherwise True
+
+    """
+
+    while True:
+      try:
+        data = self._socket.recv(65536)
+        break
+      except socket.error, e:
+        if not isinstance(e, ssl.SSLError) and \
+           e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+          yield self._loop.waitReadable(self._socket.fileno(), self._timeout)
+        else:
+          yield self._waitFor(e)
+
+    self._buffer += data
+    raise loop_handler.Return(len(data) > 0)
+
+  def _readLine(self):
+    """Reads a line (a coroutine)
+
+    Returns:
+      The line including its line break, or what is left when the host
+      closed the connection
+
+    """
+
+    while "\n" not in self._buffer:
+      received = yield self._receive()
+      if not received:
+        line, self._buffer = self._buffer, ""
+        raise loop_handler.Return(line)
+
+    index = self._buffer.index("\n") + 1
+    line, self._buffer = self._buffer[:index], self._buffer[index:]
+    raise loop_handler.Return(line)
+
+  def _readExactly(self, length):
+    """Reads an exact number of bytes (a coroutine)
+
+    Args:
+      length: The number of bytes to read
+
+    Returns:
+      The bytes that were read
+
+    """
+
+    while len(self._buffer) < length:
+      received = yield self._receive()
+      if not received:
+        raise httplib.IncompleteRead(self._buffer, length - len(self._buffer))
+
+    data, self._buffer = self._buffer[:length], self._buffer[length:]
+    raise loop_handler.Return(data)
+
+  def _readChunked(self):
+    """Reads a body in the chunked transfer encoding (a coroutine)
+
+    Returns:
+      The body
+
+    """
+
+    chunks = []
+
+    while True:
+      line = yield self._readLine()
+      try:
+        length = int(line.split(";", 1)[0].strip(), 16)
+      except ValueError:
+        raise httplib.HTTPException("Invalid chunk size")
+
+      if length == 0:
+        break
+
+      chunks.append((yield self._readExactly(length)))
+      yield self._readLine()
+
+    # Skip the trailers
+    while (yield self._readLine()) not in ("\r\n", "\n", ""):
+      pass
+
+    raise loop_handler.Return("".join(chunks))
+
+  def _readUntilClose(self):
+    """Reads everything until the host closes the connection (a coroutine)
+
+    Returns:
+      The data that was read
+
+    """
+
+    while (yield self._receive()):
+      pass
+
+    data, self._buffer = self._buffer, ""
+    raise loop_handler.Return(data)
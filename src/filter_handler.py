@@ -0,0 +1,139 @@
+import re
+from datetime import date, datetime
+
+# The date at the start of the pushed fields (ex: 2011/03/01 10:00:00 -0700
+# in API v2, or 2011-03-01T10:00:00Z)
+_DATE = re.compile(r"(\d{4})[/-](\d{2})[/-](\d{2})")
+
+
+def parseDate(value):
+  """Parses a date given as YYYY-MM-DD (an argparse type)
+
+  Args:
+    value: The date as a string
+
+  Returns:
+    The date
+
+  Raises:
+    ValueError: The date isn't valid
+
+  """
+
+  return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class FilterHandler():
+
+  """This class filters the repositories on the fields of the search results
+
+  The search results already carry the size, fork flag, last push date and
+  watchers of each repository, so the repositories that would be discarded
+  anyway are filtered out before their language API call or their clone.
+  A field that a search result doesn't carry doesn't filter the repository
+  out. Each criterion is optional.
+
+  """
+
+  # The minimum size of the repositories (in KB, as given by the API)
+  _minSize = None
+
+  # The maximum size of the repositories (in KB)
+  _maxSize = None
+
+  # Flag that indicates that forks are filtered out
+  _skipForks = None
+
+  # The date the repositories must have been pushed to after
+  _pushedAfter = None
+
+  # The minimum number of watchers of the repositories
+  _minWatchers = None
+
+  def __init__(self, minSize=None, maxSize=None, skipForks=False,
+               pushedAfter=None, minWatchers=None):
+    """Constructor that sets the criteria
+
+    Args:
+      minSize: The minimum size of the repositories in KB (optional)
+      maxSize: The maximum size of the repositories in KB (optional)
+      skipForks: Flag that indicates that forks are filtered out
+      pushedAfter: The date the repositories must have been pushed to after
+                   (optional)
+      minWatchers: The minimum number of watchers of the repositories
+                   (optional)
+
+    """
+
+    self._minSize = minSize
+    self._maxSize = maxSize
+    self._skipForks = skipForks
+    self._pushedAfter = pushedAfter
+    self._minWatchers = minWatchers
+
+  def isFiltering(self):
+    """Determines if any criterion is set
+
+    Returns:
+      True if repositories can be filtered out, otherwise False
+
+    """
+
+    return self._minSize != None or self._maxSize != None or \
+           self._skipForks or self._pushedAfter != None or \
+           self._minWatchers != None
+
+  def rejection(self, repository):
+    """Determines why a repository is filtered out
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      The criterion the repository fails ('size', 'fork', 'pushed' or
+      'watchers'), or None if the repository passes
+
+    """
+
+    size = repository.get('size')
+    if size != None:
+      if self._minSize != None and size < self._minSize:
+        return "size"
+      if self._maxSize != None and size > self._maxSize:
+        return "size"
+
+    if self._skipForks and repository.get('fork') in (True, "true"):
+      return "fork"
+
+    if self._pushedAfter != None:
+      pushed = self._pushedDate(repository)
+      if pushed != None and pushed <= self._pushedAfter:
+        return "pushed"
+
+    watchers = repository.get('watchers')
+    if self._minWatchers != None and watchers != None and \
+       watchers < self._minWatchers:
+      return "watchers"
+
+    return None
+
+  def _pushedDate(self, repository):
+    """Acquires the date a repository was last pushed to
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      The date, or None if the repository doesn't carry it
+
+    """
+
+    for field in ('pushed_at', 'pushed'):
+      match = _DATE.match(unicode(repository.get(field) or ""))
+      if match != None:
+        try:
+          return date(*[int(part) for part in match.groups()])
+        except ValueError:
+          pass
+
+    return None
@@ -1,6 +1,14 @@
 import argparse
 import logging
+import os
+import time
+import checkpoint_handler
+import filter_handler
+import metrics_handler
+import report_handler
 import repository_handler
+import statement_handler
+import store_handler
 
 
 class GitHubExplorer():
@@ -36,7 +44,8 @@ class GitHubExplorer():
   _logger = None
 
   def __init__(self, primaryLanguage, keywords, sourceStatements, clone,
-               processNumber, maxProcesses, writeLog, logger=None):
+               processNumber, maxProcesses, writeLog, logger=None,
+               **crawlOptions):
     """Constructor that initializes the GitHubExplorer
 
     This constructor uses the specified parameters when setting up the rest of
@@ -53,6 +62,14 @@ class GitHubExplorer():
       maxProcesses: The maximum number of concurrent processes executing
       writeLog: Flag that indicates that the log file should be written out
       logger: The custom logger to be used for this executing process
+      crawlOptions: The tuning options of the crawl, passed on as keyword
+                    arguments to the RepositoryHandler (apart from 'resume'
+                    and 'journalFile', which set up the CheckpointHandler
+                    when none is given, 'reportFormat', which is the format
+                    of the report written when no report queue is given,
+                    'metricsFile', 'metricsInterval' and 'metricsPort',
+                    which expose the metrics of this execution, and
+                    'engine', which picks the crawl of the RepositoryHandler)
 
     """
 
@@ -88,37 +105,502 @@ class GitHubExplorer():
                         %(primaryLanguage))
       primaryLanguage = ""
 
-    primaryLanguage = self._cleanInput(primaryLanguage)  # Must clean the input
-    keywords = '+'.join(keywords.split())  # Join words with +
-    sourceStatements = '|'.join(sourceStatements.split())  # Join words with |
+    engine = crawlOptions.pop('engine', "thread")
+    reportFormat = crawlOptions.pop('reportFormat', "csv")
+    metricsFile = crawlOptions.pop('metricsFile', None)
+    metricsInterval = crawlOptions.pop('metricsInterval', 10)
+    metricsPort = crawlOptions.pop('metricsPort', None)
+
+    # Without a shared journal, this execution journals its own crawl
+    resume = crawlOptions.pop('resume', False)
+    journalFile = crawlOptions.pop('journalFile', None)
+    if crawlOptions.get('checkpointHandler') == None and journalFile != None:
+      crawlOptions['checkpointHandler'] = checkpoint_handler. \
+          CheckpointHandler(journalFile, primaryLanguage, keywords, resume,
+                            maxProcesses == 1, processNumber == 1,
+                            self._logger)
+
+    primaryLanguage, keywords, sourceStatements = formatQuery(primaryLanguage,
+        keywords, sourceStatements)
+
+    # Without a shared report writer, this execution writes its own report
+    reportWriter = None
+    if crawlOptions.get('reportQueue') == None:
+      fileName = report_handler.REPORT_FORMATS[reportFormat].FILE_NAME
+      if maxProcesses > 1 and \
+         not report_handler.REPORT_FORMATS[reportFormat].SHARED:
+        root, extension = os.path.splitext(fileName)
+        fileName = "%s_%d%s" %(root, processNumber, extension)
+
+      reportWriter = report_handler.ReportWriter(reportHeaders(
+          sourceStatements, clone, crawlOptions.get('statementStats')),
+          self._languages, self._logger, append=resume or maxProcesses > 1,
+          fileName=fileName,
+          checkpointHandler=crawlOptions.get('checkpointHandler'),
+          reportFormat=reportFormat)
+      reportWriter.start()
+      crawlOptions['reportQueue'] = reportWriter.queue
+
+    # Manually started executions each expose the metrics of their own crawl
+    metricsReporter = None
+    if metricsFile != None or metricsPort != None:
+      if metricsFile != None and maxProcesses > 1:
+        root, extension = os.path.splitext(metricsFile)
+        metricsFile = "%s_%d%s" %(root, processNumber, extension)
+      if metricsPort != None and maxProcesses > 1:
+        metricsPort += processNumber - 1
+
+      metricsReporter = metrics_handler.MetricsReporter(
+          metrics_handler.getMetricsHandler(), metricsFile, metricsInterval,
+          metricsPort, self._logger)
+      metricsReporter.start()
 
     # Create the repository handler and start crawling
     self._logger.info("GitHub Explorer is about to commence its search")
     repositoryHandler = repository_handler.RepositoryHandler(self._headers,
         self._languages, primaryLanguage, keywords, sourceStatements, clone,
-        processNumber, maxProcesses, logger)
-    repositoryHandler.crawlRepositories()
+        processNumber, maxProcesses, logger, **crawlOptions)
 
-  def _cleanInput(self, input):
-    """Cleans the input from special characters
+    try:
+      if engine == "loop":
+        repositoryHandler.crawlRepositoriesAsync()
+      else:
+        repositoryHandler.crawlRepositories()
+    finally:
+      if reportWriter != None:
+        reportWriter.close()
+      if metricsReporter != None:
+        metricsReporter.close()
 
-    GitHub's language parameter can have special characters that can break the
-    search functionality, thus they must be cleaned first.
 
-    Args:
-      input: The string that will be cleansed from special characters
+def formatQuery(primaryLanguage, keywords, sourceStatements):
+  """Formats the search criteria as the RepositoryHandler takes them
 
-    Returns:
-      The input that has been cleansed from special characters
+  Args:
+    primaryLanguage: A filter of the primary language for the repositories
+    keywords: Filter of keywords for the repositories (space separated)
+    sourceStatements: Filter of source statements for the repositories (space
+                      separated)
+
+  Returns:
+    A tuple of the cleaned primary language, the keywords joined with '+' and
+    the source statements joined with '|'
+
+  """
+
+  primaryLanguage = _cleanInput(primaryLanguage)  # Must clean the input
+  keywords = '+'.join(keywords.split())  # Join words with +
+  sourceStatements = '|'.join(sourceStatements.split())  # Join words with |
+
+  return primaryLanguage, keywords, sourceStatements
+
+
+def reportHeaders(sourceStatements, clone, statementStats):
+  """Forms the header fields of the report of a crawl
+
+  Args:
+    sourceStatements: The source statements of the crawl ('|' separated)
+    clone: Flag that indicates repositories are cloned
+    statementStats: Flag that indicates the statistics of the source
+                    statements are reported
+
+  Returns:
+    The list of header fields, followed by the headers of the statistics of
+    the source statements when the cloned repositories are searched for them
+
+  """
+
+  headers = list(GitHubExplorer._headers)
+  if statementStats and clone and sourceStatements != "":
+    headers += statement_handler.statisticsHeaders(sourceStatements.split('|'))
+
+  return headers
 
-    """
 
-    input = input.replace(":", "%3A")
-    input = input.replace("/", "%2F")
-    input = input.replace("#", "%23")
-    input = input.replace("+", "%2B")
+def _cleanInput(input):
+  """Cleans the input from special characters
 
-    return input
+  GitHub's language parameter can have special characters that can break the
+  search functionality, thus they must be cleaned first.
+
+  Args:
+    input: The string that will be cleansed from special characters
+
+  Returns:
+    The input that has been cleansed from special characters
+
+  """
+
+  input = input.replace(":", "%3A")
+  input = input.replace("/", "%2F")
+  input = input.replace("#", "%23")
+  input = input.replace("+", "%2B")
+
+  return input
+
+
+def addCrawlArguments(parser):
+  """Adds the arguments of the crawl tuning options to the parser
+
+  The tuning options are shared by the GitHub Explorer program and its driver,
+  and are turned into the keyword arguments of the RepositoryHandler using
+  getCrawlOptions.
+
+  Args:
+    parser: The argparse.ArgumentParser to add the arguments to
+
+  """
+
+  parser.add_argument(
+      '--language-workers',
+      action='store',
+      type=int,
+      default=10,
+      dest='languageWorkers',
+      help="The number of concurrent language API calls made for each page "
+           "of repositories")
+  parser.add_argument(
+      '--api-rate',
+      action='store',
+      type=float,
+      default=0,
+      dest='apiRate',
+      help="The maximum number of API calls per minute, shared by all the "
+           "executions within a process (0 is unlimited)")
+  parser.add_argument(
+      '--cache-dir',
+      action='store',
+      default=None,
+      dest='cacheDirectory',
+      help="Enables the on-disk cache of API responses in the given "
+           "directory (responses are revalidated before being reused)")
+  parser.add_argument(
+      '--cache-ttl',
+      action='store',
+      type=int,
+      default=604800,
+      dest='cacheTimeToLive',
+      help="The number of seconds a cached API response is kept")
+  parser.add_argument(
+      '--cache-size',
+      action='store',
+      type=int,
+      default=512,
+      dest='cacheSize',
+      help="The maximum size of the API response cache in megabytes")
+  parser.add_argument(
+      '--pool-size',
+      action='store',
+      type=int,
+      default=10,
+      dest='poolSize',
+      help="The maximum number of persistent connections to a host, shared "
+           "by all the executions within a process")
+  parser.add_argument(
+      '--pool-idle',
+      action='store',
+      type=int,
+      default=60,
+      dest='poolIdleTimeout',
+      help="The number of seconds an idle persistent connection is kept open")
+  parser.add_argument(
+      '--page-file',
+      action='store',
+      default="page_schedule",
+      dest='pageFile',
+      help="The file through which manually started executions (-p/-m) "
+           "share the pages of the search")
+  parser.add_argument(
+      '--crawl-id',
+      action='store',
+      default=None,
+      dest='crawlId',
+      help="The identifier of the crawl given to all of its manually "
+           "started executions (-p/-m), a new one starts the pages of the "
+           "page file over (ex: the date of a nightly crawl; without one, "
+           "the pages are started over once they were all claimed)")
+  parser.add_argument(
+      '--max-scan-size',
+      action='store',
+      type=int,
+      default=10,
+      dest='maxScanSize',
+      help="The maximum size in megabytes of the files searched for the "
+           "source statements (larger files are skipped)")
+  parser.add_argument(
+      '--scan-processes',
+      action='store',
+      type=int,
+      default=1,
+      dest='scanProcesses',
+      help="The number of processes searching the files of a large clone "
+           "for the source statements together (1 searches every clone in a "
+           "single process), a pool of them per crawling process")
+  parser.add_argument(
+      '--parallel-scan-size',
+      action='store',
+      type=int,
+      default=64,
+      dest='parallelScanSize',
+      help="The size in megabytes of the clones above which their files are "
+           "searched by the scan processes")
+  parser.add_argument(
+      '--statement-stats',
+      action='store_true',
+      default=False,
+      dest='statementStats',
+      help="Adds the number of matches, the number of files and the first "
+           "hit of each source statement to the report (searching each clone "
+           "in full, in a single pass for all the source statements)")
+  parser.add_argument(
+      '--clone-workers',
+      action='store',
+      type=int,
+      default=4,
+      dest='cloneWorkers',
+      help="The number of repositories cloned concurrently (by each "
+           "process, whose executions share them)")
+  parser.add_argument(
+      '--scan-workers',
+      action='store',
+      type=int,
+      default=2,
+      dest='scanWorkers',
+      help="The number of cloned repositories searched concurrently (by "
+           "each process, whose executions share them)")
+  parser.add_argument(
+      '--clean-workers',
+      action='store',
+      type=int,
+      default=1,
+      dest='cleanWorkers',
+      help="The number of cloned repositories removed concurrently (by "
+           "each process, whose executions share them)")
+  parser.add_argument(
+      '--clone-budget',
+      action='store',
+      type=int,
+      default=2048,
+      dest='cloneBudget',
+      help="The maximum disk space in megabytes taken by the clones in "
+           "progress of each process, whose executions share it (cloning "
+           "waits while it is used up)")
+  parser.add_argument(
+      '--clone-mode',
+      action='store',
+      default="full",
+      choices=["full", "sparse"],
+      dest='cloneMode',
+      help="Clones every file (full), or only the source files of the "
+           "primary language without any large files (sparse, a partial "
+           "clone with a sparse checkout)")
+  parser.add_argument(
+      '--blob-limit',
+      action='store',
+      default="1m",
+      dest='blobLimit',
+      help="The size of the largest file fetched by sparse clones (ex: 512k)")
+  parser.add_argument(
+      '--mirror-dir',
+      action='store',
+      default=None,
+      dest='mirrorDirectory',
+      help="Enables the local store of repository mirrors in the given "
+           "directory, which are cloned from and only fetch what changed "
+           "(shared by concurrent executions and later crawls)")
+  parser.add_argument(
+      '--mirror-budget',
+      action='store',
+      type=int,
+      default=10240,
+      dest='mirrorBudget',
+      help="The maximum size of the store of mirrors in megabytes (the least "
+           "recently used mirrors are removed)")
+  parser.add_argument(
+      '--stream-pages',
+      action='store_true',
+      default=False,
+      dest='streamPages',
+      help="Handles the repositories of a page as they are received, "
+           "instead of once the whole page is in (thread engine)")
+  parser.add_argument(
+      '--report-format',
+      action='store',
+      default="csv",
+      choices=sorted(report_handler.REPORT_FORMATS),
+      dest='reportFormat',
+      help="Writes the report as CSV, or as columnar NumPy arrays (npz) that "
+           "load quickly for analysis (manually started executions each "
+           "write their own npz report)")
+  parser.add_argument(
+      '--engine',
+      action='store',
+      default="thread",
+      choices=["thread", "loop"],
+      dest='engine',
+      help="Makes the API calls on a pool of threads, or as coroutines on an "
+           "event loop within a single thread (loop)")
+  parser.add_argument(
+      '--async-pages',
+      action='store',
+      type=int,
+      default=4,
+      dest='asyncPages',
+      help="The number of pages crawled at once by the event loop engine "
+           "(their language API calls are all in flight together)")
+  parser.add_argument(
+      '--journal',
+      action='store',
+      default="crawl_journal",
+      dest='journalFile',
+      help="The journal file recording the progress of the crawl, so that it "
+           "can be resumed (manually started executions share it, and -p 1 "
+           "starts a new crawl of the search in it, so start -p 1 first)")
+  parser.add_argument(
+      '--resume',
+      action='store_true',
+      default=False,
+      dest='resume',
+      help="Resumes the crawl recorded in the journal, skipping its finished "
+           "work and appending to its report (manually started executions "
+           "must start -p 1 first, and need a new --crawl-id so that the "
+           "pages in progress are handed out again)")
+  parser.add_argument(
+      '--store',
+      action='store',
+      default=None,
+      dest='storeFile',
+      help="Enables the SQLite store of the examined repositories in the "
+           "given file, which leaves out the repositories already handled "
+           "on another page and reuses the fresh data of earlier crawls")
+  parser.add_argument(
+      '--store-freshness',
+      action='store',
+      type=int,
+      default=604800,
+      dest='storeFreshness',
+      help="The number of seconds the stored data of a repository is reused")
+  parser.add_argument(
+      '--min-size',
+      action='store',
+      type=int,
+      default=None,
+      dest='minSize',
+      help="Leaves out the repositories smaller than the given size in KB "
+           "(as given by the search results, before any other API call or "
+           "clone is made for them)")
+  parser.add_argument(
+      '--max-size',
+      action='store',
+      type=int,
+      default=None,
+      dest='maxSize',
+      help="Leaves out the repositories larger than the given size in KB")
+  parser.add_argument(
+      '--skip-forks',
+      action='store_true',
+      default=False,
+      dest='skipForks',
+      help="Leaves out the repositories that are forks")
+  parser.add_argument(
+      '--pushed-after',
+      action='store',
+      type=filter_handler.parseDate,
+      default=None,
+      dest='pushedAfter',
+      help="Leaves out the repositories not pushed to after the given date "
+           "(ex: 2011-06-30)")
+  parser.add_argument(
+      '--min-watchers',
+      action='store',
+      type=int,
+      default=None,
+      dest='minWatchers',
+      help="Leaves out the repositories with fewer watchers than given")
+  parser.add_argument(
+      '--api-url',
+      action='store',
+      default=None,
+      dest='apiUrl',
+      help="The URL the API calls are made to, ending with a '/' (by default "
+           "GitHub's), such as the stand-in of the benchmarks")
+  parser.add_argument(
+      '--metrics-file',
+      action='store',
+      default=None,
+      dest='metricsFile',
+      help="Enables the metrics of the crawl (stage latencies, API calls, "
+           "retries, cache hits, bytes cloned and queue depths), regularly "
+           "written as a JSON snapshot to the given file (manually started "
+           "executions add their process number to its name)")
+  parser.add_argument(
+      '--metrics-interval',
+      action='store',
+      type=float,
+      default=10,
+      dest='metricsInterval',
+      help="The number of seconds between writing the metrics snapshot")
+  parser.add_argument(
+      '--metrics-port',
+      action='store',
+      type=int,
+      default=None,
+      dest='metricsPort',
+      help="Serves the metrics of the crawl as JSON on "
+           "http://127.0.0.1:PORT/metrics (manually started executions add "
+           "their process number minus 1 to the port)")
+
+
+def getCrawlOptions(userArgs):
+  """Acquires the crawl tuning options from the parsed arguments
+
+  Args:
+    userArgs: The arguments parsed with the options of addCrawlArguments
+
+  Returns:
+    A dictionary of the keyword arguments for the GitHubExplorer
+
+  """
+
+  return {'languageWorkers': userArgs.languageWorkers,
+          'apiRate': userArgs.apiRate,
+          'cacheDirectory': userArgs.cacheDirectory,
+          'cacheTimeToLive': userArgs.cacheTimeToLive,
+          'cacheMaxBytes': userArgs.cacheSize * 1048576,
+          'poolSize': userArgs.poolSize,
+          'poolIdleTimeout': userArgs.poolIdleTimeout,
+          'pageFile': userArgs.pageFile,
+          'crawlId': userArgs.crawlId,
+          'maxScanFileSize': userArgs.maxScanSize * 1048576,
+          'statementStats': userArgs.statementStats,
+          'scanProcesses': userArgs.scanProcesses,
+          'parallelScanBytes': userArgs.parallelScanSize * 1048576,
+          'cloneWorkers': userArgs.cloneWorkers,
+          'scanWorkers': userArgs.scanWorkers,
+          'cleanWorkers': userArgs.cleanWorkers,
+          'maxCloneBytes': userArgs.cloneBudget * 1048576,
+          'cloneMode': userArgs.cloneMode,
+          'blobLimit': userArgs.blobLimit,
+          'mirrorDirectory': userArgs.mirrorDirectory,
+          'maxMirrorBytes': userArgs.mirrorBudget * 1048576,
+          'streamPages': userArgs.streamPages,
+          'asyncPages': userArgs.asyncPages,
+          'reportFormat': userArgs.reportFormat,
+          'engine': userArgs.engine,
+          'journalFile': userArgs.journalFile,
+          'resume': userArgs.resume,
+          'storeFile': userArgs.storeFile,
+          'storeFreshness': userArgs.storeFreshness,
+          'metricsFile': userArgs.metricsFile,
+          'metricsInterval': userArgs.metricsInterval,
+          'metricsPort': userArgs.metricsPort,
+          'apiUrl': userArgs.apiUrl,
+          'minSize': userArgs.minSize,
+          'maxSize': userArgs.maxSize,
+          'skipForks': userArgs.skipForks,
+          'pushedAfter': userArgs.pushedAfter,
+          'minWatchers': userArgs.minWatchers,
+          'storeCrawl': "%x-%x" %(int(time.time()), os.getpid())}
 
 # If this module is ran as main
 if __name__ == '__main__':
@@ -176,10 +658,34 @@ if __name__ == '__main__':
       default=False,
       dest='writeLog',
       help="Enables the output to be written to a log file")
+  parser.add_argument(
+      '--export-store',
+      action='store',
+      default=None,
+      dest='exportFile',
+      help="Exports the repositories of the store (given with --store) to "
+           "the given CSV report, instead of crawling")
+  addCrawlArguments(parser)
 
   userArgs = parser.parse_args()
 
+  if userArgs.resume and int(userArgs.maxProcesses) > 1 and \
+     userArgs.crawlId == None:
+    parser.error("--resume with -m requires a new --crawl-id")
+
+  if userArgs.exportFile != None:
+    if userArgs.storeFile == None:
+      parser.error("--export-store requires --store")
+
+    logging.basicConfig(level=logging.INFO)
+    store_handler.StoreHandler(userArgs.storeFile,
+        GitHubExplorer._headers, GitHubExplorer._languages,
+        userArgs.storeFreshness, None,
+        logging.getLogger("export")).exportCSV(userArgs.exportFile)
+    exit()
+
   # Create the GitHub Explorer which starts this process
   gitHubExplorer = GitHubExplorer(userArgs.language, userArgs.keywords,
       userArgs.sourceStatements, userArgs.clone, int(userArgs.processNumber),
-      int(userArgs.maxProcesses), userArgs.writeLog)
+      int(userArgs.maxProcesses), userArgs.writeLog, None,
+      **getCrawlOptions(userArgs))
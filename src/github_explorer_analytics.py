@@ -0,0 +1,131 @@
+import argparse
+import logging
+import sys
+import analytics_handler
+import github_explorer
+try: import simplejson as json
+except ImportError: import json
+
+"""This python file computes the language analytics of GitHub Explorer reports
+
+The reports written by the GitHub Explorer program (CSV or NPZ) are gone
+through in chunks, so reports larger than the memory can be analyzed. The
+analytics are the total bytes and share of each language, the number of
+repositories each language is used by and is the primary language of, the
+size percentiles, the co-occurring languages and the largest repositories.
+They are printed as tables, or as JSON (which includes the co-occurrence
+matrix).
+
+"""
+
+
+def _printResults(results, pairCount):
+  """Prints the results of the analytics as tables
+
+  Args:
+    results: The results of the AnalyticsHandler
+    pairCount: The number of co-occurring language pairs printed
+
+  """
+
+  print "%d repositories with content" %results['repositories']
+  print "Repository size percentiles: %s" \
+        %_formatPercentiles(results['percentiles'])
+  print
+  print "%-16s %14s %7s %8s %8s %7s  %s" %("Language", "Bytes", "Share",
+                                            "Repos", "Primary", "Share",
+                                            "Size percentiles")
+
+  languages = sorted(results['languages'], key=lambda entry: entry['bytes'],
+                     reverse=True)
+  for entry in languages:
+    if entry['repositories'] == 0:
+      continue
+
+    print "%-16s %14d %6.2f%% %8d %8d %6.2f%%  %s" \
+          %(entry['language'], entry['bytes'], 100 * entry['share'],
+            entry['repositories'], entry['primary'],
+            100 * entry['primaryShare'],
+            _formatPercentiles(entry['percentiles']))
+
+  pairs = []
+  names = [entry['language'] for entry in results['languages']]
+  for first, row in enumerate(results['cooccurrence']):
+    for second in range(first + 1, len(row)):
+      if row[second] > 0:
+        pairs.append((row[second], names[first], names[second]))
+
+  print
+  print "Most co-occurring languages:"
+  for count, first, second in sorted(pairs, reverse=True)[:pairCount]:
+    print "  %-16s %-16s %8d" %(first, second, count)
+
+  print
+  print "Largest repositories:"
+  for name, size in results['top']:
+    print "  %-40s %14d" %(name, size)
+
+
+def _formatPercentiles(percentiles):
+  """Formats the size percentiles
+
+  Args:
+    percentiles: The dictionary of the sizes by percentile
+
+  Returns:
+    The percentiles as a string (ex: p50=1200 p90=56000)
+
+  """
+
+  return " ".join("p%d=%d" %(percentile, percentiles[percentile])
+                  for percentile in sorted(percentiles))
+
+
+# If this module is ran as main
+if __name__ == '__main__':
+
+  # Define the argument options to be parsed
+  parser = argparse.ArgumentParser(
+      description="<https://github.com/kevinjalbert/github_explorer>",
+      version="github_explorer_analytics 0.3.0")
+  parser.add_argument(
+      'reports',
+      nargs='*',
+      default=["repository_report.csv"],
+      help="The reports to analyze, CSV or NPZ (by their extension), which "
+           "are analyzed as one")
+  parser.add_argument(
+      '--top',
+      action='store',
+      type=int,
+      default=10,
+      dest='top',
+      help="The number of largest repositories and of co-occurring language "
+           "pairs listed")
+  parser.add_argument(
+      '--chunk-rows',
+      action='store',
+      type=int,
+      default=65536,
+      dest='chunkRows',
+      help="The number of repositories loaded at once, which bounds the "
+           "memory used")
+  parser.add_argument(
+      '--json',
+      action='store_true',
+      default=False,
+      dest='json',
+      help="Prints the analytics as JSON, including the co-occurrence matrix")
+
+  userArgs = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+  analyticsHandler = analytics_handler.AnalyticsHandler(
+      github_explorer.GitHubExplorer._languages, logging.getLogger("analytics"),
+      userArgs.top)
+  analyticsHandler.analyzeReport(userArgs.reports, userArgs.chunkRows)
+
+  if userArgs.json:
+    print json.dumps(analyticsHandler.results())
+  else:
+    _printResults(analyticsHandler.results(), userArgs.top)
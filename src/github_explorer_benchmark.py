@@ -0,0 +1,352 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import benchmark_handler
+import github_explorer
+try: import simplejson as json
+except ImportError: import json
+
+"""This python file benchmarks the GitHub Explorer program offline
+
+The crawls run against a local stand-in of the GitHub API, with a chosen
+latency, rate limit and share of server errors, and clone bare git fixtures
+over file://, so nothing reaches GitHub and a benchmark can be repeated. Each
+scenario runs the GitHub Explorer program or its driver as a separate process
+in a scratch directory, once for each of the worker counts when its arguments
+use them. The throughput (repositories and API calls per second), the peak
+memory and the time spent in each stage of the crawl (from its metrics) are
+printed as a table, and can be saved as JSON. Comparing against the saved
+results of an earlier benchmark flags the scenarios that got slower.
+
+"""
+
+# The scenarios, as (name, program, arguments) tuples, where {workers} in
+# the arguments is replaced by each of the worker counts
+SCENARIOS = [
+    ("explorer", "github_explorer.py", []),
+    ("explorer-languages", "github_explorer.py",
+     ["--language-workers", "{workers}"]),
+    ("explorer-stream", "github_explorer.py",
+     ["--stream-pages", "--language-workers", "{workers}"]),
+    ("explorer-loop", "github_explorer.py",
+     ["--engine", "loop", "--async-pages", "{workers}"]),
+    ("driver-threads", "github_explorer_driver.py",
+     ["-m", "{workers}", "--language-workers", "4"]),
+    ("driver-processes", "github_explorer_driver.py",
+     ["-m", "{workers}", "--mode", "process", "--language-workers", "4"]),
+    ("explorer-clone", "github_explorer.py",
+     ["-c", "-s", "{statement}", "--clone-workers", "{workers}"]),
+    ("driver-clone", "github_explorer_driver.py",
+     ["-m", "{workers}", "-c", "-s", "{statement}"])]
+
+# The histograms of the metrics shown as the time spent in each stage
+_STAGES = ["api.request", "api.rate_wait", "page.handle", "stage.clone",
+           "stage.scan", "stage.clean", "report.write"]
+
+
+def runScenario(name, program, arguments, apiURL, directory):
+  """Runs a scenario in a scratch directory
+
+  Args:
+    name: The name of the scenario
+    program: The file name of the program (in this directory)
+    arguments: The arguments of the program
+    apiURL: The URL of the stand-in of the API
+    directory: The scratch directory the program runs in
+
+  Returns:
+    A dictionary of the 'scenario', its 'status' (the exit status), the
+    'seconds' it took, the 'repositories' in its report, the 'peakRSS' (in
+    KB) of its largest process and its 'metrics' snapshot
+
+  """
+
+  program = os.path.join(os.path.dirname(os.path.abspath(__file__)), program)
+  command = [sys.executable, program, "--api-url", apiURL, "--metrics-file",
+             "metrics.json", "--metrics-interval", "3600"] + arguments
+
+  with open(os.path.join(directory, "output.log"), 'w') as output:
+    startTime = time.time()
+    process = subprocess.Popen(command, cwd=directory, stdout=output,
+                               stderr=subprocess.STDOUT)
+
+    # The usage of the process includes its worker processes
+    pid, status, usage = os.wait4(process.pid, 0)
+    seconds = time.time() - startTime
+    process.returncode = os.WEXITSTATUS(status)
+
+  metrics = {'counters': {}, 'histograms': {}}
+  try:
+    with open(os.path.join(directory, "metrics.json")) as metricsFile:
+      metrics = json.load(metricsFile)
+  except (IOError, ValueError):
+    pass
+
+  return {'scenario': name, 'status': process.returncode,
+          'seconds': seconds,
+          'repositories': metrics['counters'].get('report.rows', 0),
+          'peakRSS': usage.ru_maxrss, 'metrics': metrics}
+
+
+def _printResults(results):
+  """Prints the results of the scenarios as a table
+
+  Args:
+    results: The list of the results of the scenarios (see runScenario)
+
+  """
+
+  stages = [stage for stage in _STAGES
+            if any(stage in result['metrics']['histograms']
+                   for result in results)]
+
+  print "%-22s %6s %8s %8s %9s %8s  %s" %("Scenario", "Status", "Seconds",
+                                           "Repos/s", "Calls/s", "Peak MB",
+                                           "Stage seconds (total/mean ms)")
+
+  for result in results:
+    histograms = result['metrics']['histograms']
+    print "%-22s %6d %8.2f %8.1f %9.1f %8.1f  %s" \
+          %(result['scenario'], result['status'], result['seconds'],
+            result['repositoriesPerSecond'], result['callsPerSecond'],
+            result['peakRSS'] / 1024.0,
+            " ".join("%s=%.2f/%.1f" %(stage, histograms[stage]['sum'],
+                                      1000 * histograms[stage]['mean'])
+                     for stage in stages if stage in histograms))
+
+
+def _compareResults(results, baseline, tolerance):
+  """Compares the throughput of the scenarios with an earlier benchmark
+
+  Args:
+    results: The list of the results of the scenarios (see runScenario)
+    baseline: The list of the results of the earlier benchmark
+    tolerance: The share of the throughput that can be lost before a
+               scenario is flagged
+
+  Returns:
+    The number of scenarios that got slower
+
+  """
+
+  earlier = dict((result['scenario'], result) for result in baseline)
+  slower = 0
+
+  print
+  print "%-22s %10s %10s %8s" %("Scenario", "Baseline", "Repos/s", "Change")
+  for result in results:
+    if result['scenario'] not in earlier:
+      continue
+
+    before = earlier[result['scenario']]['repositoriesPerSecond']
+    after = result['repositoriesPerSecond']
+    change = (after - before) / before if before > 0 else 0.0
+    flag = ""
+    if change < -tolerance:
+      flag = " SLOWER"
+      slower += 1
+
+    print "%-22s %10.1f %10.1f %+7.1f%%%s" %(result['scenario'], before,
+                                             after, 100 * change, flag)
+
+  return slower
+
+
+# If this module is ran as main
+if __name__ == '__main__':
+
+  # Define the argument options to be parsed
+  parser = argparse.ArgumentParser(
+      description="<https://github.com/kevinjalbert/github_explorer>",
+      version="github_explorer_benchmark 0.3.0")
+  parser.add_argument(
+      'scenarios',
+      nargs='*',
+      default=[name for name, program, arguments in SCENARIOS],
+      help="The scenarios to run (by default all of them: %s)"
+           %", ".join(name for name, program, arguments in SCENARIOS))
+  parser.add_argument(
+      '--workers',
+      action='store',
+      default="1,4",
+      dest='workers',
+      help="The comma separated worker counts of the scenarios")
+  parser.add_argument(
+      '--repositories',
+      action='store',
+      type=int,
+      default=500,
+      dest='repositories',
+      help="The number of repositories served by the stand-in of the API")
+  parser.add_argument(
+      '--latency',
+      action='store',
+      type=float,
+      default=0.02,
+      dest='latency',
+      help="The number of seconds each API call takes (with up to half of it "
+           "again as jitter)")
+  parser.add_argument(
+      '--rate-limit',
+      action='store',
+      type=int,
+      default=0,
+      dest='rateLimit',
+      help="The maximum number of API calls per minute (0 is unlimited)")
+  parser.add_argument(
+      '--error-rate',
+      action='store',
+      type=float,
+      default=0.0,
+      dest='errorRate',
+      help="The share of the API calls answered with a server error")
+  parser.add_argument(
+      '--fixtures',
+      action='store',
+      type=int,
+      default=50,
+      dest='fixtures',
+      help="The number of bare git repositories cloned by the scenarios "
+           "(the repositories take turns using them)")
+  parser.add_argument(
+      '--fixture-files',
+      action='store',
+      type=int,
+      default=20,
+      dest='fixtureFiles',
+      help="The number of source files of each fixture")
+  parser.add_argument(
+      '--fixture-file-size',
+      action='store',
+      type=int,
+      default=8192,
+      dest='fixtureFileSize',
+      help="The size of each source file of the fixtures (in bytes)")
+  parser.add_argument(
+      '--fixture-dir',
+      action='store',
+      default="benchmark_fixtures",
+      dest='fixtureDirectory',
+      help="The directory of the fixtures, which are reused by later "
+           "benchmarks")
+  parser.add_argument(
+      '--statement',
+      action='store',
+      default="synchronized",
+      dest='statement',
+      help="The source statement searched by the clone scenarios (found in a "
+           "third of the fixtures)")
+  parser.add_argument(
+      '--seed',
+      action='store',
+      type=int,
+      default=0,
+      dest='seed',
+      help="The seed of the repositories, fixtures, jitter and errors")
+  parser.add_argument(
+      '--keep',
+      action='store_true',
+      default=False,
+      dest='keep',
+      help="Keeps the scratch directories of the scenarios (with their "
+           "reports, logs and metrics)")
+  parser.add_argument(
+      '--json',
+      action='store',
+      default=None,
+      dest='jsonFile',
+      help="Saves the results to the given JSON file")
+  parser.add_argument(
+      '--baseline',
+      action='store',
+      default=None,
+      dest='baselineFile',
+      help="Compares the results with those saved by an earlier benchmark, "
+           "exiting with status 1 when a scenario got slower")
+  parser.add_argument(
+      '--tolerance',
+      action='store',
+      type=float,
+      default=0.1,
+      dest='tolerance',
+      help="The share of the throughput a scenario can lose before it is "
+           "flagged as slower")
+
+  userArgs = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+  logger = logging.getLogger("benchmark")
+
+  scenarios = dict((name, (program, arguments))
+                   for name, program, arguments in SCENARIOS)
+  for name in userArgs.scenarios:
+    if name not in scenarios:
+      parser.error("Unknown scenario %s" %name)
+
+  fixtures = None
+  if any("-c" in scenarios[name][1] for name in userArgs.scenarios):
+    if not os.path.isdir(userArgs.fixtureDirectory):
+      os.makedirs(userArgs.fixtureDirectory)
+    fixtures = benchmark_handler.makeFixtures(userArgs.fixtureDirectory,
+        userArgs.fixtures, userArgs.fixtureFiles, userArgs.fixtureFileSize,
+        userArgs.statement, logger, userArgs.seed)
+
+  stubAPIHandler = benchmark_handler.StubAPIHandler(
+      benchmark_handler.makeRepositories(userArgs.repositories,
+          github_explorer.GitHubExplorer._languages, fixtures,
+          userArgs.seed),
+      logger, userArgs.latency, userArgs.rateLimit, userArgs.errorRate,
+      userArgs.seed)
+  stubAPIHandler.start()
+
+  results = []
+  try:
+    for name in userArgs.scenarios:
+      program, arguments = scenarios[name]
+      workerCounts = [None]
+      if "{workers}" in arguments:
+        workerCounts = [int(count) for count in userArgs.workers.split(",")]
+
+      for workers in workerCounts:
+        scenario = name if workers == None else "%s-%d" %(name, workers)
+        directory = tempfile.mkdtemp(prefix="benchmark_%s_" %scenario)
+        logger.info("Running scenario %s in %s" %(scenario, directory))
+
+        stubAPIHandler.resetCounts()
+        result = runScenario(scenario, program,
+                             [argument.format(workers=workers,
+                                              statement=userArgs.statement)
+                              for argument in arguments],
+                             stubAPIHandler.url, directory)
+
+        result['api'] = stubAPIHandler.counts()
+        result['repositoriesPerSecond'] = result['repositories'] / \
+                                          result['seconds']
+        result['callsPerSecond'] = result['api']['calls'] / result['seconds']
+        results.append(result)
+
+        if result['status'] != 0:
+          logger.warn("Scenario %s exited with status %d (see %s)"
+                      %(scenario, result['status'],
+                        os.path.join(directory, "output.log")))
+        elif not userArgs.keep:
+          shutil.rmtree(directory, True)
+  finally:
+    stubAPIHandler.close()
+
+  _printResults(results)
+
+  if userArgs.jsonFile != None:
+    with open(userArgs.jsonFile, 'w') as jsonFile:
+      json.dump(results, jsonFile, indent=1)
+
+  if userArgs.baselineFile != None:
+    with open(userArgs.baselineFile) as baselineFile:
+      baseline = json.load(baselineFile)
+    if _compareResults(results, baseline, userArgs.tolerance) > 0:
+      sys.exit(1)
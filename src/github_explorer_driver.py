@@ -1,27 +1,73 @@
 import argparse
 import logging
+import logging.handlers
+import multiprocessing
+import Queue
+import sys
 import threading
+import checkpoint_handler
 import github_explorer
+import job_handler
+import log_handler
+import metrics_handler
+import report_handler
+import scheduler_handler
 
 """This python file drives multiple GitHub Explorer program concurrently
 
 Multiple GitHub Explorer processes are started at the same time and given a
-specific process number that dictates what repository page intervals it should
-handle. Each process will have it's own logger that will log the progress in
-individual log files. It's still possible to manually orchestrate the multiple
-GitHub Explorer programs by making use of the -p and -m parameters in the
-GitHub Explorer program.
+specific process number. The processes share a page scheduler, from which they
+claim the next unhandled repository page whenever they are ready. Each process
+will have it's own logger, whose records are handed over a queue to this
+process, which writes them all to a single rotated log of JSON lines. It's
+still possible to manually orchestrate the multiple GitHub Explorer programs
+by making use of the -p and -m parameters in the GitHub Explorer program.
+The executions run as threads by default; with the process mode they run as
+separate worker processes that report their progress back over a queue.
+Either way, a single report writer in this process writes the data of all the
+executions to the report, and the metrics of all the executions are exposed
+together (the worker processes send snapshots of their metrics along with
+their progress). With a job file, the executions work through the queries
+of the job together (see job_handler), which share the work on the
+repositories that several queries find.
 
 """
 
 
+def _workerLogger(processNumber, logQueue, logLevel, samplingRates):
+  """Creates the custom logger of an execution, which hands its log records
+  over to the log queue of the driver
+
+  The level and the sampling of the records are applied by the execution, so
+  the records that are left out never reach the queue.
+
+  Args:
+    processNumber: The process number of the execution
+    logQueue: The queue of the QueueListener writing the log
+    logLevel: The name of the lowest level that is logged (ex: INFO)
+    samplingRates: The dictionary of the sampling rate of each stage
+
+  Returns:
+    The logger of the execution
+
+  """
+
+  logger = logging.getLogger("logger" + str(processNumber))
+  handler = log_handler.QueueHandler(logQueue)
+  handler.addFilter(log_handler.SamplingFilter(samplingRates))
+  logger.setLevel(getattr(logging, logLevel))
+  logger.propagate = False
+  logger.addHandler(handler)
+  return logger
+
+
 def _task(language, keywords, sourceStatements, clone, processNumber,
-         maxProcesses):
+         maxProcesses, logQueue, logLevel, samplingRates, **crawlOptions):
   """This task is a single execution of the GitHub Explorer program
 
-  This function is used in the threading approach to running multiple GitHub
-  Explorer programs. A specific logger is created for the new execution of the
-  GitHub Explorer.
+  This function is used in both the threading and the process approach to
+  running multiple GitHub Explorer programs. A specific logger is created for
+  the new execution of the GitHub Explorer.
 
   Args:
     language: A filter of the primary language for the repositories
@@ -30,22 +76,65 @@ def _task(language, keywords, sourceStatements, clone, processNumber,
     clone: Flag that indicates repositories should be cloned
     processNumber: The current processNumber of this concurrent execution
     maxProcesses: The maximum number of concurrent processes executing
+    logQueue: The queue of the QueueListener writing the log
+    logLevel: The name of the lowest level that is logged (ex: INFO)
+    samplingRates: The dictionary of the sampling rate of each stage
+    crawlOptions: The tuning options of the crawl (see getCrawlOptions)
 
   """
 
   # Create custom logger to be used within new GitHub Explorer process
-  logger = logging.getLogger("logger" + str(processNumber))
-  handler = logging.FileHandler("worker_log_" + str(processNumber), "w")
-  logger.setLevel(logging.DEBUG)
-  formatter = logging.Formatter("%(asctime)s %(levelname)-8s P" +
-                                str(processNumber) +
-                                " %(message)s", datefmt="%d %b %H:%M:%S")
-  handler.setFormatter(formatter)
-  logger.addHandler(handler)
+  logger = _workerLogger(processNumber, logQueue, logLevel, samplingRates)
 
   # Create the GitHub Explorer which starts the process
   gitHubExplorer = github_explorer.GitHubExplorer(language, keywords,
-      sourceStatements, clone, processNumber, maxProcesses, True, logger)
+      sourceStatements, clone, processNumber, maxProcesses, True, logger,
+      **crawlOptions)
+
+
+def _awaitProcesses(workers, progressQueue, metricsReporter):
+  """Waits for every worker process while reporting their progress
+
+  The progress reported by the worker processes is collected as it arrives
+  on the queue, until every worker process has exited.
+
+  Args:
+    workers: The list of worker processes (multiprocessing.Process)
+    progressQueue: The queue the worker processes report their progress to
+    metricsReporter: The MetricsReporter the snapshots of the metrics of the
+                     worker processes are handed to
+
+  Returns:
+    The exit status of the whole execution (0 if every worker succeeded)
+
+  """
+
+  repositoriesDone = {}
+
+  while True:
+    try:
+      progress = progressQueue.get(timeout=1)
+    except Queue.Empty:
+      # The queue must be drained before concluding that the workers are done
+      if not any(worker.is_alive() for worker in workers):
+        break
+      continue
+
+    if progress[0] == "finished":
+      repositoriesDone[progress[1]] = progress[2]
+    elif progress[0] == "metrics":
+      metricsReporter.update(progress[1], progress[2])
+
+  exitStatus = 0
+  for processNumber, worker in enumerate(workers, 1):
+    worker.join()
+    print "P%d exited with status %d (%d repositories done)" \
+          %(processNumber, worker.exitcode,
+            repositoriesDone.get(processNumber, 0))
+    if worker.exitcode != 0:
+      exitStatus = 1
+
+  return exitStatus
 
 # If this module is ran as main
 if __name__ == '__main__':
@@ -90,14 +179,191 @@ if __name__ == '__main__':
       help="Source Statements to be used in the detailed search (ex: "
            "\"java.util synchronized latch\"), able to search with multiple "
            "terms (this-or-that)")
+  parser.add_argument(
+      '--mode',
+      action='store',
+      default="thread",
+      choices=["thread", "process"],
+      dest='mode',
+      help="Runs the concurrent executions as threads of this process, or as "
+           "separate worker processes (which avoids sharing the interpreter "
+           "lock)")
+  parser.add_argument(
+      '--jobs',
+      action='store',
+      default=None,
+      dest='jobFile',
+      help="Crawls the queries of a JSON job file instead of -l, -k and -s "
+           "(ex: [{\"name\": \"java\", \"language\": \"Java\", "
+           "\"sourceStatements\": \"synchronized\"}, ...]), sharing the "
+           "executions and the work on the repositories found by several "
+           "queries")
+  parser.add_argument(
+      '--combined-report',
+      action='store_true',
+      default=False,
+      dest='combinedReport',
+      help="Writes the queries of a job file to one report with a query "
+           "column, instead of a report per query")
+  parser.add_argument(
+      '--log-file',
+      action='store',
+      default="worker_log.jsonl",
+      dest='logFile',
+      help="The log of all the executions, with a JSON object per record "
+           "(ex: {\"repo\": ..., \"stage\": \"clone\", \"duration\": ..., "
+           "\"bytes\": ...})")
+  parser.add_argument(
+      '--log-level',
+      action='store',
+      default="DEBUG",
+      choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+      dest='logLevel',
+      help="The lowest level of the records that are logged")
+  parser.add_argument(
+      '--log-sample',
+      action='store',
+      default="",
+      dest='logSample',
+      help="The fraction of the records of a stage that are logged (ex: "
+           "\"clone=0.1,scan=0.1,done=0.01\"), the warnings and errors are "
+           "always logged (stages: filter, languages, clone, scan, clean, "
+           "done)")
+  parser.add_argument(
+      '--log-max-size',
+      action='store',
+      default=100,
+      type=int,
+      dest='logMaxSize',
+      help="The size in MB the log is rotated at")
+  parser.add_argument(
+      '--log-backups',
+      action='store',
+      default=5,
+      type=int,
+      dest='logBackups',
+      help="The number of rotated logs that are kept")
+  github_explorer.addCrawlArguments(parser)
 
   userArgs = parser.parse_args()
 
-  workers = []
-  for processNumber in range(int(userArgs.maxProcesses)):
-    worker = threading.Thread(target=_task, args=(userArgs.language,
-                              userArgs.keywords, userArgs.sourceStatements,
-                              userArgs.clone, processNumber + 1,
-                              int(userArgs.maxProcesses)))
-    workers.append(worker)
-    worker.start()
+  try:
+    samplingRates = log_handler.parseSampling(userArgs.logSample)
+  except ValueError, e:
+    parser.error("Invalid log sampling -> %s" %e)
+
+  maxProcesses = int(userArgs.maxProcesses)
+  crawlOptions = github_explorer.getCrawlOptions(userArgs)
+  taskArgs = (userArgs.language, userArgs.keywords, userArgs.sourceStatements,
+              userArgs.clone)
+
+  # Create the logger of the driver itself (used by the report writer)
+  logger = logging.getLogger("driver")
+  logger.addHandler(logging.StreamHandler())
+
+  # The log records of the executions are written by a single listener
+  logFileHandler = logging.handlers.RotatingFileHandler(userArgs.logFile,
+      maxBytes=userArgs.logMaxSize * 1048576, backupCount=userArgs.logBackups)
+  logFileHandler.setFormatter(log_handler.JSONFormatter())
+  logListener = log_handler.QueueListener(
+      multiprocessing.Queue() if userArgs.mode == "process" and
+      userArgs.jobFile == None else Queue.Queue(), [logFileHandler])
+  logListener.start()
+  logArgs = (logListener.queue, userArgs.logLevel, samplingRates)
+
+  headers = github_explorer.GitHubExplorer._headers
+  languages = github_explorer.GitHubExplorer._languages
+
+  if userArgs.jobFile != None:
+    if userArgs.mode == "process":
+      parser.error("A job file is only crawled in the thread mode")
+    try:
+      queries = job_handler.loadJobFile(userArgs.jobFile, languages)
+    except (IOError, ValueError), e:
+      parser.error("Invalid job file -> %s" %e)
+
+    metricsReporter = metrics_handler.MetricsReporter(
+        metrics_handler.getMetricsHandler(), crawlOptions.pop('metricsFile'),
+        crawlOptions.pop('metricsInterval'), crawlOptions.pop('metricsPort'),
+        logger)
+    metricsReporter.start()
+
+    jobHandler = job_handler.JobHandler(queries, headers, languages,
+        userArgs.clone, [_workerLogger(processNumber, *logArgs) for
+                         processNumber in range(1, maxProcesses + 1)],
+        logger, userArgs.combinedReport, **crawlOptions)
+    jobHandler.run()
+    metricsReporter.close()
+    logListener.stop()
+    sys.exit(0)
+
+  # The report has the statistics of the source statements, if they are kept
+  headers = github_explorer.reportHeaders(github_explorer.formatQuery(
+      userArgs.language, userArgs.keywords, userArgs.sourceStatements)[2],
+      userArgs.clone, userArgs.statementStats)
+
+  # All the executions share the journal of the crawl
+  resume = crawlOptions.pop('resume')
+  reportFormat = crawlOptions.pop('reportFormat')
+  checkpointHandler = checkpoint_handler.CheckpointHandler(
+      crawlOptions.pop('journalFile'), userArgs.language, userArgs.keywords,
+      resume, True, True, logger)
+  crawlOptions['checkpointHandler'] = checkpointHandler
+
+  # The metrics of every execution are exposed here, not by the executions
+  metricsReporter = metrics_handler.MetricsReporter(
+      metrics_handler.getMetricsHandler(), crawlOptions.pop('metricsFile'),
+      crawlOptions.pop('metricsInterval'), crawlOptions.pop('metricsPort'),
+      logger)
+  metricsReporter.start()
+
+  if userArgs.mode == "process":
+
+    # Worker processes don't share the rate budget, so it is split up
+    crawlOptions['apiRate'] = userArgs.apiRate / maxProcesses
+    crawlOptions['pageScheduler'] = scheduler_handler.SharedPageScheduler()
+    crawlOptions['progressQueue'] = multiprocessing.Queue()
+
+    reportWriter = report_handler.ReportWriter(headers, languages, logger,
+        multiprocessing.Queue(), resume, checkpointHandler=checkpointHandler,
+        reportFormat=reportFormat)
+    reportWriter.start()
+    crawlOptions['reportQueue'] = reportWriter.queue
+
+    workers = []
+    for processNumber in range(maxProcesses):
+      worker = multiprocessing.Process(target=_task, args=taskArgs +
+                                       (processNumber + 1, maxProcesses) +
+                                       logArgs, kwargs=crawlOptions)
+      workers.append(worker)
+      worker.start()
+
+    exitStatus = _awaitProcesses(workers, crawlOptions['progressQueue'],
+                                 metricsReporter)
+    reportWriter.close()
+    metricsReporter.close()
+    logListener.stop()
+    sys.exit(exitStatus)
+
+  else:
+    crawlOptions['pageScheduler'] = scheduler_handler.PageScheduler()
+
+    reportWriter = report_handler.ReportWriter(headers, languages, logger,
+        append=resume, checkpointHandler=checkpointHandler,
+        reportFormat=reportFormat)
+    reportWriter.start()
+    crawlOptions['reportQueue'] = reportWriter.queue
+
+    workers = []
+    for processNumber in range(maxProcesses):
+      worker = threading.Thread(target=_task, args=taskArgs +
+                                (processNumber + 1, maxProcesses) + logArgs,
+                                kwargs=crawlOptions)
+      workers.append(worker)
+      worker.start()
+
+    for worker in workers:
+      worker.join()
+    reportWriter.close()
+    metricsReporter.close()
+    logListener.stop()
@@ -0,0 +1,471 @@
+import os
+import re
+import threading
+import github_explorer
+import report_handler
+import repository_handler
+import scheduler_handler
+import statement_handler
+try: import simplejson as json
+except ImportError: import json
+
+
+def loadJobFile(fileName, languages):
+  """Loads the queries of a job file
+
+  The job file is a JSON list of queries, each an object of the 'language',
+  'keywords' and 'sourceStatements' of the query (as given to the GitHub
+  Explorer program with -l, -k and -s, all optional) and its 'name' (by
+  default query1, query2, ...).
+
+  Args:
+    fileName: The file name of the job file
+    languages: The list of languages the languages of the queries are from
+
+  Returns:
+    The list of the queries, as dictionaries of their 'name', 'language',
+    'keywords' and 'sourceStatements'
+
+  Raises:
+    ValueError: The job file isn't a valid list of queries
+
+  """
+
+  with open(fileName) as jobFile:
+    entries = json.load(jobFile)
+
+  if not isinstance(entries, list) or len(entries) == 0:
+    raise ValueError("%s isn't a list of queries" %fileName)
+
+  queries = []
+  names = set()
+
+  for number, entry in enumerate(entries, 1):
+    if not isinstance(entry, dict):
+      raise ValueError("Query %d of %s isn't an object" %(number, fileName))
+
+    query = {'name': unicode(entry.get('name', "query%d" %number)),
+             'language': entry.get('language', ""),
+             'keywords': entry.get('keywords', ""),
+             'sourceStatements': entry.get('sourceStatements', "")}
+
+    if query['language'] not in languages:
+      raise ValueError("Query %s has an unknown language %s"
+                       %(query['name'], query['language']))
+    if query['name'] in names:
+      raise ValueError("Query %s is in %s twice" %(query['name'], fileName))
+
+    names.add(query['name'])
+    queries.append(query)
+
+  return queries
+
+
+class SharedRepositories():
+
+  """This class shares the work on the repositories between the queries
+
+  The queries of a job often find the same repositories. The language API
+  call of a repository is only made by the first query to need it, the
+  others wait for it and reuse its result. Likewise, a repository is only
+  cloned and searched once: the first query clones it and searches it for
+  the source statements of every query of the job, and the others wait for
+  that and only check if their own source statements were found. The clone
+  is kept when any source statement was found in it, or when the query that
+  cloned it has no source statements (which keeps its clones).
+
+  """
+
+  # The language results of the repositories, by 'owner/name', as [event,
+  # languages] lists (the event is set once the languages are in)
+  _languages = None
+
+  # The clone results of the repositories, by 'owner/name', as [event,
+  # result] lists (see finishClone)
+  _clones = None
+
+  # The source statements of every query
+  _statements = None
+
+  # The statement handler searching for the source statements of every query
+  # (None if no query has source statements)
+  _statementHandler = None
+
+  # Lock guarding the results
+  _lock = None
+
+  def __init__(self, queries, logger, maxScanFileSize=10485760,
+               scanProcesses=1, parallelScanBytes=67108864):
+    """Constructor that compiles the source statements of every query
+
+    Args:
+      queries: The list of the queries of the job (see loadJobFile)
+      logger: The custom logger to be used for the searches
+      maxScanFileSize: The maximum size of the files searched for the source
+                       statements (in bytes)
+      scanProcesses: The number of scan processes searching the large clones
+                     (1 disables them)
+      parallelScanBytes: The size of the clones above which they are
+                         searched by the scan processes (in bytes)
+
+    """
+
+    self._languages = {}
+    self._clones = {}
+    self._lock = threading.Lock()
+
+    self._statements = []
+    for query in queries:
+      for statement in query['sourceStatements'].split():
+        if statement not in self._statements:
+          self._statements.append(statement)
+
+    if len(self._statements) > 0:
+      self._statementHandler = statement_handler.StatementHandler(
+          "|".join(self._statements), logger, maxScanFileSize, scanProcesses,
+          parallelScanBytes)
+
+  def languages(self, name, acquire):
+    """Acquires the languages of a repository once for all the queries
+
+    Args:
+      name: The name of the repository as 'owner/name'
+      acquire: The function making the language API call of the repository
+
+    Returns:
+      A list of language->size values of the repository, or None if the API
+      call failed
+
+    """
+
+    entry = self.claimLanguages(name)
+    if entry != None:
+      entry[0].wait()
+      return entry[1]
+
+    languages = None
+    try:
+      languages = acquire()
+    finally:
+      self.finishLanguages(name, languages)
+
+    return languages
+
+  def claimLanguages(self, name):
+    """Claims the language API call of a repository for the calling query
+
+    The first query to claim the languages of a repository makes the API
+    call (and must call finishLanguages), the others wait for the returned
+    event to be set (coroutines poll it, not to hold up their event loop).
+
+    Args:
+      name: The name of the repository as 'owner/name'
+
+    Returns:
+      None if the calling query is to make the API call, otherwise the
+      [event, languages] list of the API call
+
+    """
+
+    with self._lock:
+      entry = self._languages.get(name)
+      if entry == None:
+        self._languages[name] = [threading.Event(), None]
+
+    return entry
+
+  def finishLanguages(self, name, languages):
+    """Records the languages of a repository, for the waiting queries
+
+    A failed API call is forgotten, so it is made again by the next query.
+
+    Args:
+      name: The name of the repository as 'owner/name'
+      languages: The list of language->size values (None if the API call
+                 failed)
+
+    """
+
+    with self._lock:
+      entry = self._languages[name]
+      if languages == None:
+        del self._languages[name]
+
+    entry[1] = languages
+    entry[0].set()
+
+  def claimClone(self, name):
+    """Claims the clone of a repository for the calling query
+
+    The first query to claim the clone of a repository makes it (and must
+    call finishClone), the others wait for it to be done.
+
+    Args:
+      name: The name of the repository as 'owner/name'
+
+    Returns:
+      None if the calling query is to make the clone, otherwise the result of
+      the clone (see finishClone)
+
+    """
+
+    with self._lock:
+      entry = self._clones.get(name)
+      if entry == None:
+        self._clones[name] = [threading.Event(), None]
+        return None
+
+    entry[0].wait()
+    return entry[1]
+
+  def finishClone(self, name, cloned, found=None, kept=False,
+                  statistics=None):
+    """Records the result of the clone of a repository, for the waiting
+    queries
+
+    Args:
+      name: The name of the repository as 'owner/name'
+      cloned: Flag that indicates the clone succeeded
+      found: The list of the source statements found in the clone (None if
+             it wasn't searched)
+      kept: Flag that indicates the clone is kept
+      statistics: The statistics of the source statements in the clone (None
+                  if it wasn't searched, see scanClone)
+
+    """
+
+    with self._lock:
+      entry = self._clones[name]
+
+    entry[1] = {'cloned': cloned, 'found': found, 'kept': kept,
+                'statistics': statistics}
+    entry[0].set()
+
+  def scanClone(self, directory):
+    """Searches a clone for the source statements of every query, in a single
+    pass
+
+    Every source statement is counted on its own, also where the statement
+    of another query matches at the same position (ex: java and java.util),
+    so each query finds what a crawl of its own would.
+
+    Args:
+      directory: The directory of the clone
+
+    Returns:
+      A tuple of the list of the source statements found and the list of the
+      statistics of every source statement (see statements and
+      StatementHandler.scanStatistics)
+
+    """
+
+    if self._statementHandler == None:
+      return [], []
+
+    statistics = self._statementHandler.scanStatistics(directory)
+    return [statement for statement, (matches, files, firstHit) in
+            zip(self._statements, statistics) if matches > 0], statistics
+
+  def statements(self):
+    """Acquires the source statements of every query
+
+    Returns:
+      The list of the source statements, in the order of their statistics
+
+    """
+
+    return list(self._statements)
+
+  def isSearching(self):
+    """Determines if the clones are searched for source statements
+
+    Returns:
+      True if a query of the job has source statements, otherwise False
+
+    """
+
+    return self._statementHandler != None
+
+
+class JobHandler():
+
+  """This class crawls the queries of a job with one set of executions
+
+  Instead of a driver (with its executions, loggers and report) for each
+  query, the executions work through the queries of the job together: an
+  execution crawls the pages of a query until its search results run out,
+  and then moves on to the next query with pages left, so every execution
+  stays busy until the whole job is done. The executions share the rate
+  budget, the connection pool and the API cache of the process, and the
+  language API calls and clones of the repositories found by several
+  queries (see SharedRepositories). The report is written per query
+  (repository_report_<name>.ext), or as one report with a 'query' column.
+
+  """
+
+  # The list of the queries of the job (see loadJobFile)
+  _queries = None
+
+  # The list of header fields that repositories have
+  _headers = None
+
+  # The list of languages that GitHub has available
+  _languages = None
+
+  # Flag that indicates repositories should be cloned
+  _clone = None
+
+  # The list of the loggers of the executions
+  _loggers = None
+
+  # Flag that indicates the queries are reported together, with a tag
+  _combinedReport = None
+
+  # The name of the report format (see report_handler.REPORT_FORMATS)
+  _reportFormat = None
+
+  # The crawl engine ('thread' or 'loop')
+  _engine = None
+
+  # The tuning options of the crawl (see github_explorer.getCrawlOptions)
+  _crawlOptions = None
+
+  # The page schedulers of the queries
+  _pageSchedulers = None
+
+  # The number of the first query that may still have pages left
+  _nextQuery = 0
+
+  # Lock guarding the progress through the queries
+  _lock = None
+
+  # Logger being used for the job
+  _logger = None
+
+  def __init__(self, queries, headers, languages, clone, loggers, logger,
+               combinedReport=False, **crawlOptions):
+    """Constructor that sets up the job
+
+    Args:
+      queries: The list of the queries of the job (see loadJobFile)
+      headers: The list of header fields that repositories have
+      languages: The list of languages that GitHub has available
+      clone: Flag that indicates repositories should be cloned
+      loggers: The list of the loggers of the executions (one per execution)
+      logger: The custom logger to be used for the job itself
+      combinedReport: Flag that indicates the queries are written to one
+                      report, with a 'query' column
+      crawlOptions: The tuning options of the crawl (see
+                    github_explorer.getCrawlOptions, the journal and resume
+                    options don't apply to jobs)
+
+    """
+
+    self._queries = queries
+    self._headers = headers
+    self._languages = languages
+    self._clone = clone
+    self._loggers = loggers
+    self._logger = logger
+    self._combinedReport = combinedReport
+    self._reportFormat = crawlOptions.pop('reportFormat', "csv")
+    self._engine = crawlOptions.pop('engine', "thread")
+    self._lock = threading.Lock()
+
+    for option in ('resume', 'journalFile', 'checkpointHandler'):
+      crawlOptions.pop(option, None)
+    crawlOptions['sharedRepositories'] = SharedRepositories(queries, logger,
+        crawlOptions.get('maxScanFileSize', 10485760),
+        crawlOptions.get('scanProcesses', 1),
+        crawlOptions.get('parallelScanBytes', 67108864))
+    self._crawlOptions = crawlOptions
+
+    self._pageSchedulers = [scheduler_handler.PageScheduler()
+                            for query in queries]
+    self._nextQuery = 0
+
+  def run(self):
+    """Crawls every query of the job, and writes the reports"""
+
+    reportWriters = []
+    formatClass = report_handler.REPORT_FORMATS[self._reportFormat]
+    root, extension = os.path.splitext(formatClass.FILE_NAME)
+
+    # The statistics are of the source statements of every query
+    headers = github_explorer.reportHeaders("|".join(
+        self._crawlOptions['sharedRepositories'].statements()), self._clone,
+        self._crawlOptions.get('statementStats'))
+
+    if self._combinedReport:
+      reportWriter = report_handler.ReportWriter(headers + ["query"],
+          self._languages, self._logger, reportFormat=self._reportFormat)
+      reportWriters = [reportWriter] * len(self._queries)
+    else:
+      for query in self._queries:
+        reportWriters.append(report_handler.ReportWriter(headers,
+            self._languages, self._logger,
+            fileName="%s_%s%s" %(root, re.sub(r"[^\w.-]", "_",
+                                              query['name']), extension),
+            reportFormat=self._reportFormat))
+
+    for reportWriter in set(reportWriters):
+      reportWriter.start()
+
+    executions = []
+    for executionNumber in range(1, len(self._loggers) + 1):
+      execution = threading.Thread(target=self._execute,
+                                   args=(executionNumber, reportWriters))
+      executions.append(execution)
+      execution.start()
+
+    for execution in executions:
+      execution.join()
+
+    for reportWriter in set(reportWriters):
+      reportWriter.close()
+
+    self._logger.info("Job of %d queries is complete" %len(self._queries))
+
+  def _execute(self, executionNumber, reportWriters):
+    """Crawls the queries with pages left, one after the other (an
+    execution)
+
+    Args:
+      executionNumber: The number of the execution (starting at 1)
+      reportWriters: The list of the ReportWriters of each query
+
+    """
+
+    logger = self._loggers[executionNumber - 1]
+
+    while True:
+      with self._lock:
+        queryNumber = self._nextQuery
+      if queryNumber >= len(self._queries):
+        break
+
+      query = self._queries[queryNumber]
+      language, keywords, sourceStatements = github_explorer.formatQuery(
+          query['language'], query['keywords'], query['sourceStatements'])
+      logger.info("Crawling query %s" %query['name'])
+
+      crawlOptions = dict(self._crawlOptions)
+      if crawlOptions.get('storeCrawl') != None:
+        crawlOptions['storeCrawl'] += "/" + query['name']
+
+      repositoryHandler = repository_handler.RepositoryHandler(self._headers,
+          self._languages, language, keywords, sourceStatements, self._clone,
+          executionNumber, len(self._loggers), logger,
+          pageScheduler=self._pageSchedulers[queryNumber],
+          reportQueue=reportWriters[queryNumber].queue,
+          reportTag=query['name'] if self._combinedReport else None,
+          **crawlOptions)
+
+      if self._engine == "loop":
+        repositoryHandler.crawlRepositoriesAsync()
+      else:
+        repositoryHandler.crawlRepositories()
+
+      # The search results of the query ran out, the next query is up
+      with self._lock:
+        self._nextQuery = max(self._nextQuery, queryNumber + 1)
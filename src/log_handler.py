@@ -0,0 +1,236 @@
+import logging
+import threading
+from datetime import datetime
+try: import simplejson as json
+except ImportError: import json
+
+# The structured fields a log record can carry (as the extra of a log call)
+_FIELDS = ["repo", "stage", "duration", "bytes"]
+
+
+def parseSampling(specification):
+  """Parses the sampling rates of the stages (ex: "clone=0.1,done=0.01")
+
+  Args:
+    specification: The comma separated pairs of a stage and the fraction of
+                   its log records that are kept (between 0 and 1)
+
+  Returns:
+    The dictionary of the sampling rate of each stage
+
+  """
+
+  rates = {}
+
+  for pair in specification.split(","):
+    if pair.strip() == "":
+      continue
+    stage, separator, rate = pair.partition("=")
+    if separator == "" or stage.strip() == "":
+      raise ValueError("%s is not a stage=rate pair" %pair)
+    rates[stage.strip()] = float(rate)
+    if not 0 <= rates[stage.strip()] <= 1:
+      raise ValueError("The rate of %s is not between 0 and 1" %stage)
+
+  return rates
+
+
+class JSONFormatter(logging.Formatter):
+
+  """This class formats the log records as JSON lines
+
+  Each record becomes a JSON object on one line, with the time, level,
+  logger and message of the record, followed by the structured fields (see
+  _FIELDS) that the record carries.
+
+  """
+
+  def format(self, record):
+    """Formats a log record as a JSON object on one line
+
+    Args:
+      record: The log record
+
+    Returns:
+      The JSON line of the record
+
+    """
+
+    line = {"time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname, "logger": record.name,
+            "message": record.getMessage()}
+
+    for field in _FIELDS:
+      value = getattr(record, field, None)
+      if value != None:
+        line[field] = value
+
+    if record.exc_info:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      line["exception"] = record.exc_text
+
+    return json.dumps(line)
+
+
+class SamplingFilter(logging.Filter):
+
+  """This class samples the log records of the stages
+
+  A stage with a sampling rate only lets that fraction of its records
+  through, evenly spread (a rate of 0.1 keeps the first record and every
+  tenth one after it). The warnings and errors are always kept, as are the
+  records of the stages without a rate.
+
+  """
+
+  # The dictionary of the sampling rate of each stage
+  _rates = None
+
+  # The dictionary of the credit each sampled stage has towards its next record
+  _credits = None
+
+  # Lock guarding the credits
+  _lock = None
+
+  def __init__(self, rates):
+    """Constructs a filter that samples the log records of the stages
+
+    Args:
+      rates: The dictionary of the sampling rate of each stage
+
+    """
+
+    logging.Filter.__init__(self)
+    self._rates = rates
+    self._credits = dict((stage, 1.0) for stage in rates)
+    self._lock = threading.Lock()
+
+  def filter(self, record):
+    """Decides whether a log record is kept
+
+    Args:
+      record: The log record
+
+    Returns:
+      True if the record is kept, otherwise false
+
+    """
+
+    stage = getattr(record, "stage", None)
+
+    if record.levelno >= logging.WARNING or stage not in self._rates:
+      return True
+
+    with self._lock:
+      self._credits[stage] += self._rates[stage]
+      if self._credits[stage] < 1:
+        return False
+      self._credits[stage] -= 1
+      return True
+
+
+class QueueHandler(logging.Handler):
+
+  """This class hands the log records over to a queue
+
+  The executions log through this handler, so that the formatting and the
+  writing of the records happen in a QueueListener instead of their own
+  thread. The message of a record is formatted beforehand, and its arguments
+  and exception are dropped, so that the record can also be passed between
+  processes (over a multiprocessing.Queue).
+
+  """
+
+  # The queue the log records are put on
+  queue = None
+
+  def __init__(self, queue):
+    """Constructs a handler that puts the log records on a queue
+
+    Args:
+      queue: The queue the log records are put on (Queue.Queue or
+             multiprocessing.Queue)
+
+    """
+
+    logging.Handler.__init__(self)
+    self.queue = queue
+
+  def emit(self, record):
+    """Puts a log record on the queue
+
+    Args:
+      record: The log record
+
+    """
+
+    try:
+      record.msg = record.getMessage()
+      record.args = None
+      if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+      self.queue.put_nowait(record)
+    except Exception:
+      self.handleError(record)
+
+
+class QueueListener():
+
+  """This class handles the log records that arrive on a queue
+
+  A thread of the listener takes the log records from the queue and hands
+  them to the handlers (whose level they reach), until the listener is
+  stopped.
+
+  """
+
+  # The queue the log records arrive on
+  queue = None
+
+  # The list of handlers of the log records
+  _handlers = None
+
+  # The thread handling the log records
+  _thread = None
+
+  def __init__(self, queue, handlers):
+    """Constructs a listener of the log records of a queue
+
+    Args:
+      queue: The queue the log records arrive on
+      handlers: The list of handlers of the log records
+
+    """
+
+    self.queue = queue
+    self._handlers = handlers
+
+  def start(self):
+    """Starts handling the log records"""
+
+    self._thread = threading.Thread(target=self._handleRecords)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Handles the log records left on the queue, then closes the handlers"""
+
+    self.queue.put(None)
+    self._thread.join()
+
+    for handler in self._handlers:
+      handler.close()
+
+  def _handleRecords(self):
+    """Hands the log records over to the handlers until the listener stops"""
+
+    while True:
+      record = self.queue.get()
+      if record == None:
+        break
+
+      for handler in self._handlers:
+        if record.levelno >= handler.level:
+          handler.handle(record)
@@ -0,0 +1,636 @@
+import collections
+import errno
+import fcntl
+import heapq
+import os
+import select
+import socket
+import sys
+import threading
+import time
+import types
+from multiprocessing.pool import ThreadPool
+
+
+class Return(Exception):
+
+  """This exception returns a value from a coroutine
+
+  Generators can't return a value in this version of Python, so a coroutine
+  raises Return(value) instead.
+
+  """
+
+  def __init__(self, value=None):
+    """Constructor that sets the returned value
+
+    Args:
+      value: The value returned by the coroutine
+
+    """
+
+    Exception.__init__(self)
+    self.value = value
+
+
+class Future():
+
+  """This class holds the result of an operation that hasn't finished yet
+
+  A coroutine yields a future to wait for its result; the yield evaluates to
+  the result, or raises the exception of the operation.
+
+  """
+
+  # Flag that indicates the operation finished
+  _done = False
+
+  # The result of the operation
+  _result = None
+
+  # The (type, value, traceback) of the exception of the operation (or None)
+  _exceptionInfo = None
+
+  # The functions called with the future once it is done
+  _callbacks = None
+
+  def __init__(self):
+    """Constructor that sets up an unfinished future"""
+
+    self._callbacks = []
+
+  def done(self):
+    """Determines if the operation finished
+
+    Returns:
+      True if the future has its result (or exception), otherwise False
+
+    """
+
+    return self._done
+
+  def result(self):
+    """Acquires the result of the finished operation
+
+    Returns:
+      The result of the operation (the exception of the operation is raised)
+
+    """
+
+    if self._exceptionInfo != None:
+      raise self._exceptionInfo[0], self._exceptionInfo[1], \
+            self._exceptionInfo[2]
+
+    return self._result
+
+  def exceptionInfo(self):
+    """Acquires the exception of the finished operation
+
+    Returns:
+      The (type, value, traceback) of the exception, or None
+
+    """
+
+    return self._exceptionInfo
+
+  def setResult(self, result):
+    """Finishes the operation with a result
+
+    Args:
+      result: The result of the operation
+
+    """
+
+    if not self._done:
+      self._result = result
+      self._finish()
+
+  def setException(self, exceptionInfo):
+    """Finishes the operation with an exception
+
+    Args:
+      exceptionInfo: The (type, value, traceback) of the exception
+
+    """
+
+    if not self._done:
+      self._exceptionInfo = exceptionInfo
+      self._finish()
+
+  def addCallback(self, callback):
+    """Adds a function to call with the future once it is done
+
+    Args:
+      callback: The function taking the future
+
+    """
+
+    if self._done:
+      callback(self)
+    else:
+      self._callbacks.append(callback)
+
+  def _finish(self):
+    """Marks the future as done and calls its callbacks"""
+
+    self._done = True
+    callbacks, self._callbacks = self._callbacks, None
+
+    for callback in callbacks:
+      callback(self)
+
+
+class Task(Future):
+
+  """This class runs a coroutine on the event loop
+
+  A coroutine is a generator that yields futures to wait for them, or other
+  coroutines to call them. The coroutines it calls run within the same task
+  (on a stack of generators) instead of being tasks of their own, so a call
+  costs no more than its generator. The task is a future of the result of
+  the coroutine.
+
+  """
+
+  # The event loop the task runs on
+  _loop = None
+
+  # The stack of the generators being run, the innermost one last
+  _stack = None
+
+  def __init__(self, loop, coroutine):
+    """Constructor that schedules the first step of the coroutine
+
+    Args:
+      loop: The event loop the task runs on
+      coroutine: The generator of the coroutine
+
+    """
+
+    Future.__init__(self)
+    self._loop = loop
+    self._stack = [coroutine]
+    loop.callSoon(self._step, None, None)
+
+  def _step(self, value, exceptionInfo):
+    """Runs the coroutines until they wait on a future, or finish
+
+    Args:
+      value: The value sent into the innermost generator
+      exceptionInfo: The exception thrown into the innermost generator (or
+                     None)
+
+    """
+
+    while self._stack:
+      generator = self._stack[-1]
+
+      try:
+        if exceptionInfo != None:
+          yielded = generator.throw(*exceptionInfo)
+        else:
+          yielded = generator.send(value)
+      except Return, returned:
+        self._stack.pop()
+        value, exceptionInfo = returned.value, None
+        continue
+      except StopIteration:
+        self._stack.pop()
+        value, exceptionInfo = None, None
+        continue
+      except Exception:
+        self._stack.pop()
+        value, exceptionInfo = None, sys.exc_info()
+        continue
+
+      value, exceptionInfo = None, None
+
+      if isinstance(yielded, types.GeneratorType):
+        self._stack.append(yielded)
+      elif isinstance(yielded, Future):
+        yielded.addCallback(self._wakeUp)
+        return
+      else:
+        exceptionInfo = (TypeError, TypeError("Coroutines must yield a "
+                         "future or a generator, not %r" %(yielded,)), None)
+
+    if exceptionInfo != None:
+      self.setException(exceptionInfo)
+    else:
+      self.setResult(value)
+
+  def _wakeUp(self, future):
+    """Resumes the coroutines once the awaited future is done
+
+    Args:
+      future: The future that was awaited
+
+    """
+
+    if future.exceptionInfo() != None:
+      self._loop.callSoon(self._step, None, future.exceptionInfo())
+    else:
+      self._loop.callSoon(self._step, future.result(), None)
+
+
+class EventLoop():
+
+  """This class runs coroutines concurrently on a single thread
+
+  The loop waits on the sockets of the coroutines with poll, and on their
+  timers with a heap, so any number of coroutines can be waiting at once for
+  little more than their generators. Work that would block the loop (such
+  as disk bound or CPU bound handling) runs on a small pool of threads
+  instead, and its result is handed back to the loop through a pipe that
+  wakes it up.
+
+  """
+
+  # The callbacks ready to be called, as (function, arguments) tuples
+  _ready = None
+
+  # The heap of timers, as (deadline, sequence, function, arguments) tuples
+  _timers = None
+
+  # The sequence number of the last timer (keeps the heap order stable)
+  _timerSequence = 0
+
+  # The futures waiting for a socket to be readable, by file descriptor
+  _readers = None
+
+  # The futures waiting for a socket to be writable, by file descriptor
+  _writers = None
+
+  # The poll object of the sockets being waited on
+  _poll = None
+
+  # The callbacks handed over by other threads
+  _threadCallbacks = None
+
+  # Lock guarding the callbacks handed over by other threads
+  _threadLock = None
+
+  # The pipe waking up the loop, as (read end, write end) file descriptors
+  _wakeUpPipe = None
+
+  # The number of threads running blocking work
+  _threads = None
+
+  # The pool of threads running blocking work (made when first needed)
+  _threadPool = None
+
+  def __init__(self, threads=1):
+    """Constructor that sets up an idle loop
+
+    Args:
+      threads: The number of threads running the blocking work handed to
+               runInThread
+
+    """
+
+    self._ready = collections.deque()
+    self._timers = []
+    self._readers = {}
+    self._writers = {}
+    self._poll = select.poll()
+    self._threadCallbacks = []
+    self._threadLock = threading.Lock()
+    self._threads = max(1, threads)
+
+    self._wakeUpPipe = os.pipe()
+    for descriptor in self._wakeUpPipe:
+      _setNonBlocking(descriptor)
+    self._poll.register(self._wakeUpPipe[0], select.POLLIN)
+
+  def spawn(self, coroutine):
+    """Starts running a coroutine as a task of its own
+
+    Args:
+      coroutine: The generator of the coroutine
+
+    Returns:
+      The Task of the coroutine (a future of its result)
+
+    """
+
+    return Task(self, coroutine)
+
+  def run(self, coroutine):
+    """Runs the loop until a coroutine (or a future) finishes
+
+    Args:
+      coroutine: The generator of the coroutine, or a future
+
+    Returns:
+      The result of the coroutine (its exception is raised)
+
+    """
+
+    future = coroutine
+    if isinstance(coroutine, types.GeneratorType):
+      future = self.spawn(coroutine)
+
+    while not future.done():
+      self._runOnce()
+
+    return future.result()
+
+  def close(self):
+    """Closes the wake up pipe and the pool of threads"""
+
+    if self._threadPool != None:
+      self._threadPool.close()
+      self._threadPool.join()
+
+    for descriptor in self._wakeUpPipe:
+      os.close(descriptor)
+
+  def gather(self, coroutines):
+    """Runs coroutines concurrently and waits for all of them
+
+    Args:
+      coroutines: The generators of the coroutines
+
+    Returns:
+      A future of the list of their results, in the given order (the first
+      exception is raised instead)
+
+    """
+
+    tasks = [self.spawn(coroutine) for coroutine in coroutines]
+    future = Future()
+    remaining = [len(tasks)]
+
+    def taskDone(task):
+      remaining[0] -= 1
+      if task.exceptionInfo() != None:
+        future.setException(task.exceptionInfo())
+      elif remaining[0] == 0:
+        future.setResult([task.result() for task in tasks])
+
+    if len(tasks) == 0:
+      future.setResult([])
+
+    for task in tasks:
+      task.addCallback(taskDone)
+
+    return future
+
+  def sleep(self, seconds):
+    """Waits without blocking the loop
+
+    Args:
+      seconds: The number of seconds to wait
+
+    Returns:
+      A future that is done after the given time
+
+    """
+
+    future = Future()
+    self.callLater(seconds, future.setResult, None)
+    return future
+
+  def waitReadable(self, descriptor, timeout=None):
+    """Waits for a socket to be readable
+
+    Args:
+      descriptor: The file descriptor of the socket
+      timeout: The number of seconds after which socket.timeout is raised
+               (None waits forever)
+
+    Returns:
+      A future that is done once the socket is readable
+
+    """
+
+    return self._waitSocket(self._readers, descriptor, timeout)
+
+  def waitWritable(self, descriptor, timeout=None):
+    """Waits for a socket to be writable
+
+    Args:
+      descriptor: The file descriptor of the socket
+      timeout: The number of seconds after which socket.timeout is raised
+               (None waits forever)
+
+    Returns:
+      A future that is done once the socket is writable
+
+    """
+
+    return self._waitSocket(self._writers, descriptor, timeout)
+
+  def runInThread(self, function, *arguments):
+    """Runs blocking work on the pool of threads
+
+    Args:
+      function: The function doing the work
+      arguments: The arguments of the function
+
+    Returns:
+      A future of the result of the function
+
+    """
+
+    if self._threadPool == None:
+      self._threadPool = ThreadPool(self._threads)
+
+    future = Future()
+
+    def run():
+      try:
+        result = function(*arguments)
+      except Exception:
+        self.callSoonThreadsafe(future.setException, sys.exc_info())
+      else:
+        self.callSoonThreadsafe(future.setResult, result)
+
+    self._threadPool.apply_async(run)
+    return future
+
+  def callSoon(self, function, *arguments):
+    """Schedules a function to be called by the loop
+
+    Args:
+      function: The function to call
+      arguments: The arguments of the function
+
+    """
+
+    self._ready.append((function, arguments))
+
+  def callLater(self, delay, function, *arguments):
+    """Schedules a function to be called by the loop after a delay
+
+    Args:
+      delay: The number of seconds to wait before calling the function
+      function: The function to call
+      arguments: The arguments of the function
+
+    Returns:
+      The timer, which can be passed to cancelTimer
+
+    """
+
+    self._timerSequence += 1
+    timer = [time.time() + delay, self._timerSequence, function, arguments]
+    heapq.heappush(self._timers, timer)
+    return timer
+
+  def cancelTimer(self, timer):
+    """Cancels a timer that hasn't gone off yet
+
+    Args:
+      timer: The timer returned by callLater
+
+    """
+
+    timer[2] = None
+
+  def callSoonThreadsafe(self, function, *arguments):
+    """Schedules a function to be called by the loop, from another thread
+
+    Args:
+      function: The function to call
+      arguments: The arguments of the function
+
+    """
+
+    with self._threadLock:
+      self._threadCallbacks.append((function, arguments))
+
+    try:
+      os.write(self._wakeUpPipe[1], "x")
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise  # A full pipe already wakes up the loop
+
+  def _waitSocket(self, waiters, descriptor, timeout):
+    """Waits for a socket to be ready
+
+    Args:
+      waiters: The dictionary of the futures waiting to read or to write
+      descriptor: The file descriptor of the socket
+      timeout: The number of seconds after which socket.timeout is raised
+
+    Returns:
+      A future that is done once the socket is ready
+
+    """
+
+    future = Future()
+    waiters[descriptor] = future
+    self._updatePoll(descriptor)
+
+    if timeout != None:
+      def expire():
+        if waiters.get(descriptor) is future:
+          del waiters[descriptor]
+          self._updatePoll(descriptor)
+          future.setException((socket.timeout, socket.timeout("timed out"),
+                               None))
+
+      timer = self.callLater(timeout, expire)
+      future.addCallback(lambda future: self.cancelTimer(timer))
+
+    return future
+
+  def _updatePoll(self, descriptor):
+    """Registers a socket with poll for the events being waited on
+
+    Args:
+      descriptor: The file descriptor of the socket
+
+    """
+
+    events = 0
+    if descriptor in self._readers:
+      events |= select.POLLIN
+    if descriptor in self._writers:
+      events |= select.POLLOUT
+
+    if events:
+      self._poll.register(descriptor, events)
+    else:
+      try: self._poll.unregister(descriptor)
+      except KeyError: pass
+
+  def _runOnce(self):
+    """Waits for the sockets and timers, and calls the ready callbacks"""
+
+    timeout = None
+    if self._ready:
+      timeout = 0
+    elif self._timers:
+      timeout = max(0, self._timers[0][0] - time.time())
+
+    try:
+      events = self._poll.poll(None if timeout == None else timeout * 1000)
+    except select.error, e:
+      if e.args[0] != errno.EINTR:
+        raise
+      events = []
+
+    for descriptor, event in events:
+      if descriptor == self._wakeUpPipe[0]:
+        self._takeThreadCallbacks()
+        continue
+
+      # Errors and hang ups wake up both sides, which then see the failure
+      if event & (select.POLLIN | select.POLLERR | select.POLLHUP):
+        self._wakeWaiter(self._readers, descriptor)
+      if event & (select.POLLOUT | select.POLLERR | select.POLLHUP):
+        self._wakeWaiter(self._writers, descriptor)
+
+    now = time.time()
+    while self._timers and self._timers[0][0] <= now:
+      deadline, sequence, function, arguments = heapq.heappop(self._timers)
+      if function != None:
+        self._ready.append((function, arguments))
+
+    for index in range(len(self._ready)):
+      function, arguments = self._ready.popleft()
+      function(*arguments)
+
+  def _wakeWaiter(self, waiters, descriptor):
+    """Finishes the future waiting on a ready socket
+
+    Args:
+      waiters: The dictionary of the futures waiting to read or to write
+      descriptor: The file descriptor of the ready socket
+
+    """
+
+    future = waiters.pop(descriptor, None)
+    self._updatePoll(descriptor)
+
+    if future != None:
+      future.setResult(None)
+
+  def _takeThreadCallbacks(self):
+    """Moves the callbacks handed over by other threads to the ready ones"""
+
+    try:
+      while os.read(self._wakeUpPipe[0], 4096):
+        pass
+    except OSError, e:
+      if e.errno != errno.EAGAIN:
+        raise
+
+    with self._threadLock:
+      callbacks, self._threadCallbacks = self._threadCallbacks, []
+
+    self._ready.extend(callbacks)
+
+
+def _setNonBlocking(descriptor):
+  """Makes a file descriptor non-blocking
+
+  Args:
+    descriptor: The file descriptor
+
+  """
+
+  flags = fcntl.fcntl(descriptor, fcntl.F_GETFL)
+  fcntl.fcntl(descriptor, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -0,0 +1,416 @@
+import BaseHTTPServer
+import bisect
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+try: import simplejson as json
+except ImportError: import json
+
+# The upper bounds of the latency histogram buckets in seconds (1ms to ~9min),
+# the last bucket counts everything above
+_BOUNDS = [0.001 * 2 ** exponent for exponent in range(20)]
+
+# The metrics handler shared by everything in this process
+_sharedMetricsHandler = None
+
+# Lock guarding the creation of the shared metrics handler
+_sharedLock = threading.Lock()
+
+
+def getMetricsHandler():
+  """Acquires the metrics handler that is shared by the whole process
+
+  The first caller creates the metrics handler, every later caller receives
+  that same metrics handler. A worker process (forked from the driver) gets
+  its own metrics handler, instead of adding to the copy of the driver's.
+
+  Returns:
+    The MetricsHandler shared by the whole process
+
+  """
+
+  global _sharedMetricsHandler
+
+  with _sharedLock:
+    if _sharedMetricsHandler == None or \
+       _sharedMetricsHandler.processId != os.getpid():
+      _sharedMetricsHandler = MetricsHandler()
+
+  return _sharedMetricsHandler
+
+
+class MetricsHandler():
+
+  """This class keeps the metrics of the crawl
+
+  There are three kinds of metrics: counters (ex: API retries, bytes
+  cloned), gauges (ex: queue depths) and latency histograms (ex: of the API
+  calls or the clone stage). A histogram counts the latencies in buckets
+  whose bounds double from 1ms, along with their count, sum and maximum, so
+  recording a latency is a few operations under a lock. The gauges are
+  functions that are only called when a snapshot is taken, gauges of the
+  same name are added up. Snapshots of several processes can be merged.
+
+  """
+
+  # The ID of the process the metrics handler belongs to
+  processId = None
+
+  # The counters by name
+  _counters = None
+
+  # The lists of the gauge functions by name
+  _gauges = None
+
+  # The histograms by name, as [count, sum, max, bucket counts]
+  _histograms = None
+
+  # Lock guarding the metrics
+  _lock = None
+
+  def __init__(self):
+    """Constructor that starts out without any metrics"""
+
+    self.processId = os.getpid()
+    self._counters = {}
+    self._gauges = {}
+    self._histograms = {}
+    self._lock = threading.Lock()
+
+  def increment(self, name, amount=1):
+    """Adds to a counter
+
+    Args:
+      name: The name of the counter
+      amount: The amount added
+
+    """
+
+    with self._lock:
+      self._counters[name] = self._counters.get(name, 0) + amount
+
+  def observe(self, name, seconds):
+    """Records a latency in a histogram
+
+    Args:
+      name: The name of the histogram
+      seconds: The latency in seconds
+
+    """
+
+    bucket = bisect.bisect_left(_BOUNDS, seconds)
+
+    with self._lock:
+      histogram = self._histograms.get(name)
+      if histogram == None:
+        histogram = self._histograms[name] = [0, 0.0, 0.0,
+                                              [0] * (len(_BOUNDS) + 1)]
+
+      histogram[0] += 1
+      histogram[1] += seconds
+      histogram[2] = max(histogram[2], seconds)
+      histogram[3][bucket] += 1
+
+  @contextmanager
+  def timer(self, name):
+    """Records the latency of a block of code in a histogram (a context
+    manager)
+
+    Args:
+      name: The name of the histogram
+
+    Yields:
+      A dictionary whose 'duration' is set once the block is done
+
+    """
+
+    timing = {}
+    startTime = time.time()
+    try:
+      yield timing
+    finally:
+      timing['duration'] = time.time() - startTime
+      self.observe(name, timing['duration'])
+
+  def addGauge(self, name, function):
+    """Adds a gauge function, which is called whenever a snapshot is taken
+
+    Args:
+      name: The name of the gauge
+      function: The function returning the current value of the gauge
+
+    """
+
+    with self._lock:
+      self._gauges.setdefault(name, []).append(function)
+
+  def snapshot(self):
+    """Takes a snapshot of the metrics
+
+    Returns:
+      A JSON friendly dictionary of the 'counters', 'gauges' and
+      'histograms' (as dictionaries of the 'count', 'sum', 'max' and
+      'buckets') by name
+
+    """
+
+    with self._lock:
+      counters = dict(self._counters)
+      gauges = dict((name, list(functions))
+                    for name, functions in self._gauges.iteritems())
+      histograms = dict((name, {'count': histogram[0], 'sum': histogram[1],
+                                'max': histogram[2],
+                                'buckets': list(histogram[3])})
+                        for name, histogram in self._histograms.iteritems())
+
+    # The gauges are called outside of the lock, they take locks of their own
+    gauges = dict((name, sum(function() for function in functions))
+                  for name, functions in gauges.iteritems())
+
+    return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+
+def mergeSnapshots(snapshots):
+  """Merges the snapshots of several processes
+
+  The counters, gauges and histograms of the same name are added up.
+
+  Args:
+    snapshots: The list of snapshots (see MetricsHandler.snapshot)
+
+  Returns:
+    The merged snapshot
+
+  """
+
+  merged = {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+  for snapshot in snapshots:
+    for kind in ('counters', 'gauges'):
+      for name, value in snapshot[kind].iteritems():
+        merged[kind][name] = merged[kind].get(name, 0) + value
+
+    for name, histogram in snapshot['histograms'].iteritems():
+      mergedHistogram = merged['histograms'].get(name)
+      if mergedHistogram == None:
+        merged['histograms'][name] = {'count': histogram['count'],
+                                      'sum': histogram['sum'],
+                                      'max': histogram['max'],
+                                      'buckets': list(histogram['buckets'])}
+        continue
+
+      mergedHistogram['count'] += histogram['count']
+      mergedHistogram['sum'] += histogram['sum']
+      mergedHistogram['max'] = max(mergedHistogram['max'], histogram['max'])
+      mergedHistogram['buckets'] = [first + second for first, second in
+                                    zip(mergedHistogram['buckets'],
+                                        histogram['buckets'])]
+
+  return merged
+
+
+def _summarize(histogram):
+  """Adds the mean and the estimated percentiles to a histogram
+
+  A percentile is estimated as the upper bound of the bucket it falls in
+  (the maximum for the last bucket).
+
+  Args:
+    histogram: The histogram of a snapshot
+
+  """
+
+  count = histogram['count']
+  histogram['mean'] = histogram['sum'] / count if count > 0 else 0.0
+
+  for percentile in (50, 90, 99):
+    rank = count * percentile / 100.0
+    seen = 0
+    estimate = 0.0
+
+    for bucket, bucketCount in enumerate(histogram['buckets']):
+      seen += bucketCount
+      if bucketCount > 0 and seen >= rank:
+        estimate = _BOUNDS[bucket] if bucket < len(_BOUNDS) else \
+                   histogram['max']
+        break
+
+    histogram['p%d' %percentile] = min(estimate, histogram['max'])
+
+
+class MetricsReporter():
+
+  """This class exposes the metrics of the crawl while it runs
+
+  The metrics of this process are merged with the latest snapshots of the
+  worker processes (which are handed over as they arrive), and regularly
+  written to a JSON snapshot file, which is replaced atomically so it can be
+  read at any time. The merged metrics can also be served over HTTP, on the
+  local interface only (ex: curl http://127.0.0.1:PORT/metrics).
+
+  """
+
+  # The metrics handler of this process
+  _metricsHandler = None
+
+  # The file name of the snapshot file (or None)
+  _fileName = None
+
+  # The number of seconds between writing the snapshot file
+  _interval = None
+
+  # The port of the HTTP endpoint (or None)
+  _port = None
+
+  # The latest snapshots of the worker processes, by process number
+  _snapshots = None
+
+  # The time the reporting started
+  _startTime = None
+
+  # The event that stops the writing of the snapshot file
+  _stopped = None
+
+  # The thread that writes the snapshot file
+  _thread = None
+
+  # The HTTP server of the endpoint
+  _server = None
+
+  # Lock guarding the snapshots of the worker processes
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, metricsHandler, fileName, interval, port, logger):
+    """Constructor that sets up the reporter (which still has to be started)
+
+    Args:
+      metricsHandler: The MetricsHandler of this process
+      fileName: The file name of the snapshot file (None disables it)
+      interval: The number of seconds between writing the snapshot file
+      port: The port of the HTTP endpoint (None disables it)
+      logger: The custom logger to be used for the reporter
+
+    """
+
+    self._metricsHandler = metricsHandler
+    self._fileName = fileName
+    self._interval = interval
+    self._port = port
+    self._snapshots = {}
+    self._stopped = threading.Event()
+    self._lock = threading.Lock()
+    self._logger = logger
+
+  def start(self):
+    """Starts writing the snapshot file and serving the HTTP endpoint"""
+
+    self._startTime = time.time()
+
+    if self._fileName != None:
+      self._thread = threading.Thread(target=self._run)
+      self._thread.daemon = True
+      self._thread.start()
+
+    if self._port != None:
+      self._server = BaseHTTPServer.HTTPServer(("127.0.0.1", self._port),
+                                               _MetricsRequestHandler)
+      self._server.reporter = self
+      thread = threading.Thread(target=self._server.serve_forever)
+      thread.daemon = True
+      thread.start()
+      self._logger.info("Metrics are served on http://127.0.0.1:%d/metrics"
+                        %self._server.server_port)
+
+  def update(self, processNumber, snapshot):
+    """Hands over the latest snapshot of a worker process
+
+    Args:
+      processNumber: The process number of the worker process
+      snapshot: The snapshot of its metrics (see MetricsHandler.snapshot)
+
+    """
+
+    with self._lock:
+      self._snapshots[processNumber] = snapshot
+
+  def snapshot(self):
+    """Takes the snapshot of the metrics of this and the worker processes
+
+    Returns:
+      The merged snapshot, along with the 'time', the 'uptime' in seconds,
+      the number of 'processes' and the 'bounds' of the histogram buckets,
+      and the 'mean' and estimated 'p50', 'p90' and 'p99' of each histogram
+
+    """
+
+    with self._lock:
+      snapshots = self._snapshots.values()
+
+    merged = mergeSnapshots([self._metricsHandler.snapshot()] + snapshots)
+    for histogram in merged['histograms'].itervalues():
+      _summarize(histogram)
+
+    merged['time'] = time.time()
+    merged['uptime'] = merged['time'] - self._startTime
+    merged['processes'] = 1 + len(snapshots)
+    merged['bounds'] = _BOUNDS
+    return merged
+
+  def close(self):
+    """Writes the final snapshot file and stops the HTTP endpoint"""
+
+    self._stopped.set()
+    if self._thread != None:
+      self._thread.join()
+      self._write()
+
+    if self._server != None:
+      self._server.shutdown()
+      self._server.server_close()
+
+  def _run(self):
+    """Writes the snapshot file regularly until the reporter is closed"""
+
+    while not self._stopped.wait(self._interval):
+      try:
+        self._write()
+      except (IOError, OSError), e:
+        self._logger.warn("Unable to write the metrics snapshot -> %s" %e)
+
+  def _write(self):
+    """Writes the snapshot file, replacing it atomically"""
+
+    directory = os.path.dirname(os.path.abspath(self._fileName))
+    descriptor, temporaryPath = tempfile.mkstemp(dir=directory,
+                                                 prefix=".metrics")
+    with os.fdopen(descriptor, 'w') as snapshotFile:
+      json.dump(self.snapshot(), snapshotFile, indent=1, sort_keys=True)
+
+    os.rename(temporaryPath, self._fileName)
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  """This class serves the metrics snapshot over HTTP"""
+
+  def do_GET(self):
+    """Serves the snapshot as JSON on /metrics"""
+
+    if self.path.split("?")[0] != "/metrics":
+      self.send_error(404)
+      return
+
+    body = json.dumps(self.server.reporter.snapshot(), sort_keys=True)
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *arguments):
+    pass  # The requests aren't logged
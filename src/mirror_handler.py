@@ -0,0 +1,347 @@
+import fcntl
+import os
+import shutil
+import subprocess
+import threading
+import time
+try: import simplejson as json
+except ImportError: import json
+
+
+class MirrorHandler():
+
+  """This class keeps a local store of bare mirrors of the cloned repositories
+
+  Every repository gets a bare mirror in the store, under its owner and name
+  (ex: store/owner/name.git). The first clone of a repository makes the
+  mirror, later clones (also those of later crawls) only fetch what changed
+  into it. The working copies are then cloned from the mirror locally, which
+  hard links the objects instead of copying them. A mirror is locked while it
+  is being updated and cloned from, so concurrent executions (threads or
+  processes) wait on each other instead of fetching the same mirror twice; an
+  execution that waited on a fetch doesn't fetch again. The store is kept
+  within its disk budget by removing the least recently used mirrors, which
+  are recorded in a small index file.
+
+  """
+
+  # The name of the index file of the store
+  _INDEX_NAME = "index.json"
+
+  # The directory of the store
+  _directory = None
+
+  # The maximum number of bytes taken by the mirrors of the store
+  _maxBytes = None
+
+  # The lock file descriptors held by each thread, by mirror name
+  _local = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, directory, maxBytes, logger):
+    """Constructor that sets up the store
+
+    Args:
+      directory: The directory of the store
+      maxBytes: The maximum number of bytes taken by the mirrors of the store
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._directory = directory
+    self._maxBytes = maxBytes
+    self._local = threading.local()
+    self._logger = logger
+
+    if not os.path.isdir(directory):
+      try: os.makedirs(directory)
+      except OSError: pass  # Made by another process in the meantime
+
+  def acquire(self, url, name):
+    """Acquires the up to date mirror of a repository, and locks it
+
+    The mirror is made if it isn't in the store yet, otherwise it is fetched
+    unless another execution fetched it while this one was waiting for the
+    lock. When the fetch fails the mirror is still used as it is. The lock
+    must be released once the mirror is no longer used.
+
+    Args:
+      url: The URL of the repository
+      name: The name of the mirror, as the repository's 'owner/name'
+
+    Returns:
+      A tuple of the path of the mirror (or None), and None if the mirror
+      was acquired or otherwise the error output of git
+
+    """
+
+    path = os.path.join(self._directory, name + ".git")
+    waitStart = time.time()
+    self._lock(name, fcntl.LOCK_EX)
+
+    if not os.path.isdir(path):
+      error = self._makeMirror(url, path)
+      if error != None:
+        self.release(name)
+        return None, error
+    elif self._fetchTime(path) < waitStart:
+      self._logger.info("Fetching mirror %s" %name)
+      error = self._git(['--git-dir', path, 'fetch', '--prune', '--quiet',
+                         'origin'])
+      if error != None:
+        self._logger.warn("Unable to fetch mirror %s, using it as it is (%s)"
+                          %(name, error.strip()))
+      else:
+        self._touchFetchTime(path)
+    else:
+      self._logger.info("Mirror %s was just fetched, reusing it" %name)
+
+    self._updateIndex(name, self._directorySize(path))
+    return path, None
+
+  def release(self, name):
+    """Releases the lock of a mirror, and keeps the store within its budget
+
+    Args:
+      name: The name of the mirror, as the repository's 'owner/name'
+
+    """
+
+    self._unlock(name)
+    self._evict()
+
+  def _makeMirror(self, url, path):
+    """Makes the mirror of a repository
+
+    The mirror is made under a temporary name, so an interrupted mirror is
+    never taken for a complete one.
+
+    Args:
+      url: The URL of the repository
+      path: The path of the mirror
+
+    Returns:
+      None if the mirror was made, otherwise the error output of git
+
+    """
+
+    self._logger.info("Making mirror %s" %path)
+    temporaryPath = path + ".tmp"
+
+    if os.path.isdir(temporaryPath):
+      shutil.rmtree(temporaryPath, True)
+
+    error = self._git(['clone', '--mirror', '--quiet', url, temporaryPath])
+    if error != None:
+      shutil.rmtree(temporaryPath, True)
+      return error
+
+    os.rename(temporaryPath, path)
+    self._touchFetchTime(path)
+    return None
+
+  def _fetchTime(self, path):
+    """Acquires the time a mirror was last fetched
+
+    Args:
+      path: The path of the mirror
+
+    Returns:
+      The time of the last fetch (in seconds since the epoch), or 0
+
+    """
+
+    try:
+      return os.path.getmtime(os.path.join(path, "FETCH_STAMP"))
+    except OSError:
+      return 0
+
+  def _touchFetchTime(self, path):
+    """Records that a mirror was just fetched
+
+    Args:
+      path: The path of the mirror
+
+    """
+
+    with open(os.path.join(path, "FETCH_STAMP"), 'w'):
+      pass
+
+  def _lock(self, name, operation):
+    """Locks a mirror, the lock is held by an open lock file
+
+    Each call opens its own lock file, so the lock also keeps out the other
+    threads of this process.
+
+    Args:
+      name: The name of the mirror, as the repository's 'owner/name'
+      operation: The flock operation (ex: LOCK_EX or LOCK_EX | LOCK_NB)
+
+    Returns:
+      The descriptor of the lock file (raises IOError when LOCK_NB is used
+      and the mirror is locked)
+
+    """
+
+    path = os.path.join(self._directory, name + ".lock")
+    if not os.path.isdir(os.path.dirname(path)):
+      try: os.makedirs(os.path.dirname(path))
+      except OSError: pass  # Made by another execution in the meantime
+
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+    try:
+      fcntl.flock(descriptor, operation)
+    except IOError:
+      os.close(descriptor)
+      raise
+
+    self._descriptors()[name] = descriptor
+    return descriptor
+
+  def _unlock(self, name):
+    """Unlocks a mirror locked by this thread
+
+    Args:
+      name: The name of the mirror, as the repository's 'owner/name'
+
+    """
+
+    descriptor = self._descriptors().pop(name, None)
+    if descriptor != None:
+      os.close(descriptor)  # Closing the file releases the lock
+
+  def _descriptors(self):
+    """Acquires the lock file descriptors held by the current thread
+
+    Returns:
+      A dictionary of the lock file descriptors, by mirror name
+
+    """
+
+    if not hasattr(self._local, 'descriptors'):
+      self._local.descriptors = {}
+    return self._local.descriptors
+
+  def _updateIndex(self, name, size=None, remove=False):
+    """Records the use (or the removal) of a mirror in the index of the store
+
+    Args:
+      name: The name of the mirror, as the repository's 'owner/name'
+      size: The number of bytes taken by the mirror
+      remove: Flag that indicates that the mirror was removed
+
+    """
+
+    def update(index):
+      if remove:
+        index.pop(name, None)
+      else:
+        index[name] = {'size': size, 'used': time.time()}
+
+    self._withIndex(update)
+
+  def _evict(self):
+    """Removes the least recently used mirrors while the store is too large
+
+    Mirrors that are locked (in use) are left alone.
+
+    """
+
+    def candidates(index):
+      totalSize = sum(entry['size'] for entry in index.values())
+      names = sorted(index, key=lambda name: index[name]['used'])
+      return [(name, index[name]['size']) for name in names], totalSize
+
+    names, totalSize = self._withIndex(candidates)
+    for name, size in names:
+      if totalSize <= self._maxBytes:
+        break
+
+      try:
+        self._lock(name, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError:
+        continue  # The mirror is in use
+
+      try:
+        self._logger.info("Evicting mirror %s" %name)
+        shutil.rmtree(os.path.join(self._directory, name + ".git"), True)
+        self._updateIndex(name, remove=True)
+        totalSize -= size
+      finally:
+        self._unlock(name)
+
+  def _withIndex(self, function):
+    """Applies a function to the index while holding the lock on its file
+
+    Args:
+      function: The function that reads and modifies the index dictionary
+
+    Returns:
+      The result of the function
+
+    """
+
+    path = os.path.join(self._directory, self._INDEX_NAME)
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+
+    try:
+      fcntl.flock(descriptor, fcntl.LOCK_EX)
+      indexFile = os.fdopen(os.dup(descriptor), 'r+')
+
+      try:
+        index = json.loads(indexFile.read())
+      except ValueError:
+        index = {}
+
+      result = function(index)
+
+      indexFile.seek(0)
+      indexFile.truncate()
+      indexFile.write(json.dumps(index))
+      indexFile.close()
+
+      return result
+    finally:
+      os.close(descriptor)  # Closing the file releases the lock
+
+  def _directorySize(self, directory):
+    """Calculates the number of bytes taken by the files of a directory tree
+
+    Args:
+      directory: The root of the directory tree
+
+    Returns:
+      The total size of the files in bytes
+
+    """
+
+    totalSize = 0
+
+    for root, directories, files in os.walk(directory):
+      for name in files:
+        try: totalSize += os.lstat(os.path.join(root, name)).st_size
+        except OSError: pass
+
+    return totalSize
+
+  def _git(self, arguments):
+    """Runs a git command
+
+    Args:
+      arguments: The list of arguments of the git command
+
+    Returns:
+      None if the command succeeded, otherwise its error output
+
+    """
+
+    process = subprocess.Popen(['git'] + arguments, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, shell=False)
+    output, error = process.communicate()
+
+    if process.returncode != 0:
+      return error or "git exited with %d" %process.returncode
+
+    return None
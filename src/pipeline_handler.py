@@ -0,0 +1,361 @@
+import os
+import Queue
+import threading
+
+import metrics_handler
+
+# The pipeline shared by everything in this process
+_sharedPipeline = None
+
+# The disk budget shared by everything in this process
+_sharedDiskBudget = None
+
+# Lock guarding the creation of the shared pipeline and disk budget
+_sharedLock = threading.Lock()
+
+
+def getPipelineHandler(cloneWorkers, scanWorkers, cleanWorkers, logger):
+  """Acquires the pipeline of the clone, scan and clean stages that is shared
+  by the whole process
+
+  The first caller creates and starts the pipeline (with its numbers of
+  workers and logger), every later caller receives that same pipeline, so
+  the executions of a process share its worker threads. A worker process
+  (forked from the driver) gets its own pipeline.
+
+  Args:
+    cloneWorkers: The number of worker threads of the clone stage
+    scanWorkers: The number of worker threads of the scan stage
+    cleanWorkers: The number of worker threads of the clean stage
+    logger: The custom logger to be used for this executing process
+
+  Returns:
+    The PipelineHandler shared by the whole process
+
+  """
+
+  global _sharedPipeline
+
+  with _sharedLock:
+    if _sharedPipeline == None or _sharedPipeline.processId != os.getpid():
+      _sharedPipeline = PipelineHandler(logger)
+      for stage, workers in (("clone", cloneWorkers), ("scan", scanWorkers),
+                             ("clean", cleanWorkers)):
+        _sharedPipeline.addStage(stage, workers, 2 * workers)
+        metrics_handler.getMetricsHandler().addGauge("queue." + stage,
+            lambda pipeline=_sharedPipeline, stage=stage:
+              pipeline.queueDepths()[stage])
+      _sharedPipeline.start()
+
+  return _sharedPipeline
+
+
+def getDiskBudget(maxBytes):
+  """Acquires the budget of bytes taken by clones in progress that is shared
+  by the whole process
+
+  The first caller creates the budget (with its size), every later caller
+  receives that same budget, so the executions of a process stay within one
+  budget together. A worker process (forked from the driver) gets its own
+  budget.
+
+  Args:
+    maxBytes: The maximum number of bytes in use
+
+  Returns:
+    The DiskBudget shared by the whole process
+
+  """
+
+  global _sharedDiskBudget
+
+  with _sharedLock:
+    if _sharedDiskBudget == None or \
+       _sharedDiskBudget.processId != os.getpid():
+      _sharedDiskBudget = DiskBudget(maxBytes)
+      metrics_handler.getMetricsHandler().addGauge("disk.clone_bytes",
+                                                   _sharedDiskBudget.usedBytes)
+
+  return _sharedDiskBudget
+
+
+class PipelineHandler():
+
+  """This class runs the stages of handling cloned repositories concurrently
+
+  Every stage has its own pool of worker threads and its own bounded queue of
+  work. The items are put into the pipeline along with their batch, whose
+  stage functions handle them: a stage function handles one item and returns
+  the stage the item moves on to (or None once it is done), so the network
+  bound cloning, the disk bound cleaning and the CPU bound searching of
+  different repositories overlap. When a queue is full, putting more work
+  into it blocks, which holds back the stage (or the crawl) feeding it.
+
+  """
+
+  # The identifier of the process the pipeline belongs to
+  processId = None
+
+  # The names of the stages in the order the items flow through them
+  _order = None
+
+  # The number of worker threads of each stage
+  _workers = None
+
+  # The queue of each stage
+  _queues = None
+
+  # The worker threads of all the stages
+  _threads = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, logger):
+    """Constructor that sets up a pipeline without any stages
+
+    Args:
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self.processId = os.getpid()
+    self._order = []
+    self._workers = {}
+    self._queues = {}
+    self._threads = []
+    self._logger = logger
+
+  def addStage(self, name, workers, queueSize):
+    """Adds a stage to the end of the pipeline
+
+    Args:
+      name: The name of the stage
+      workers: The number of worker threads of the stage
+      queueSize: The maximum number of items waiting for the stage
+
+    """
+
+    self._order.append(name)
+    self._workers[name] = max(1, workers)
+    self._queues[name] = Queue.Queue(max(1, queueSize))
+
+  def start(self):
+    """Starts the worker threads of all the stages"""
+
+    for name in self._order:
+      for worker in range(self._workers[name]):
+        thread = threading.Thread(target=self._run, args=(name,))
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+  def put(self, name, item, batch):
+    """Puts an item into the queue of a stage (blocks while it is full)
+
+    Args:
+      name: The name of the stage
+      item: The item to be handled by the stage
+      batch: The PipelineBatch the item belongs to
+
+    """
+
+    batch.add()
+    self._queues[name].put((item, batch))
+
+  def queueDepths(self):
+    """Acquires the number of items waiting for each stage
+
+    Returns:
+      A dictionary of the number of waiting items, by stage name
+
+    """
+
+    return dict((name, self._queues[name].qsize()) for name in self._order)
+
+  def join(self):
+    """Waits until every item put into the pipeline is done
+
+    Items only move forward through the stages, so once a stage is drained
+    nothing new can arrive in it.
+
+    """
+
+    for name in self._order:
+      self._queues[name].join()
+
+  def close(self):
+    """Waits for the remaining items and stops the worker threads"""
+
+    self.join()
+
+    for name in self._order:
+      for worker in range(self._workers[name]):
+        self._queues[name].put(None)
+
+    for thread in self._threads:
+      thread.join()
+
+  def _run(self, name):
+    """Handles the items of a stage until the pipeline is closed
+
+    Args:
+      name: The name of the stage
+
+    """
+
+    queue = self._queues[name]
+
+    while True:
+      entry = queue.get()
+      result = None
+
+      try:
+        if entry == None:
+          return
+
+        item, batch = entry
+        result = batch.functions[name](item)
+        if result != None:
+          self._queues[result[0]].put((result[1], batch))
+      except Exception, e:
+        self._logger.exception("The %s stage failed: %s" %(name, e))
+      finally:
+        if entry != None and result == None:
+          batch.done()
+        queue.task_done()
+
+
+class PipelineBatch():
+
+  """This class is the work of one execution within a shared pipeline
+
+  The batch holds the stage functions that handle the items of the
+  execution, and counts its items that are not done yet, so that an
+  execution waits for its own items only, while the other executions keep
+  the pipeline busy.
+
+  """
+
+  # The function of each stage, handling an item and returning a (stage
+  # name, item) tuple to move the item on, or None when the item is done
+  functions = None
+
+  # The number of items of the batch that are not done yet
+  _pending = 0
+
+  # Condition signalled whenever an item of the batch is done
+  _condition = None
+
+  def __init__(self, functions):
+    """Constructor that sets the stage functions of the batch
+
+    Args:
+      functions: The dictionary of the function of each stage
+
+    """
+
+    self.functions = functions
+    self._condition = threading.Condition()
+
+  def add(self):
+    """Counts an item put into the pipeline"""
+
+    with self._condition:
+      self._pending += 1
+
+  def done(self):
+    """Counts an item that is done (or failed)"""
+
+    with self._condition:
+      self._pending -= 1
+      self._condition.notify_all()
+
+  def join(self):
+    """Waits until every item of the batch is done"""
+
+    with self._condition:
+      while self._pending > 0:
+        self._condition.wait()
+
+
+class DiskBudget():
+
+  """This class bounds the number of bytes taken by clones in progress
+
+  Before a repository is cloned, its expected size is reserved from the
+  budget, waiting while the budget is used up. Once the clone is removed (or
+  kept for good), its bytes are released again. A single clone larger than
+  the whole budget is still allowed once nothing else is in progress.
+
+  """
+
+  # The identifier of the process the budget belongs to
+  processId = None
+
+  # The maximum number of bytes in use
+  _maxBytes = None
+
+  # The number of bytes in use
+  _usedBytes = 0
+
+  # Condition signalled whenever bytes are released
+  _condition = None
+
+  def __init__(self, maxBytes):
+    """Constructor that sets the size of the budget
+
+    Args:
+      maxBytes: The maximum number of bytes in use
+
+    """
+
+    self.processId = os.getpid()
+    self._maxBytes = maxBytes
+    self._condition = threading.Condition()
+
+  def reserve(self, size):
+    """Reserves bytes, waiting until they fit within the budget
+
+    Args:
+      size: The number of bytes to reserve
+
+    """
+
+    with self._condition:
+      while self._usedBytes > 0 and self._usedBytes + size > self._maxBytes:
+        self._condition.wait()
+      self._usedBytes += size
+
+  def adjust(self, size):
+    """Changes a reservation to the actual number of bytes (without waiting)
+
+    Args:
+      size: The number of bytes to add to (or remove from) the reservation
+
+    """
+
+    with self._condition:
+      self._usedBytes += size
+      self._condition.notify_all()
+
+  def release(self, size):
+    """Releases reserved bytes
+
+    Args:
+      size: The number of bytes to release
+
+    """
+
+    self.adjust(-size)
+
+  def usedBytes(self):
+    """Acquires the number of bytes in use
+
+    Returns:
+      The number of bytes in use
+
+    """
+
+    with self._condition:
+      return self._usedBytes
@@ -0,0 +1,263 @@
+import random
+import threading
+import time
+import metrics_handler
+
+# The classes of errors that an API call or clone can fail with
+RATE_LIMITED = "rate limited"
+SERVER_ERROR = "server error"
+NETWORK_ERROR = "network error"
+
+# The base and maximum number of seconds to back off for each class of error
+_BACKOFF = {RATE_LIMITED: (30.0, 900.0),
+            SERVER_ERROR: (2.0, 120.0),
+            NETWORK_ERROR: (1.0, 60.0)}
+
+# The rate handler shared by everything in this process
+_sharedRateHandler = None
+
+# Lock guarding the creation of the shared rate handler
+_sharedLock = threading.Lock()
+
+
+def getRateHandler(callsPerMinute, logger):
+  """Acquires the rate handler that is shared by the whole process
+
+  The first caller creates the rate handler, every later caller receives that
+  same rate handler so all the executions in the process share one budget.
+
+  Args:
+    callsPerMinute: The initial number of API calls per minute (0 is unlimited)
+    logger: The custom logger to be used by the rate handler
+
+  Returns:
+    The RateHandler shared by the whole process
+
+  """
+
+  global _sharedRateHandler
+
+  with _sharedLock:
+    if _sharedRateHandler == None:
+      _sharedRateHandler = RateHandler(callsPerMinute, logger)
+
+  return _sharedRateHandler
+
+
+class RateHandler():
+
+  """This class paces the GitHub API calls against a single rate budget
+
+  The budget is a token bucket, where every API call takes a token and the
+  tokens are refilled at a steady rate. The rate-limit headers of the GitHub
+  responses adjust the bucket, so the remaining calls are spread evenly until
+  the limit resets instead of being spent in a burst. Failures back off
+  exponentially (with jitter) based on the class of error, and running into
+  the rate limit pauses every caller sharing the budget.
+
+  """
+
+  # The maximum number of tokens in the bucket
+  _capacity = None
+
+  # The number of tokens currently in the bucket
+  _tokens = None
+
+  # The number of tokens refilled per second (0 is unlimited)
+  _refillRate = None
+
+  # The number of tokens per second that is never exceeded (0 is unlimited)
+  _maxRefillRate = None
+
+  # The time the bucket was last refilled
+  _lastRefill = None
+
+  # The time before which no API call is allowed (after hitting the limit)
+  _pausedUntil = 0
+
+  # Lock guarding the state of the bucket
+  _lock = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, callsPerMinute, logger):
+    """Constructor that fills the bucket for the given rate
+
+    Args:
+      callsPerMinute: The initial number of API calls per minute (0 is
+                      unlimited until GitHub reports its rate limit)
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._capacity = max(1.0, callsPerMinute)
+    self._tokens = self._capacity
+    self._refillRate = callsPerMinute / 60.0
+    self._maxRefillRate = self._refillRate
+    self._lastRefill = time.time()
+    self._lock = threading.Lock()
+    self._logger = logger
+
+  def acquire(self):
+    """Blocks until an API call fits within the rate budget
+
+    Returns:
+      The number of seconds spent waiting
+
+    """
+
+    waited = 0.0
+
+    while True:
+      delay = self.reserve()
+      if delay <= 0:
+        return waited
+
+      time.sleep(delay)
+      waited += delay
+
+  def reserve(self):
+    """Takes a token for an API call if one is available, without waiting
+
+    Callers that can't block (such as coroutines) wait the returned delay in
+    their own way, and then try again.
+
+    Returns:
+      0 if the API call fits within the rate budget, otherwise the number of
+      seconds to wait before trying again
+
+    """
+
+    with self._lock:
+      now = time.time()
+      delay = self._pausedUntil - now
+
+      if delay <= 0:
+        if self._refillRate <= 0:
+          return 0
+
+        self._refill(now)
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return 0
+
+        delay = (1 - self._tokens) / self._refillRate
+
+      return delay
+
+  def update(self, headers):
+    """Adjusts the budget using the rate-limit headers of a response
+
+    The calls remaining until the reset are spread evenly over the time left,
+    which keeps the throughput close to the limit without exceeding it.
+
+    Args:
+      headers: The headers of the response (a mimetools.Message)
+
+    """
+
+    try:
+      limit = int(headers.getheader("X-RateLimit-Limit"))
+      remaining = int(headers.getheader("X-RateLimit-Remaining"))
+    except (TypeError, ValueError):
+      return  # The response doesn't carry rate-limit information
+
+    try: reset = float(headers.getheader("X-RateLimit-Reset"))
+    except (TypeError, ValueError): reset = None
+
+    with self._lock:
+      now = time.time()
+      self._refill(now)
+
+      # Without a reset time the limit is per minute (as in API v2)
+      window = 60.0
+      if reset != None and reset > now:
+        window = reset - now
+
+      self._refillRate = max(remaining, 1) / window
+      if self._maxRefillRate > 0:
+        self._refillRate = min(self._refillRate, self._maxRefillRate)
+
+      # Allow at most a minute worth of calls in a burst
+      self._capacity = max(1.0, min(limit, remaining, self._refillRate * 60))
+      self._tokens = min(self._tokens, remaining, self._capacity)
+
+      if remaining == 0:
+        self._pausedUntil = max(self._pausedUntil, now + window)
+        self._logger.warn("API rate limit exhausted, pausing for %d seconds"
+                          %window)
+
+  def backoff(self, attempt, errorClass, headers=None, apiCall=True):
+    """Waits before retrying a failed API call or clone
+
+    Args:
+      attempt: The number of the failed attempt (starting at 1)
+      errorClass: The class of error (RATE_LIMITED, SERVER_ERROR or
+                  NETWORK_ERROR)
+      headers: The headers of the failed response (optional)
+      apiCall: Flag that indicates the retry is an API call (a clone doesn't
+               use the API budget, so it doesn't wait out its pause)
+
+    Returns:
+      The number of seconds waited
+
+    """
+
+    delay = self.backoffDelay(attempt, errorClass, headers, apiCall)
+    time.sleep(delay)
+    return delay
+
+  def backoffDelay(self, attempt, errorClass, headers=None, apiCall=True):
+    """Determines how long to wait before retrying a failed API call or clone
+
+    The delay grows exponentially with the attempt, starting from a base that
+    depends on the class of error, and half of it is randomized so that the
+    retries of concurrent callers don't line up. Running into the rate limit
+    pauses every caller sharing this budget, not just the failing one.
+
+    Args:
+      attempt: The number of the failed attempt (starting at 1)
+      errorClass: The class of error (RATE_LIMITED, SERVER_ERROR or
+                  NETWORK_ERROR)
+      headers: The headers of the failed response (optional)
+      apiCall: Flag that indicates the retry is an API call (a clone doesn't
+               use the API budget, so it doesn't wait out its pause)
+
+    Returns:
+      The number of seconds to wait
+
+    """
+
+    if headers != None:
+      self.update(headers)
+
+    base, maximum = _BACKOFF[errorClass]
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+
+    with self._lock:
+      now = time.time()
+
+      if errorClass == RATE_LIMITED:
+        self._pausedUntil = max(self._pausedUntil, now + delay)
+        delay = self._pausedUntil - now
+      elif apiCall:
+        delay = max(delay, self._pausedUntil - now)
+
+    self._logger.info("Waiting %.1f seconds (%s)" %(delay, errorClass))
+    metrics_handler.getMetricsHandler().observe("backoff." + errorClass, delay)
+    return delay
+
+  def _refill(self, now):
+    """Refills the bucket for the time passed since the last refill
+
+    Args:
+      now: The current time
+
+    """
+
+    self._tokens = min(self._capacity,
+                       self._tokens + (now - self._lastRefill) *
+                       self._refillRate)
+    self._lastRefill = now
@@ -1,5 +1,134 @@
+import array
+import itertools
 import logging
+import mmap
 import csv
+import cStringIO
+import os
+import Queue
+import re
+import struct
+import sys
+import threading
+import time
+import zipfile
+import metrics_handler
+try: import simplejson as json
+except ImportError: import json
+try: import numpy
+except ImportError: numpy = None  # Only needed to load NPZ reports
+
+
+class RepositoryRecord(object):
+
+  """This class holds the report data of a single repository compactly
+
+  Most repositories use only a few of the recognized languages, so the
+  language sizes are kept as a sparse vector: the indexes of the languages
+  used (into the list of languages) in an array of unsigned shorts, and their
+  sizes in an array of unsigned longs, instead of a boxed value for every
+  language. The header fields are kept in a tuple. The record has no
+  dictionary of its own (it uses __slots__), and its CSV row is only formed
+  when the report is written.
+
+  """
+
+  __slots__ = ("languageIndexes", "languageSizes", "fields")
+
+  def __init__(self, languageIndexes, languageSizes, fields):
+    """Constructor that sets the data of the record
+
+    Args:
+      languageIndexes: The indexes of the languages used (array of 'H')
+      languageSizes: The sizes of the languages used (array of 'L')
+      fields: The tuple of the header fields
+
+    """
+
+    self.languageIndexes = languageIndexes
+    self.languageSizes = languageSizes
+    self.fields = fields
+
+  def totalSize(self):
+    """Calculates the total size of the repository (in terms of languages)
+
+    Returns:
+      The sum of the language sizes
+
+    """
+
+    return sum(self.languageSizes)
+
+  def toCSVRow(self, languageCount):
+    """Forms the CSV row of the record
+
+    Args:
+      languageCount: The number of recognized languages
+
+    Returns:
+      The list of the language sizes (for every language) followed by the
+      header fields
+
+    """
+
+    row = [0] * languageCount
+    for index, size in itertools.izip(self.languageIndexes,
+                                      self.languageSizes):
+      row[index] = size
+
+    row.extend(self.fields)
+    return row
+
+  def toJournal(self):
+    """Forms the JSON friendly value of the record
+
+    Returns:
+      A list of the language indexes, the language sizes and the header
+      fields
+
+    """
+
+    return [self.languageIndexes.tolist(), self.languageSizes.tolist(),
+            list(self.fields)]
+
+  @staticmethod
+  def fromJournal(value):
+    """Makes a record from its JSON friendly value
+
+    Args:
+      value: The value formed by toJournal (strings may be unicode)
+
+    Returns:
+      The RepositoryRecord
+
+    """
+
+    indexes, sizes, fields = value
+    return RepositoryRecord(array.array('H', indexes), array.array('L', sizes),
+                            tuple(_encode(field) for field in fields))
+
+  def __getstate__(self):
+    return self.languageIndexes, self.languageSizes, self.fields
+
+  def __setstate__(self, state):
+    self.languageIndexes, self.languageSizes, self.fields = state
+
+
+def _encode(value):
+  """Encodes unicode values as utf-8 strings, as the report is written
+
+  Args:
+    value: The value
+
+  Returns:
+    The utf-8 string of a unicode value, otherwise the value itself
+
+  """
+
+  if isinstance(value, unicode):
+    return value.encode("utf-8")
+
+  return value
 
 
 class ReportHandler():
@@ -7,9 +136,16 @@ class ReportHandler():
   """This class handles the reporting of the gathered repository information
 
   The report generated consists of the information of the gather repository
-  information. The reports can be generated in the implemented formates which
-  is currently only CSV. The reports are placed in the present working
-  directory called "repository_report.ext" where ext is the file extension.
+  information. The reports can be generated in the implemented formats, which
+  are CSV and columnar NumPy arrays (NPZ, see REPORT_FORMATS). The reports are
+  placed in the present working directory called "repository_report.ext"
+  where ext is the file extension.
+  The data is not written by the ReportHandler itself, but handed over to the
+  ReportWriter that is shared by all the concurrent executions, so the
+  executions never block on writing to the disk. When a StoreHandler is
+  given, the examined repositories are also kept in its store. When a tag is
+  given (ex: the name of the query of a job), it is added as the last field
+  of every record, so the report can combine several crawls.
 
   """
 
@@ -19,13 +155,20 @@ class ReportHandler():
   # List of all recognized GitHub languages
   _languages = None
 
-  # The CSV report's file name
-  _CSV_NAME = "repository_report.csv"
+  # The queue of the ReportWriter that writes the report
+  _reportQueue = None
+
+  # The store handler keeping the examined repositories (or None)
+  _storeHandler = None
+
+  # The tag added as the last field of every record (or None)
+  _tag = None
 
   # Logger being used for this execution
   _logger = None
 
-  def __init__(self, headers, languages, logger):
+  def __init__(self, headers, languages, logger, reportQueue,
+               storeHandler=None, tag=None):
     """Constructor that initializes the ReportHandler
 
     This constructor sets the list of languages and headers so the reports
@@ -36,47 +179,830 @@ class ReportHandler():
       headers: The list of headers as fields for the report
       languages: The list of languages as fields for the report
       logger: The custom logger to be used for this executing process
+      reportQueue: The queue of the ReportWriter that writes the report
+      storeHandler: The StoreHandler keeping the examined repositories
+                    (optional)
+      tag: The tag added as the last field of every record in the report
+           (optional, the report must have a header for it)
 
     """
 
     self._headers = headers
     self._languages = languages
     self._logger = logger
+    self._reportQueue = reportQueue
+    self._storeHandler = storeHandler
+    self._tag = tag
 
-  def readyCSVReport(self):
-    """Creates the CSV report with the necessary header
+  def appendCSVData(self, data, page=None):
+    """Appends new data to the CSV report
 
-    This function creates the CSV report file with the necessary header.
+    This function hands new data of the past repository page over to the
+    ReportWriter, which appends it to the CSV report in the background.
+
+    Args:
+      data: The list of the RepositoryRecords of the last page of
+            repositories
+      page: The number of the page the data is from (journaled once written)
 
     """
 
-    csv_file = open(self._CSV_NAME, 'wb')
-    csv_writer = csv.writer(csv_file)
+    if self._tag != None:
+      data = [RepositoryRecord(record.languageIndexes, record.languageSizes,
+                               record.fields + (self._tag,))
+              for record in data]
 
-    header = []
-    header.extend(self._headers)
-    header.extend(self._languages)
-    header.pop()
-    csv_writer.writerow(header)
+    self._reportQueue.put((page, data))
+    self._logger.info("Repository data queued for the CSV report")
 
-    csv_file.close()
-    self._logger.info("CSV report file is ready")
+  def storeData(self, namesAndRecords):
+    """Stores the examined repositories of a page, when there is a store
 
-  def appendCSVData(self, data):
-    """Appends new data to the CSV report
+    Args:
+      namesAndRecords: The list of ('owner/name', RepositoryRecord) tuples of
+                       the repositories examined (with or without content)
+
+    """
+
+    if self._storeHandler != None:
+      self._storeHandler.store(namesAndRecords)
+
+
+class ReportWriter():
+
+  """This class writes the report on behalf of all the concurrent executions
+
+  There is a single writer for the report, running in its own thread, which
+  takes the data of the executions from a queue. It keeps the report file open
+  for the whole crawl, writes whatever data is waiting in one batch (in the
+  report format being used) and regularly syncs the file to the disk. Once the
+  data of a page is written, the page is journaled as such by the
+  CheckpointHandler (if given).
+
+  """
+
+  # The maximum number of seconds between syncing the report to the disk
+  _FSYNC_INTERVAL = 5
+
+  # The queue the data to be written is taken from
+  queue = None
+
+  # The report format the data is written in
+  _reportFormat = None
+
+  # The file name of the report
+  _fileName = None
+
+  # Flag that indicates that the data is appended to an existing report
+  _append = None
+
+  # The thread that writes the report
+  _thread = None
+
+  # The checkpoint handler the written pages are journaled with (or None)
+  _checkpointHandler = None
+
+  # The metrics of the writing
+  _metricsHandler = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, headers, languages, logger, queue=None, append=False,
+               fileName=None, checkpointHandler=None, reportFormat="csv"):
+    """Constructor that sets up the writer (which still has to be started)
+
+    Args:
+      headers: The list of headers as fields for the report
+      languages: The list of languages as fields for the report
+      logger: The custom logger to be used for the writer
+      queue: The queue the data is taken from (a multiprocessing.Queue is
+             needed when the executions are separate processes), by default
+             a Queue.Queue for executions within this process
+      append: Flag that indicates that an existing report is appended to
+              instead of being started over
+      fileName: The file name of the report (by default the one of the report
+                format)
+      checkpointHandler: The CheckpointHandler the written pages are journaled
+                         with (optional)
+      reportFormat: The name of the report format (see REPORT_FORMATS)
+
+    """
+
+    formatClass = REPORT_FORMATS[reportFormat]
+    self._reportFormat = formatClass(headers, languages)
+    self._checkpointHandler = checkpointHandler
+    self._logger = logger
+    self._append = append
+    self._fileName = fileName or formatClass.FILE_NAME
+
+    if queue == None:
+      queue = Queue.Queue()
+    self.queue = queue
+
+    self._metricsHandler = metrics_handler.getMetricsHandler()
+    self._metricsHandler.addGauge("queue.report", self.queue.qsize)
+
+  def start(self):
+    """Opens the report and starts writing the queued data in the background
+
+    Unless appending, the report is started over.
+
+    """
+
+    self._reportFormat.open(self._fileName, self._append)
+
+    self._thread = threading.Thread(target=self._run)
+    self._thread.start()
+    self._logger.info("Report file %s is ready" %self._fileName)
+
+  def close(self):
+    """Writes the remaining queued data and closes the report
+
+    This must only be called once every execution is done queueing data.
+
+    """
+
+    self.queue.put(None)
+    self._thread.join()
+    self._logger.info("Report file %s is complete" %self._fileName)
+
+  def _run(self):
+    """Writes the queued data in batches until the writer is closed"""
+
+    lastSync = time.time()
+    closing = False
+
+    while not closing:
+      records = []
+      pages = []
+      item = self.queue.get()
+
+      # Take everything that is waiting along in the same batch
+      while True:
+        if item == None:
+          closing = True
+          break
+
+        page, data = item
+        records.extend(data)
+        pages.append(page)
+
+        try:
+          item = self.queue.get_nowait()
+        except Queue.Empty:
+          break
+
+      with self._metricsHandler.timer("report.write"):
+        self._reportFormat.write(records)
+      self._metricsHandler.increment("report.rows", len(records))
+
+      if self._checkpointHandler != None:
+        for page in pages:
+          if page != None:
+            self._checkpointHandler.recordPage(0, page, "written")
+
+      if not closing and time.time() - lastSync >= self._FSYNC_INTERVAL:
+        with self._metricsHandler.timer("report.sync"):
+          self._reportFormat.sync()
+        lastSync = time.time()
+
+    self._reportFormat.close()
+
+
+class CSVReportFormat():
+
+  """This class writes the report as CSV
+
+  Each row holds the size of every language followed by the header fields.
+  The header is written once, when the report is empty. The rows of a batch
+  are written with a single write to a file opened for appending, so
+  separately started processes (using the -p and -m parameters) can share
+  the report without interleaving their rows.
+
+  """
+
+  # The report's file name
+  FILE_NAME = "repository_report.csv"
+
+  # Flag that indicates separately started processes can append to the report
+  SHARED = True
+
+  # The CSV column headers
+  _headers = None
+
+  # List of all recognized GitHub languages
+  _languages = None
+
+  # The file descriptor of the open report
+  _descriptor = None
+
+  def __init__(self, headers, languages):
+    """Constructor that sets the fields of the report
+
+    Args:
+      headers: The list of headers as fields for the report
+      languages: The list of languages as fields for the report
+
+    """
+
+    self._headers = headers
+    self._languages = languages
+
+  def open(self, fileName, append):
+    """Opens the report
+
+    Args:
+      fileName: The file name of the report
+      append: Flag that indicates that an existing report is appended to
+              instead of being started over
+
+    """
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+    if not append:
+      flags |= os.O_TRUNC
+    self._descriptor = os.open(fileName, flags, 0644)
+
+    if os.fstat(self._descriptor).st_size == 0:
+      header = []
+      header.extend(self._languages)
+      header.extend(self._headers)
+      self._write([header], csv.QUOTE_MINIMAL)
+
+  def write(self, records):
+    """Writes a batch of records to the report
+
+    Args:
+      records: The list of RepositoryRecords
+
+    """
+
+    self._write([record.toCSVRow(len(self._languages)) for record in records],
+                csv.QUOTE_NONNUMERIC)
+
+  def sync(self):
+    """Syncs the written records to the disk"""
+
+    os.fsync(self._descriptor)
+
+  def close(self):
+    """Syncs and closes the report"""
+
+    self.sync()
+    os.close(self._descriptor)
+
+  def _write(self, rows, quoting):
+    """Writes the rows to the report with a single write
+
+    Args:
+      rows: The list of rows to write
+      quoting: The quoting used for the CSV fields
+
+    """
+
+    if len(rows) == 0:
+      return
+
+    batch = cStringIO.StringIO()
+    csv.writer(batch, quoting=quoting).writerows(rows)
+    batch = batch.getvalue()
 
-    This function appends new data of the past repository page to the already
-    present CSV report (created via the readyCSVReport function).
+    written = 0
+    while written < len(batch):
+      written += os.write(self._descriptor, batch[written:])
+
+
+class NPZReportFormat():
+
+  """This class writes the report as columnar NumPy arrays in an .npz archive
+
+  Every batch of records becomes a chunk of the archive (named by its number,
+  ex: 000003/), so the report streams to the disk as the crawl goes on and
+  numpy isn't needed to write it. A chunk holds:
+
+    languages_indptr, languages_indices, languages_data: the language sizes
+        as a sparse matrix (CSR) with a row per repository
+    <header>: the values of a boolean, integer or float header field
+    <header>.codes, <header>.values, <header>.offsets: the values of a string
+        header field, dictionary encoded (the codes index the dictionary of
+        distinct utf-8 values, -1 stands for null)
+    schema.json: the number of rows and the kind of every header field, which
+                 is written last, so a chunk without it is incomplete
+
+  The archive also holds metadata.json with the languages and the headers.
+  The archive isn't compressed, so the arrays load without decoding. A
+  report whose archive wasn't completed (ex: an interrupted crawl) keeps its
+  complete chunks when it is appended to. Use loadNPZReport to load the
+  report.
+
+  """
+
+  # The report's file name
+  FILE_NAME = "repository_report.npz"
+
+  # Flag that indicates separately started processes can append to the report
+  SHARED = False
+
+  # The name of the member with the languages and the headers
+  _METADATA_NAME = "metadata.json"
+
+  # The name of the member that completes a chunk
+  _SCHEMA_NAME = "schema.json"
+
+  # The byte order mark of the arrays written
+  _BYTE_ORDER = sys.byteorder == "little" and "<" or ">"
+
+  # The CSV column headers
+  _headers = None
+
+  # List of all recognized GitHub languages
+  _languages = None
+
+  # The open report file
+  _file = None
+
+  # The archive of the report file
+  _archive = None
+
+  # The number of the next chunk
+  _chunk = None
+
+  def __init__(self, headers, languages):
+    """Constructor that sets the fields of the report
+
+    Args:
+      headers: The list of headers as fields for the report
+      languages: The list of languages as fields for the report
+
+    """
+
+    self._headers = headers
+    self._languages = languages
+
+  def open(self, fileName, append):
+    """Opens the report
+
+    Args:
+      fileName: The file name of the report
+      append: Flag that indicates that an existing report is appended to
+              instead of being started over
+
+    """
+
+    if append and os.path.exists(fileName) and \
+       os.path.getsize(fileName) > 0:
+      if not zipfile.is_zipfile(fileName):
+        self._salvage(fileName)
+
+      self._file = open(fileName, 'r+b')
+      self._archive = zipfile.ZipFile(self._file, 'a', zipfile.ZIP_STORED,
+                                      True)
+      self._chunk = len([name for name in self._archive.namelist()
+                         if name.endswith("/" + self._SCHEMA_NAME)])
+      return
+
+    self._file = open(fileName, 'w+b')
+    self._archive = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_STORED, True)
+    self._archive.writestr(self._METADATA_NAME, json.dumps(
+        {'languages': self._languages, 'headers': self._headers}))
+    self._chunk = 0
+
+  def write(self, records):
+    """Writes a batch of records to the report as a chunk
+
+    Args:
+      records: The list of RepositoryRecords
+
+    """
+
+    if len(records) == 0:
+      return
+
+    prefix = "%06d/" %self._chunk
+    indptr = array.array('l', [0])
+    indices = array.array('H')
+    sizes = array.array('L')
+
+    for record in records:
+      indices.extend(record.languageIndexes)
+      sizes.extend(record.languageSizes)
+      indptr.append(len(indices))
+
+    self._writeArray(prefix + "languages_indptr", indptr)
+    self._writeArray(prefix + "languages_indices", indices)
+    self._writeArray(prefix + "languages_data", sizes)
+
+    kinds = []
+    for position, header in enumerate(self._headers):
+      values = [_fieldValue(record.fields, position) for record in records]
+      kinds.append([header, self._writeColumn(prefix + header, values)])
+
+    self._archive.writestr(prefix + self._SCHEMA_NAME,
+                           json.dumps({'rows': len(records), 'kinds': kinds}))
+    self._file.flush()
+    self._chunk += 1
+
+  def sync(self):
+    """Syncs the written chunks to the disk"""
+
+    self._file.flush()
+    os.fsync(self._file.fileno())
+
+  def close(self):
+    """Completes the archive, then syncs and closes the report"""
+
+    self._archive.close()
+    self.sync()
+    self._file.close()
+
+  def _writeColumn(self, name, values):
+    """Writes the values of a header field as an array of its kind
+
+    Args:
+      name: The member name of the field (without extension)
+      values: The list of the values of the field
+
+    Returns:
+      The kind of the field (boolean, integer, float or string)
+
+    """
+
+    kind = _fieldKind(values)
+
+    if kind == "boolean":
+      self._writeArray(name, array.array('B', values), "|b1")
+    elif kind == "integer":
+      try:
+        self._writeArray(name, array.array('l', values))
+      except OverflowError:
+        kind = "float"
+
+    if kind == "float":
+      self._writeArray(name, array.array('d', [value == None and
+          float("nan") or value for value in values]))
+    elif kind == "string":
+      codes = array.array('i')
+      offsets = array.array('l', [0])
+      dictionary = {}
+      distinct = []
+
+      for value in values:
+        if value == None:
+          codes.append(-1)
+          continue
+
+        if not isinstance(value, str):
+          value = isinstance(value, unicode) and value.encode("utf-8") or \
+                  str(value)
+
+        code = dictionary.get(value)
+        if code == None:
+          code = dictionary[value] = len(distinct)
+          distinct.append(value)
+          offsets.append(offsets[-1] + len(value))
+        codes.append(code)
+
+      self._writeArray(name + ".codes", codes)
+      self._writeArray(name + ".offsets", offsets)
+      self._writeArray(name + ".values", array.array('B', "".join(distinct)),
+                       "|u1")
+
+    return kind
+
+  def _writeArray(self, name, values, descr=None):
+    """Writes an array as a .npy member of the archive
+
+    Args:
+      name: The member name (without extension)
+      values: The array.array of the values
+      descr: The NumPy type of the values (by default it follows from the
+             typecode of the array)
+
+    """
+
+    if descr == None:
+      if values.typecode in "fd":
+        kind = "f"
+      elif values.typecode in "BHIL":
+        kind = "u"
+      else:
+        kind = "i"
+      descr = "%s%s%d" %(self._BYTE_ORDER, kind, values.itemsize)
+
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" \
+             %(descr, len(values))
+    # The header is padded so the data is aligned
+    header += " " * (-(len(header) + 11) % 64) + "\n"
+
+    self._archive.writestr(name + ".npy",
+                           "\x93NUMPY\x01\x00" + struct.pack("<H", len(header))
+                           + header + values.tostring())
+
+  def _salvage(self, fileName):
+    """Rewrites an archive that wasn't completed with its complete chunks
+
+    The members are recovered from their local headers, up to the first one
+    that wasn't fully written.
 
     Args:
-      data: The list of new data from the last page of repositories
+      fileName: The file name of the archive
 
     """
 
-    csv_file = open(self._CSV_NAME, 'a')
-    csv_writer = csv.writer(csv_file, quoting=csv.QUOTE_NONNUMERIC)
+    members = []
+    with open(fileName, 'rb') as archiveFile:
+      while True:
+        header = archiveFile.read(30)
+        if len(header) < 30 or header[:4] != "PK\x03\x04":
+          break
+
+        (flags, method, size, nameLength,
+         extraLength) = struct.unpack("<6xHH8xL4xHH", header)
+        if flags & 0x08 or method != zipfile.ZIP_STORED or \
+           size == 0xffffffff:
+          break  # Not written by this format
+
+        name = archiveFile.read(nameLength)
+        archiveFile.read(extraLength)
+        data = archiveFile.read(size)
+        if len(data) < size:
+          break
+        members.append((name, data))
+
+    complete = set(name[:-len(self._SCHEMA_NAME)] for name, data in members
+                   if name.endswith("/" + self._SCHEMA_NAME))
+
+    temporaryName = fileName + ".tmp"
+    archive = zipfile.ZipFile(temporaryName, 'w', zipfile.ZIP_STORED, True)
+    archive.writestr(self._METADATA_NAME, json.dumps(
+        {'languages': self._languages, 'headers': self._headers}))
+
+    for name, data in members:
+      if name[:name.find("/") + 1] in complete:
+        archive.writestr(name, data)
+
+    archive.close()
+    os.rename(temporaryName, fileName)
+
+
+def _fieldValue(fields, position):
+  """Acquires a header field of a record, or null when the record has none
+
+  Args:
+    fields: The tuple of the header fields of the record
+    position: The position of the header field
+
+  Returns:
+    The value of the field, or None
+
+  """
+
+  if position < len(fields):
+    return fields[position]
+
+  return None
+
+
+def _fieldKind(values):
+  """Determines the kind of array that holds the values of a header field
+
+  Args:
+    values: The list of the values of the field
+
+  Returns:
+    The kind of the field: boolean, integer, float (also for numbers with
+    nulls) or string (for anything else)
+
+  """
+
+  kind = "boolean"
+  for value in values:
+    if value == None:
+      if kind != "string":
+        kind = "float"
+    elif isinstance(value, bool):
+      pass
+    elif isinstance(value, (int, long)):
+      if kind == "boolean":
+        kind = "integer"
+    elif isinstance(value, float):
+      if kind != "string":
+        kind = "float"
+    else:
+      return "string"
+
+  return kind
+
+
+# The report formats by name
+REPORT_FORMATS = {'csv': CSVReportFormat, 'npz': NPZReportFormat}
+
+
+def _readMember(archive, contents, name):
+  """Reads a member of an uncompressed archive from the archive's contents
+
+  Args:
+    archive: The ZipFile of the archive
+    contents: The contents of the archive file
+    name: The name of the member
+
+  Returns:
+    A tuple of the contents, and the offset and size of the member within
+    them (or the member's data itself if it is compressed)
+
+  """
+
+  information = archive.getinfo(name)
+  if information.compress_type != zipfile.ZIP_STORED:
+    data = archive.read(name)
+    return data, 0, len(data)
+
+  offset = information.header_offset
+  offset += 30 + sum(struct.unpack("<26xHH", contents[offset:offset + 30]))
+  return contents, offset, information.file_size
+
+
+def _readArray(archive, contents, name):
+  """Reads a .npy member of an archive as a NumPy array
+
+  The headers written by NPZReportFormat are parsed here, which saves most of
+  the loading time of the small arrays of each chunk, and the data of the
+  array is read without copying it.
+
+  Args:
+    archive: The ZipFile of the archive
+    contents: The contents of the archive file
+    name: The name of the member
+
+  Returns:
+    The NumPy array (read only)
+
+  """
+
+  contents, offset, size = _readMember(archive, contents, name)
+  headerLength, = struct.unpack("<H", contents[offset + 8:offset + 10])
+  match = _NPY_HEADER.match(contents, offset + 10, offset + 10 + headerLength)
+
+  if match == None:
+    return numpy.lib.format.read_array(
+        cStringIO.StringIO(contents[offset:offset + size]))
+
+  return numpy.frombuffer(contents, match.group(1), int(match.group(2)),
+                          offset + 10 + headerLength)
+
+
+# The header of the .npy arrays written by NPZReportFormat
+_NPY_HEADER = re.compile(r"\{'descr': '([^']+)', 'fortran_order': False, "
+                         r"'shape': \((\d+),\), \} *\n")
+
+# The kinds of header fields, from the narrowest to the widest
+_KIND_ORDER = ["boolean", "integer", "float", "string"]
+
+# The NumPy types of the kinds of header fields
+_KIND_TYPES = {'boolean': bool, 'integer': 'int64', 'float': 'float64',
+               'string': object}
+
+
+def loadNPZReport(*fileNames):
+  """Loads NPZ reports as NumPy arrays (requires numpy)
+
+  The chunks of the reports are joined into one report. A header field whose
+  kind differs between chunks takes the widest kind (boolean, integer, float,
+  string).
+
+  Args:
+    fileNames: The file names of the reports (ex: of separately started
+               processes)
+
+  Returns:
+    A dictionary of the 'languages' and 'headers' of the report, the
+    'languageSizes' as a tuple of the data, indices and indptr arrays of a
+    sparse matrix (CSR, ex: scipy.sparse.csr_matrix(languageSizes)) with a
+    row per repository, and the 'columns' of the header fields by header
+    (string fields are arrays of objects, with None for nulls)
+
+  """
+
+  languages = headers = None
+  kinds = {}
+  data = []
+  indices = []
+  indptr = [numpy.zeros(1, numpy.int64)]
+  columns = {}
+  rows = 0
+  nonZeros = 0
+
+  for chunk in iterateNPZReport(fileNames):
+    languages = chunk['languages']
+    headers = chunk['headers']
+
+    chunkData, chunkIndices, chunkIndptr = chunk['languageSizes']
+    data.append(chunkData)
+    indices.append(chunkIndices)
+    indptr.append(chunkIndptr[1:] + nonZeros)
+    nonZeros += len(chunkData)
+
+    for header, kind in chunk['kinds'].iteritems():
+      kinds[header] = max(kinds.get(header, kind), kind,
+                          key=_KIND_ORDER.index)
+      columns.setdefault(header, []).append(chunk['columns'][header])
+
+    rows += chunk['rows']
+
+  for header in columns:
+    dtype = _KIND_TYPES[kinds[header]]
+    for position, column in enumerate(columns[header]):
+      if column.dtype != dtype:
+        nulls = column.dtype.kind == "f" and numpy.isnan(column)
+        column = column.astype(dtype)
+        if dtype == object:
+          column[nulls] = None  # Nulls of a chunk without strings are NaN
+        columns[header][position] = column
+
+    columns[header] = numpy.concatenate(columns[header])
+
+  return {'languages': languages, 'headers': headers,
+          'languageSizes': (numpy.concatenate(data or [numpy.zeros(0,
+                                                       numpy.uint64)]),
+                            numpy.concatenate(indices or [numpy.zeros(0,
+                                                          numpy.uint16)]),
+                            numpy.concatenate(indptr)),
+          'columns': columns, 'rows': rows}
+
+
+def iterateNPZReport(fileNames, headers=None):
+  """Iterates over the chunks of NPZ reports as NumPy arrays (requires numpy)
+
+  The reports are mapped into memory instead of being read, and the arrays
+  of a chunk are views of the mapping, so only the chunks in use take memory
+  (ex: to go through a report larger than the memory).
+
+  Args:
+    fileNames: The list of the file names of the reports
+    headers: The list of the header fields to read (by default all of them)
+
+  Returns:
+    A generator of a dictionary for each chunk, with the 'languages' and
+    'headers' of the report, the 'rows' of the chunk, its 'languageSizes' as
+    a tuple of the data, indices and indptr arrays of a sparse matrix (CSR),
+    and the 'kinds' and 'columns' of its header fields by header
+
+  """
+
+  if numpy == None:
+    raise ImportError("numpy is required to load an NPZ report")
+
+  for fileName in fileNames:
+    archive = zipfile.ZipFile(fileName, 'r')
+    with open(fileName, 'rb') as reportFile:
+      # The arrays keep the mapping open for as long as they are in use
+      contents = mmap.mmap(reportFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(name):
+      memberContents, offset, size = _readMember(archive, contents, name)
+      return memberContents[offset:offset + size]
+
+    def readArray(name):
+      return _readArray(archive, contents, name + ".npy")
+
+    metadata = json.loads(read(NPZReportFormat._METADATA_NAME))
+    reportLanguages = [_encode(language)
+                       for language in metadata['languages']]
+    reportHeaders = [_encode(header) for header in metadata['headers']]
+
+    chunks = sorted(name[:-len(NPZReportFormat._SCHEMA_NAME)]
+                    for name in archive.namelist()
+                    if name.endswith("/" + NPZReportFormat._SCHEMA_NAME))
+    for prefix in chunks:
+      schema = json.loads(read(prefix + NPZReportFormat._SCHEMA_NAME))
+      kinds = {}
+      columns = {}
+
+      for header, kind in schema['kinds']:
+        header = _encode(header)
+        if headers != None and header not in headers:
+          continue
+
+        if kind == "string":
+          offsets = readArray(prefix + header + ".offsets").tolist()
+          values = readArray(prefix + header + ".values").tostring()
+          dictionary = numpy.empty(len(offsets), object)
+          dictionary[:-1] = [values[start:end] for start, end in
+                             itertools.izip(offsets, offsets[1:])]
+          # The code -1 takes the last entry, which is null
+          column = dictionary.take(readArray(prefix + header + ".codes"))
+        else:
+          column = readArray(prefix + header)
+
+        kinds[header] = kind
+        columns[header] = column
 
-    csv_writer.writerows(data)
+      yield {'languages': reportLanguages, 'headers': reportHeaders,
+             'rows': schema['rows'],
+             'languageSizes': (readArray(prefix + "languages_data"),
+                               readArray(prefix + "languages_indices"),
+                               readArray(prefix + "languages_indptr")),
+             'kinds': kinds, 'columns': columns}
 
-    csv_file.close()
-    self._logger.info("Repository data appended to CSV report")
+    archive.close()
@@ -1,9 +1,28 @@
+import array
+import itertools
 import logging
+import os
 import subprocess
+import threading
 import time
+import urllib
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 import api_handler
+import cache_handler
+import checkpoint_handler
+import loop_handler
+import clone_handler
+import connection_handler
+import filter_handler
+import metrics_handler
+import mirror_handler
+import pipeline_handler
+import rate_handler
 import report_handler
+import scheduler_handler
+import statement_handler
+import store_handler
 
 
 class RepositoryHandler():
@@ -13,10 +32,16 @@ class RepositoryHandler():
   The crawling of GitHub for repositories that fall in the search criteria
   occurs in this class. The data is extracted from repositories and passed
   to the ReportHandler. If enabled the repositories will be cloned and check
-  to see if indicated source statements are present (using egrep on Linux).
+  to see if indicated source statements are present (using the
+  StatementHandler).
   Given a positive hit on the search for source statements the repository
   is kept, otherwise it is removed. There is a customHandleRepository function
-  that allows for a special handling of a repository based on the user.
+  that allows for a special handling of a repository based on the user. The
+  language information of a page of repositories is acquired concurrently by
+  a pool of workers, while the results are still handled in page order. The
+  cloning, searching and removing of the repositories is done by the stages
+  of a pipeline, each with its own workers, within a bound on the disk space
+  taken by the clones in progress.
 
   """
 
@@ -50,11 +75,104 @@ class RepositoryHandler():
   # The max number of processes being ran
   _maxProcesses = None
 
+  # The pool of workers that acquire the language information of a page
+  _languagePool = None
+
+  # The rate handler shared by the whole process, paces API calls and retries
+  _rateHandler = None
+
+  # The connection handler shared by the whole process
+  _connectionHandler = None
+
+  # The on-disk cache of API responses (None if caching is disabled)
+  _cacheHandler = None
+
+  # The maximum number of persistent connections per host
+  _poolSize = None
+
+  # The number of seconds an idle connection is kept open
+  _poolIdleTimeout = None
+
+  # The URL the API calls are made to (None for the one of GitHub)
+  _apiUrl = None
+
+  # The number of concurrent language API calls per page
+  _languageWorkers = None
+
+  # Flag that indicates the repositories of a page are handled as they arrive
+  _streamPages = None
+
+  # The number of pages in flight when crawling on an event loop
+  _asyncPages = None
+
+  # The scheduler handing out the pages to the concurrent executions
+  _pageScheduler = None
+
+  # The queue the progress is reported to (None when nothing collects it)
+  _progressQueue = None
+
+  # The checkpoint handler journaling the crawl
+  _checkpointHandler = None
+
+  # The store handler of the examined repositories (None if there is no store)
+  _storeHandler = None
+
+  # The filter handler of the search results (None if nothing is filtered)
+  _filterHandler = None
+
+  # The work on the repositories shared with the other queries of a job (or
+  # None)
+  _sharedRepositories = None
+
+  # The statement handler searching the cloned repositories
+  _statementHandler = None
+
+  # The source statements whose statistics are added to the report (None if
+  # they aren't)
+  _statisticsStatements = None
+
+  # The clone handler performing the git commands of a clone
+  _cloneHandler = None
+
+  # The pipeline of the clone, scan and clean stages (shared by the process)
+  _pipeline = None
+
+  # The batch of the repositories of this crawl within the pipeline
+  _pipelineBatch = None
+
+  # The budget of bytes taken by the clones in progress (shared by the
+  # process)
+  _diskBudget = None
+
+  # The metrics of the crawl
+  _metricsHandler = None
+
+  # The number of repositories that are done
+  _repositoriesDone = 0
+
+  # Lock guarding the number of repositories that are done
+  _doneLock = None
+
   # Logger being used for this execution
   _logger = None
 
   def __init__(self, headers, languages, primaryLanguage, keywords,
-               sourceStatements, clone, processNumber, maxProcesses, logger):
+               sourceStatements, clone, processNumber, maxProcesses, logger,
+               languageWorkers=1, apiRate=0, cacheDirectory=None,
+               cacheTimeToLive=604800, cacheMaxBytes=536870912, poolSize=10,
+               poolIdleTimeout=60, pageScheduler=None,
+               pageFile="page_schedule", crawlId=None, progressQueue=None,
+               reportQueue=None, checkpointHandler=None,
+               maxScanFileSize=10485760,
+               cloneWorkers=4, scanWorkers=2, cleanWorkers=1,
+               maxCloneBytes=2147483648, cloneMode="full", blobLimit="1m",
+               mirrorDirectory=None, maxMirrorBytes=10737418240,
+               asyncPages=4, streamPages=False, storeFile=None,
+               storeFreshness=604800, storeCrawl=None, apiUrl=None,
+               minSize=None, maxSize=None, skipForks=False, pushedAfter=None,
+               minWatchers=None, sharedRepositories=None, reportTag=None,
+               statementStats=False, scanProcesses=1,
+               parallelScanBytes=67108864):
     """Constructor that sets the passed parameters as well as the handlers
 
     The parameters are sets within the class for future use. The APIHandler
@@ -67,15 +185,148 @@ class RepositoryHandler():
       keywords: Filter of keywords for the repositories
       sourceStatements: Filter of source statements for the repositories
       clone: Flag that indicates repositories should be cloned
-      processNumber: The ID of this process, used as a modifier to the pages
+      processNumber: The ID of this process
       maxProcesses: The max number of concurrent processes running
       logger: The custom logger to be used for this executing process
+      languageWorkers: The number of concurrent language API calls per page
+      apiRate: The maximum number of API calls per minute (0 is unlimited),
+               shared by every repository handler within the process
+      cacheDirectory: The directory of the API response cache (None disables)
+      cacheTimeToLive: The number of seconds a cached API response is kept
+      cacheMaxBytes: The maximum number of bytes the API cache can take
+      poolSize: The maximum number of persistent connections per host, shared
+                by every repository handler within the process
+      poolIdleTimeout: The number of seconds an idle connection is kept open
+      pageScheduler: The scheduler shared by the concurrent executions of this
+                     process (by default one is made for this execution)
+      pageFile: The state file of the page scheduler shared by separately
+                started processes (used when maxProcesses is above 1 and no
+                pageScheduler is given)
+      crawlId: The identifier of the crawl given to all of the separately
+               started processes, a new one starts the pages of the page
+               file over (by default the pages are only started over once
+               they were all claimed)
+      progressQueue: The queue the progress of the crawl is reported to, as
+                     ('metrics', processNumber, snapshot) tuples after each
+                     page and a final ('finished', processNumber,
+                     repositories) tuple
+      reportQueue: The queue of the ReportWriter that writes the report
+      checkpointHandler: The CheckpointHandler journaling the crawl, which is
+                         also used to resume an earlier crawl (by default
+                         the crawl isn't journaled)
+      maxScanFileSize: The maximum size of the files searched for the source
+                       statements (in bytes)
+      cloneWorkers: The number of repositories cloned concurrently
+      scanWorkers: The number of cloned repositories searched concurrently
+      cleanWorkers: The number of cloned repositories removed concurrently
+      maxCloneBytes: The maximum number of bytes on disk taken by the clones
+                     in progress (not counting the ones that are kept).
+                     The workers and the bytes are shared by all the crawls
+                     of the process, so the first crawl's numbers apply
+      cloneMode: The clone mode, 'full' or 'sparse' (a partial clone without
+                 large blobs, checking out the primary language's sources)
+      blobLimit: The size of the largest blob fetched by sparse clones (ex: 1m)
+      mirrorDirectory: The directory of the local store of mirrors that the
+                       repositories are cloned from (None disables)
+      maxMirrorBytes: The maximum number of bytes the store of mirrors can
+                      take
+      asyncPages: The number of pages in flight when crawling on an event
+                  loop (see crawlRepositoriesAsync)
+      streamPages: Flag that indicates the repositories of a page are decoded
+                   and handled as the page arrives (by crawlRepositories)
+      storeFile: The SQLite database of the examined repositories, which
+                 leaves out the repositories the crawl already handled and
+                 reuses the fresh data of earlier crawls (None disables)
+      storeFreshness: The number of seconds the stored data of a repository
+                      is reused
+      storeCrawl: The identifier of the crawl in the store, shared by the
+                  concurrent executions of the crawl
+      apiUrl: The URL the API calls are made to (by default the one of
+              GitHub), such as a local stand-in of the API for benchmarks
+      minSize: The minimum size of the repositories in KB (the repositories
+               failing a filter are left out before any API call or clone)
+      maxSize: The maximum size of the repositories in KB
+      skipForks: Flag that indicates that forks are left out
+      pushedAfter: The date the repositories must have been pushed to after
+      minWatchers: The minimum number of watchers of the repositories
+      sharedRepositories: The SharedRepositories of the job this crawl is a
+                          query of, which makes the language API calls and
+                          clones of the repositories shared with the other
+                          queries only once (see job_handler)
+      reportTag: The tag added as the last field of the report records (ex:
+                 the name of the query of a job)
+      statementStats: Flag that indicates the statistics of the source
+                      statements (see statement_handler.statisticsHeaders)
+                      are added to the report records of the cloned
+                      repositories, which searches each clone in full
+      scanProcesses: The number of scan processes searching the large clones,
+                     shared by every repository handler within the process (1
+                     searches every clone within this process)
+      parallelScanBytes: The size of the clones above which they are
+                         searched by the scan processes (in bytes)
 
     """
 
+    if checkpointHandler == None:
+      checkpointHandler = checkpoint_handler.CheckpointHandler(os.devnull,
+          primaryLanguage, keywords, False, False, False, logger)
+    self._checkpointHandler = checkpointHandler
+
+    if sourceStatements != "":
+      self._statementHandler = statement_handler.StatementHandler(
+          sourceStatements, logger, maxScanFileSize, scanProcesses,
+          parallelScanBytes)
+
+    # The clones of a job are searched for the statements of every query
+    if statementStats and clone:
+      if sharedRepositories != None:
+        self._statisticsStatements = sharedRepositories.statements() or None
+      elif sourceStatements != "":
+        self._statisticsStatements = sourceStatements.split('|')
+
+    cacheHandler = None
+    if cacheDirectory != None:
+      cacheHandler = cache_handler.CacheHandler(cacheDirectory,
+          cacheTimeToLive, cacheMaxBytes, logger)
+
+    if storeFile != None:
+      self._storeHandler = store_handler.StoreHandler(storeFile, headers,
+          languages, storeFreshness, storeCrawl, logger)
+
+    filterHandler = filter_handler.FilterHandler(minSize, maxSize, skipForks,
+                                                 pushedAfter, minWatchers)
+    if filterHandler.isFiltering():
+      self._filterHandler = filterHandler
+
     self._reportHandler = report_handler.ReportHandler(headers, languages,
-                                                       logger)
-    self._apiHandler = api_handler.APIHandler(logger)
+        logger, reportQueue, self._storeHandler, reportTag)
+    self._sharedRepositories = sharedRepositories
+    self._rateHandler = rate_handler.getRateHandler(apiRate, logger)
+    self._connectionHandler = connection_handler.getConnectionHandler(poolSize,
+        poolIdleTimeout, logger)
+    self._apiHandler = api_handler.APIHandler(logger, self._rateHandler,
+                                              self._connectionHandler,
+                                              cacheHandler, apiUrl)
+    self._languagePool = ThreadPool(max(1, languageWorkers))
+    self._languageWorkers = max(1, languageWorkers)
+    self._streamPages = streamPages
+    self._cacheHandler = cacheHandler
+    self._poolSize = poolSize
+    self._poolIdleTimeout = poolIdleTimeout
+    self._apiUrl = apiUrl
+    self._asyncPages = max(1, asyncPages)
+
+    # Separately started processes can only share the pages through a file
+    if pageScheduler == None and maxProcesses > 1:
+      pageScheduler = scheduler_handler.FilePageScheduler(pageFile,
+          primaryLanguage, keywords, crawlId)
+    elif pageScheduler == None:
+      pageScheduler = scheduler_handler.PageScheduler()
+    self._pageScheduler = pageScheduler
+
+    if checkpointHandler.endPage != None:
+      pageScheduler.endOfResults(checkpointHandler.endPage)
+    self._progressQueue = progressQueue
 
     self._languages = languages
     self._primaryLanguage = primaryLanguage
@@ -86,8 +337,23 @@ class RepositoryHandler():
     self._processNumber = processNumber
     self._maxProcesses = maxProcesses
     self._logger = logger
-
-    self._reportHandler.readyCSVReport()
+    self._doneLock = threading.Lock()
+    self._metricsHandler = metrics_handler.getMetricsHandler()
+
+    if clone:
+      mirrorHandler = None
+      if mirrorDirectory != None:
+        mirrorHandler = mirror_handler.MirrorHandler(mirrorDirectory,
+                                                     maxMirrorBytes, logger)
+
+      self._cloneHandler = clone_handler.CloneHandler(cloneMode, blobLimit,
+          urllib.unquote(primaryLanguage), logger, mirrorHandler)
+      self._diskBudget = pipeline_handler.getDiskBudget(maxCloneBytes)
+      self._pipeline = pipeline_handler.getPipelineHandler(cloneWorkers,
+          scanWorkers, cleanWorkers, logger)
+      self._pipelineBatch = pipeline_handler.PipelineBatch({
+          'clone': self._cloneStage, 'scan': self._scanStage,
+          'clean': self._cleanStage})
 
   def crawlRepositories(self):
     """Function that crawls the GitHub repositories given the search criteria
@@ -97,89 +363,860 @@ class RepositoryHandler():
     repositories come in sets of 100 per page, and are handled one at a time.
     This terminates when there are no more repositories or an error occurs.
     Given the situation the repository can be cloned and further examined. The
-    pages are incremented based on the number of max processes searching.
+    pages are claimed from the page scheduler, so the concurrent executions
+    take the next unclaimed page whenever they are ready for more work.
 
     """
 
-    page = self._processNumber
-    done = False
+    page = self._claimPage()
 
-    while not done:
+    while page != None:
+
+      if self._streamPages:
+        outcome = {}
+        repositories = self._apiHandler.streamNextPage(page,
+            self._primaryLanguage, self._keywords, outcome)
+
+        # An empty (or failed) page is only known once it has been received
+        handled = self._handlePage(page, self._streamLanguages(repositories),
+                                   outcome)
+        if not outcome.get('complete'):
+          self._pageFailed(page)
+          break
+        elif handled == 0:
+          self._isEndOfResults(page, [])
+
+        page = self._claimPage()
+        continue
 
       # Acquire next page of repositories
       repositories = self._apiHandler.getNextPage(page, self._primaryLanguage,
                                                   self._keywords)
 
-      # Consider terminating condition
-      if repositories == None or len(repositories) == 0:
-        self._logger.info("No repositories left in current search")
-        done = True
-      else:
-        dataOfRepositories = []
+      if repositories == None:
+        self._pageFailed(page)
+        break
+
+      if self._isEndOfResults(page, repositories):
+        page = self._claimPage()
+        continue
+
+      for repository in repositories:
+        self._prepareRepository(repository)
+
+      # Acquire the languages of the whole page concurrently (in page order)
+      languagesOfRepositories = self._languagePool.imap(
+          self._acquireLanguages, repositories)
+
+      self._handlePage(page, itertools.izip(repositories,
+                                            languagesOfRepositories))
+      page = self._claimPage()
 
+    self._finishCrawl()
+
+  def crawlRepositoriesAsync(self):
+    """Function that crawls the GitHub repositories on an event loop
+
+    The crawl works like crawlRepositories, except that the API calls are
+    coroutines on an event loop in this thread. Several pages are crawled at
+    once, and the language API calls of a page are all in flight together,
+    bounded only by the connection pool and the rate budget. Once the
+    languages of a page are in, the page is handled on a thread of the loop,
+    one page at a time, so the loop keeps making API calls meanwhile.
+
+    """
+
+    loop = loop_handler.EventLoop()
+    connectionHandler = connection_handler.AsyncConnectionHandler(loop,
+        self._poolSize, self._poolIdleTimeout, self._logger)
+    apiHandler = api_handler.AsyncAPIHandler(self._logger, self._rateHandler,
+        connectionHandler, loop, self._cacheHandler, self._apiUrl)
+
+    try:
+      loop.run(loop.gather([self._crawlPagesAsync(loop, apiHandler)
+                            for crawler in range(self._asyncPages)]))
+    finally:
+      loop.close()
+
+    statistics = connectionHandler.statistics()
+    self._logger.info("Event loop connections: %d new, %d reused"
+                      %(statistics['created'], statistics['reused']))
+    self._finishCrawl()
+
+  def _crawlPagesAsync(self, loop, apiHandler):
+    """Crawls pages until the end of the search results (a coroutine)
+
+    Args:
+      loop: The EventLoop the crawl runs on
+      apiHandler: The AsyncAPIHandler making the API calls
+
+    """
+
+    page = self._claimPage()
+
+    while page != None:
+      repositories = yield apiHandler.getNextPage(page, self._primaryLanguage,
+                                                  self._keywords)
+
+      if repositories == None:
+        self._pageFailed(page)
+        return
+
+      if not self._isEndOfResults(page, repositories):
         for repository in repositories:
+          self._prepareRepository(repository)
+
+        languagesOfRepositories = yield loop.gather(
+            [self._acquireLanguagesAsync(loop, apiHandler, repository)
+             for repository in repositories])
+
+        yield loop.runInThread(self._handlePage, page, zip(repositories,
+                               languagesOfRepositories))
+
+      page = self._claimPage()
+
+  def _claimPage(self):
+    """Claims the next page that still needs to be crawled
+
+    Pages already written by the crawl being resumed are skipped entirely.
+
+    Returns:
+      The number of the claimed page, or None if the end of the search
+      results has been reached
+
+    """
+
+    page = self._pageScheduler.claimPage()
+
+    while page != None and self._checkpointHandler.isPageWritten(page):
+      self._logger.info("Page %d is already in the report, skipping it"
+                        %page)
+      page = self._pageScheduler.claimPage()
+
+    if page != None:
+      self._checkpointHandler.recordPage(self._processNumber, page, "claimed")
+
+    return page
+
+  def _isEndOfResults(self, page, repositories):
+    """Determines if a page is past the end of the search results
+
+    Args:
+      page: The number of the page
+      repositories: The repositories of the page
+
+    Returns:
+      True if the page has no repositories, otherwise False
+
+    """
+
+    # Consider terminating condition
+    if len(repositories) == 0:
+      self._logger.info("No repositories left in current search")
+      self._pageScheduler.endOfResults(page)
+      self._checkpointHandler.recordPage(self._processNumber, page, "end")
+      return True
+
+    return False
+
+  def _pageFailed(self, page):
+    """Stops the crawl of this execution at a page whose API call failed
+
+    The page is neither the end of the search results nor written, so a
+    resumed crawl claims it again.
+
+    Args:
+      page: The number of the page
+
+    """
+
+    self._logger.warn("Page %d could not be acquired, stopping this crawl "
+                      "(resume it to retry the page)" %page)
+    self._metricsHandler.increment("pages.failed")
+
+  def _prepareRepository(self, repository):
+    """Sets up the unique name and clone URL of a repository
+
+    The criterion the repository fails (if any) is determined here as well,
+    as 'filterRejection', so nothing more is done for the repository.
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    """
+
+    # Make a unique name so forks and leading '-' don't cause problems
+    repository['uniqueName'] = "_%s_%s" %(repository['name'],
+                                          repository['owner'])
+
+    # Change the repository url from 'https' to 'git', much faster
+    if repository['url'].startswith("https:"):
+      repository['url'] = "git" + repository['url'][5:]
+
+    if self._filterHandler != None:
+      repository['filterRejection'] = self._filterHandler.rejection(
+          repository)
+
+  def _streamLanguages(self, repositories):
+    """Acquires the languages of the repositories of a page as they arrive
+
+    The language API calls start while the page is still being received.
+    Only a few repositories at a time are between being received and being
+    handled, so the page is never held as a whole.
+
+    Args:
+      repositories: The generator of the repositories of the page
+
+    Returns:
+      A generator of (repository, language->size values) tuples, in page
+      order
+
+    """
+
+    admitted = threading.BoundedSemaphore(2 * self._languageWorkers)
+
+    def admit():
+      for repository in repositories:
+        self._prepareRepository(repository)
+        admitted.acquire()
+        yield repository
+
+    pairs = self._languagePool.imap(self._acquireRepositoryLanguages, admit())
+
+    for repository, repositoryLanguages in pairs:
+      yield repository, repositoryLanguages
+      admitted.release()
+
+  def _handlePage(self, page, repositoriesAndLanguages, outcome=None):
+    """Handles the repositories of a page and passes its data to the report
+
+    Args:
+      page: The number of the page
+      repositoriesAndLanguages: The (repository, language->size values)
+                                tuples of the page, in page order
+      outcome: The dictionary whose 'complete' flag tells if a streamed page
+               was received as a whole (the data of a page that was cut off
+               is left to a resume, which reuses the journaled records)
 
-          # Make a unique name so forks and leading '-' don't cause problems
-          repository['uniqueName'] = "_%s_%s" %(repository['name'],
-                               repository['owner'])
+    Returns:
+      The number of repositories of the page (nothing is passed to the report
+      when there are none)
 
-          # Change the repository url from 'https' to 'git', much faster
-          repository['url'] = "git" + repository['url'][5:]
+    """
 
-          startTime = datetime.now()  # Make note of the starting time
-          size, data = self._examineRepository(repository)
+    pageStartTime = time.time()
+    dataOfRepositories = []
+    examined = []
+    repositories = 0
+
+    for repository, repositoryLanguages in repositoriesAndLanguages:
+
+      repositories += 1
+      startTime = datetime.now()  # Make note of the starting time
+      resumedOutcome = self._checkpointHandler.outcome(repository)
+      data = self._checkpointHandler.examinedRow(repository)
+      storeOutcome = repository.get('storeOutcome')
+
+      if resumedOutcome == "skipped":
+        continue  # Found to be without content by the resumed crawl
+      elif repository.get('filterRejection') != None:
+        self._logger.info("%s is filtered out by its %s"
+                          %(repository['uniqueName'],
+                            repository['filterRejection']),
+                          extra={'repo': repository['uniqueName'],
+                                 'stage': "filter"})
+        self._metricsHandler.increment("filter." +
+                                       repository['filterRejection'])
+        continue
+      elif storeOutcome == "duplicate":
+        self._logger.info("%s is handled on another page, skipping it"
+                          %repository['uniqueName'],
+                          extra={'repo': repository['uniqueName'],
+                                 'stage': "filter"})
+        self._metricsHandler.increment("store.duplicates")
+        continue
+      elif data != None:
+        size = 1  # Only repositories with content have a report row
+      else:
+        if storeOutcome == "fresh":
+          data = repository['storedRecord']  # Examined by an earlier crawl
+          size = data.totalSize()
+          self._metricsHandler.increment("store.fresh")
+        else:
+          size, data = self._examineRepository(repository,
+                                               repositoryLanguages)
 
           # If the API call failed for examining the repository, skip it
           if data == None:
-            self._logger.warn("Language acquisition process failed, skipping %s"
-                                  %repository['uniqueName'])
+            self._logger.warn("Language acquisition process failed, "
+                              "skipping %s" %repository['uniqueName'],
+                              extra={'repo': repository['uniqueName'],
+                                     'stage': "languages"})
+            if storeOutcome == "claimed":
+              self._storeHandler.release(self._storeName(repository))
             continue
 
-          if size > 0:
-            dataOfRepositories.append(data)
+          if storeOutcome == "claimed":
+            examined.append((self._storeName(repository), data))
 
-            if self._clone:
-              cloned = self._cloneRepository(repository)
+        self._checkpointHandler.recordOutcome(self._processNumber, page,
+            repository, "examined" if size > 0 else "skipped",
+            data if size > 0 else None)
 
-              if cloned:
+      if size > 0:
+        dataOfRepositories.append(self._withStatistics(data, None))
 
-                if self._sourceStatements != "":
-                  relavant = self._isStatementInRepository(repository)
+        # The cloning and searching overlap with the rest of the page
+        if self._clone and not self._isHandled(resumedOutcome) and \
+           storeOutcome != "fresh":
+          self._pipeline.put("clone", {'page': page,
+                                       'repository': repository,
+                                       'startTime': startTime,
+                                       'record': data,
+                                       'records': dataOfRepositories,
+                                       'position': len(dataOfRepositories) - 1},
+                             self._pipelineBatch)
+          continue
 
-                  if relavant:
-                    self._customHandleRepository(repository)
-                  else:
-                    self._cleanRepository(repository)
-              else:
-                self._logger.warn("Clone process failed, therefore skipping")
-                continue
+      else:
+        self._logger.warn("No content found in repository, therefore "
+                          "skipping", extra={'repo': repository['uniqueName'],
+                                             'stage': "languages"})
+        continue
 
-          else:
-            self._logger.warn("No content found in repository, therefore "
-                              "skipping")
-            continue
+      self._repositoryDone(repository, startTime)
+
+    # The page is only complete once its clones are handled
+    if self._clone:
+      self._pipelineBatch.join()
+
+    if repositories > 0:
+      self._reportHandler.storeData(examined)
+      if outcome == None or outcome.get('complete'):
+        self._reportHandler.appendCSVData(dataOfRepositories, page)
+
+    self._metricsHandler.observe("page.handle", time.time() - pageStartTime)
+    self._metricsHandler.increment("pages.handled")
+    self._reportMetrics()
+    return repositories
+
+  def _reportMetrics(self):
+    """Reports the snapshot of the metrics of this process to the progress
+    queue (if there is one)"""
+
+    if self._progressQueue != None:
+      self._progressQueue.put(("metrics", self._processNumber,
+                               self._metricsHandler.snapshot()))
+
+  def _finishCrawl(self):
+    """Stops the workers of the crawl and reports that it finished"""
+
+    self._languagePool.close()
+    self._languagePool.join()
+
+    # The pipeline is shared by the process, so only this crawl's items are
+    # waited for
+    if self._clone:
+      self._pipelineBatch.join()
+
+    statistics = self._connectionHandler.statistics()
+    self._logger.info("Connections so far: %d new, %d reused"
+                      %(statistics['created'], statistics['reused']))
+
+    self._reportMetrics()
+    if self._progressQueue != None:
+      self._progressQueue.put(("finished", self._processNumber,
+                               self._repositoriesDone))
+
+  def _cloneStage(self, item):
+    """Clones a repository, as the first stage of the pipeline
+
+    The expected size of the repository is reserved from the disk budget
+    before cloning, and corrected to the actual size afterwards. When the
+    crawl is a query of a job, a repository that another query cloned is
+    not cloned again (see _useSharedClone).
+
+    Args:
+      item: The dictionary of the 'page', 'repository', 'startTime' and
+            report 'record' of the repository (at the 'position' of the
+            'records' of its page)
+
+    Returns:
+      The next stage of the item, or None if the item is done
+
+    """
+
+    repository = item['repository']
+    nextStage = None
+
+    try:
+      if self._sharedRepositories != None:
+        result = self._sharedRepositories.claimClone(
+            self._storeName(repository))
+        item['sharedClone'] = result == None
+        if result != None and self._useSharedClone(item, result):
+          return None
+
+      expectedBytes = repository.get('size', 0) * 1024  # Size is given in KB
+      self._diskBudget.reserve(expectedBytes)
+      item['bytes'] = expectedBytes
+
+      with self._metricsHandler.timer("stage.clone") as timing:
+        cloned = self._cloneRepository(repository)
+
+      if not cloned:
+        self._releaseClone(item, False)
+        self._logger.warn("Clone process failed, therefore skipping",
+                          extra={'repo': repository['uniqueName'],
+                                 'stage': "clone",
+                                 'duration': timing['duration']})
+        self._metricsHandler.increment("clone.failures")
+        return None
+
+      self._checkpointHandler.recordOutcome(self._processNumber, item['page'],
+                                            repository, "cloned")
+
+      clonedBytes = self._directorySize(repository['uniqueName'])
+      self._diskBudget.adjust(clonedBytes - item['bytes'])
+      item['bytes'] = clonedBytes
+      self._metricsHandler.increment("clone.bytes", clonedBytes)
+      self._logger.info("Cloned %s" %repository['uniqueName'],
+                        extra={'repo': repository['uniqueName'],
+                               'stage': "clone",
+                               'duration': timing['duration'],
+                               'bytes': clonedBytes})
+
+      # The clones shared by a job are searched for every query's statements
+      if self._sourceStatements != "" or \
+         (item.get('sharedClone') and self._sharedRepositories.isSearching()):
+        nextStage = ("scan", item)
+        return nextStage
+
+      # Without source statements the clone is kept
+      self._releaseClone(item, True, True)
+      self._repositoryDone(repository, item['startTime'])
+      return None
+    finally:
+      if nextStage == None:
+        self._releaseClone(item, False)  # Only when the stage failed
+
+  def _scanStage(self, item):
+    """Searches a cloned repository, as the second stage of the pipeline
+
+    Relevant repositories are handled by the custom handle function and kept,
+    the others move on to be cleaned.
+
+    Args:
+      item: The dictionary of the 'page', 'repository', 'startTime' and
+            'bytes' of the clone
+
+    Returns:
+      The next stage of the item, or None if the item is done
+
+    """
+
+    repository = item['repository']
+    nextStage = None
+
+    try:
+      with self._metricsHandler.timer("stage.scan") as timing:
+        if item.get('sharedClone'):
+          item['found'], item['statistics'] = \
+              self._sharedRepositories.scanClone(repository['uniqueName'])
+          self._recordStatistics(item, item['statistics'])
+          matched = self._isMatch(item['found'])
+
+          # Kept for any query of the job whose statements were found
+          kept = len(item['found']) > 0 or self._sourceStatements == ""
+        elif self._statisticsStatements != None:
+          statistics = self._statementHandler.scanStatistics(
+              repository['uniqueName'])
+          self._recordStatistics(item, statistics)
+          matched = kept = any(matches > 0 for matches, files, firstHit in
+                               statistics)
+        else:
+          matched = kept = self._isStatementInRepository(repository)
+
+      self._logger.info("Scanned %s (%s)" %(repository['uniqueName'],
+                        "matched" if matched else "not matched"),
+                        extra={'repo': repository['uniqueName'],
+                               'stage': "scan",
+                               'duration': timing['duration'],
+                               'bytes': item['bytes']})
+
+      if not kept:
+        nextStage = ("clean", item)
+        return nextStage
+
+      if matched:
+        self._customHandleRepository(repository)
+        self._checkpointHandler.recordOutcome(self._processNumber,
+                                              item['page'], repository,
+                                              "matched")
+      self._releaseClone(item, True, True)
+      self._repositoryDone(repository, item['startTime'])
+      return None
+    finally:
+      if nextStage == None:
+        self._releaseClone(item, False)  # Only when the stage failed
+
+  def _cleanStage(self, item):
+    """Removes a cloned repository, as the last stage of the pipeline
+
+    Args:
+      item: The dictionary of the 'page', 'repository', 'startTime' and
+            'bytes' of the clone
+
+    Returns:
+      None, as the item is done
+
+    """
+
+    repository = item['repository']
+
+    try:
+      with self._metricsHandler.timer("stage.clean") as timing:
+        self._cleanRepository(repository)
+      self._logger.info("Removed cloned repository %s"
+                        %repository['uniqueName'],
+                        extra={'repo': repository['uniqueName'],
+                               'stage': "clean",
+                               'duration': timing['duration'],
+                               'bytes': item['bytes']})
+      self._checkpointHandler.recordOutcome(self._processNumber, item['page'],
+                                            repository, "cleaned")
+      self._releaseClone(item, True, False)
+      self._repositoryDone(repository, item['startTime'])
+      return None
+    finally:
+      self._releaseClone(item, False)  # Only when the stage failed
+
+  def _useSharedClone(self, item, result):
+    """Handles a repository that another query of the job cloned
+
+    Args:
+      item: The dictionary of the 'page', 'repository' and 'startTime'
+      result: The result of the clone (see SharedRepositories.finishClone)
+
+    Returns:
+      True if the repository is done, or False if it still has to be cloned
+      (the clone was removed, but this query keeps its clones)
+
+    """
+
+    repository = item['repository']
+
+    if not result['cloned']:
+      self._logger.warn("Clone process failed, therefore skipping",
+                        extra={'repo': repository['uniqueName'],
+                               'stage': "clone"})
+      return True
+
+    if result['statistics'] != None:
+      self._recordStatistics(item, result['statistics'])
+
+    if self._sourceStatements == "":
+      if not result['kept']:
+        return False
+    elif self._isMatch(result['found'] or []):
+      self._customHandleRepository(repository)
+
+    self._logger.info("%s was cloned by another query"
+                      %repository['uniqueName'],
+                      extra={'repo': repository['uniqueName'],
+                             'stage': "clone"})
+    self._metricsHandler.increment("clone.shared")
+    self._repositoryDone(repository, item['startTime'])
+    return True
+
+  def _releaseClone(self, item, cloned, kept=False):
+    """Releases the bytes of a clone that is done from the disk budget and
+    records the result of the clone for the other queries of the job
+
+    Only the first call for an item has an effect, so a stage that fails
+    halfway still releases its clone, but a clone is never released twice.
+
+    Args:
+      item: The dictionary of the repository going through the pipeline,
+            along with the 'bytes' reserved for its clone (once reserved)
+      cloned: Flag that indicates the clone succeeded
+      kept: Flag that indicates the clone is kept
+
+    """
+
+    if item.get('released'):
+      return
+    item['released'] = True
+
+    self._finishSharedClone(item, cloned, kept)
+    if 'bytes' in item:
+      self._diskBudget.release(item['bytes'])
+
+  def _finishSharedClone(self, item, cloned, kept=False):
+    """Records the result of a clone for the other queries of the job, if
+    this query made the clone
+
+    Args:
+      item: The dictionary of the 'page', 'repository' and 'startTime', along
+            with the 'found' source statements and their 'statistics' once
+            the clone is searched
+      cloned: Flag that indicates the clone succeeded
+      kept: Flag that indicates the clone is kept
+
+    """
+
+    if item.get('sharedClone'):
+      self._sharedRepositories.finishClone(self._storeName(item['repository']),
+          cloned, item.get('found'), kept, item.get('statistics'))
+
+  def _withStatistics(self, record, statistics):
+    """Adds the statistics of the source statements to a report record
+
+    Args:
+      record: The RepositoryRecord of the repository
+      statistics: The list of the (matches, files, first hit) tuples of the
+                  source statements, or None if the repository wasn't
+                  searched (the statistics are left empty)
+
+    Returns:
+      The RepositoryRecord with the statistics as its last header fields (the
+      record itself when the statistics aren't reported)
+
+    """
+
+    if self._statisticsStatements == None:
+      return record
+
+    if statistics == None:
+      statistics = [(None, None, None)] * len(self._statisticsStatements)
+
+    return report_handler.RepositoryRecord(record.languageIndexes,
+        record.languageSizes,
+        record.fields + tuple(itertools.chain.from_iterable(statistics)))
+
+  def _recordStatistics(self, item, statistics):
+    """Replaces the report record of a cloned repository with the one that
+    has the statistics of the source statements
+
+    Args:
+      item: The dictionary of the 'record' of the repository and its
+            'position' in the 'records' of its page
+      statistics: The list of the (matches, files, first hit) tuples of the
+                  source statements
+
+    """
+
+    if self._statisticsStatements != None:
+      item['records'][item['position']] = self._withStatistics(item['record'],
+                                                               statistics)
+
+  def _isMatch(self, found):
+    """Determines if any source statement of this crawl was found
+
+    Args:
+      found: The list of the source statements found in a repository
+
+    Returns:
+      True if a source statement of this crawl is among them, otherwise False
+
+    """
+
+    return self._sourceStatements != "" and \
+           any(statement in found
+               for statement in self._sourceStatements.split('|'))
+
+  def _repositoryDone(self, repository, startTime):
+    """Reports the progress of a repository that is done
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+      startTime: The time the handling of the repository started
+
+    """
+
+    timeTaken = datetime.now() - startTime  # Figure out the time taken
+
+    with self._doneLock:
+      self._repositoriesDone += 1
+    self._metricsHandler.increment("repositories.done")
+
+    self._logger.info("Done: %s (took %s)" \
+                      %(repository['uniqueName'], timeTaken),
+                      extra={'repo': repository['uniqueName'],
+                             'stage': "done",
+                             'duration': timeTaken.total_seconds()})
+
+  def _directorySize(self, directory):
+    """Calculates the number of bytes taken by the files of a directory tree
+
+    Args:
+      directory: The root of the directory tree
+
+    Returns:
+      The total size of the files in bytes
+
+    """
+
+    totalSize = 0
 
-          timeTaken = datetime.now() - startTime  # Figure out the time taken
-          print "P%d Done: %s (took %s)" \
-                %(self._processNumber, repository['uniqueName'], timeTaken)
-          self._logger.info("Done: %s (took %s)" \
-                            %(repository['uniqueName'], timeTaken))
+    for root, directories, files in os.walk(directory):
+      for name in files:
+        try: totalSize += os.lstat(os.path.join(root, name)).st_size
+        except OSError: pass
 
-        self._reportHandler.appendCSVData(dataOfRepositories)
-      page += self._maxProcesses
+    return totalSize
+
+  def _acquireLanguages(self, repository):
+    """Acquires the language information of a repository
+
+    Repositories that are filtered out, that were already examined by the
+    crawl being resumed, or that the store has for this crawl (see
+    _claimRepository), don't need their language information.
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      A list of language->size values of the repository, or None
+
+    """
+
+    if repository.get('filterRejection') != None or \
+       self._checkpointHandler.examinedRow(repository) != None or \
+       self._checkpointHandler.outcome(repository) == "skipped" or \
+       not self._claimRepository(repository):
+      return None
+
+    if self._sharedRepositories != None:
+      return self._sharedRepositories.languages(self._storeName(repository),
+          lambda: self._apiHandler.getLanguages(repository))
+
+    return self._apiHandler.getLanguages(repository)
+
+  def _acquireRepositoryLanguages(self, repository):
+    """Acquires the language information of a repository, along with it
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      A tuple of the repository and its list of language->size values (or
+      None)
+
+    """
+
+    return repository, self._acquireLanguages(repository)
+
+  def _acquireLanguagesAsync(self, loop, apiHandler, repository):
+    """Acquires the language information of a repository (a coroutine)
+
+    Args:
+      loop: The EventLoop the crawl runs on
+      apiHandler: The AsyncAPIHandler making the API calls
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      A list of language->size values of the repository, or None
+
+    """
+
+    if repository.get('filterRejection') != None or \
+       self._checkpointHandler.examinedRow(repository) != None or \
+       self._checkpointHandler.outcome(repository) == "skipped" or \
+       not self._claimRepository(repository):
+      raise loop_handler.Return(None)
+
+    entry = None
+    if self._sharedRepositories != None:
+      entry = self._sharedRepositories.claimLanguages(
+          self._storeName(repository))
+
+    if entry != None:
+      # Another query makes the API call, waiting on it would block the loop
+      while not entry[0].is_set():
+        yield loop.sleep(0.05)
+      raise loop_handler.Return(entry[1])
+
+    languages = None
+    try:
+      languages = yield apiHandler.getLanguages(repository)
+    finally:
+      if self._sharedRepositories != None:
+        self._sharedRepositories.finishLanguages(self._storeName(repository),
+                                                 languages)
+
+    raise loop_handler.Return(languages)
+
+  def _claimRepository(self, repository):
+    """Claims a repository in the store, before any work is done on it
+
+    The outcome of the claim ('duplicate', 'fresh' or 'claimed') and the
+    stored record (of a fresh repository) are kept with the repository
+    information, for the handling of the page.
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      True if the repository is to be examined, otherwise False
+
+    """
+
+    if self._storeHandler == None:
+      return True
+
+    repository['storeOutcome'], repository['storedRecord'] = \
+        self._storeHandler.claim(self._storeName(repository))
+    return repository['storeOutcome'] == "claimed"
+
+  def _storeName(self, repository):
+    """Forms the name of a repository in the store
+
+    Args:
+      repository: The repository information in a JSON format (dictionary)
+
+    Returns:
+      The name of the repository as 'owner/name'
+
+    """
+
+    return "%s/%s" %(repository['owner'], repository['name'])
+
+  def _isHandled(self, outcome):
+    """Determines if the crawl being resumed completed handling a repository
+
+    Args:
+      outcome: The outcome of the repository in the crawl being resumed
+
+    Returns:
+      True if the repository needs no cloning or searching, otherwise False
+
+    """
+
+    if outcome in ("matched", "cleaned"):
+      return True
+
+    # Without source statements there is nothing to do after the clone
+    return outcome == "cloned" and self._sourceStatements == ""
 
   def _cloneRepository(self, repository):
     """Clones the specified repository into the present working directory
 
-    Performs a shallow git clone of the specified repository into the present
-    working directory of the file system.
+    Performs a shallow git clone (or a sparse one, depending on the clone
+    mode) of the specified repository into the present working directory of
+    the file system.
 
     Args:
       repository: The repository information in a JSON format (dictionary)
 
+    Returns:
+      True if the clone succeeded, otherwise false
+
     """
 
-    self._logger.info("Cloning Repository %s" %repository['uniqueName'])
+    self._logger.debug("Cloning Repository %s" %repository['uniqueName'],
+                       extra={'repo': repository['uniqueName'],
+                              'stage': "clone"})
 
     currentAttempt = 0
     maxAttempts = 10  # The number of attempts to retry the API call
@@ -187,24 +1224,22 @@ class RepositoryHandler():
 
     # Keep trying to complete a successful clone (up to maxAttempts times)
     while not successful:
-      process = subprocess.Popen(['git', 'clone', '--depth', '1',
-                                 repository['url'],
-                                 repository['uniqueName']],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 shell=False)
-      output, error = process.communicate()
-
-      # If the clone doesn't succeed wait 60 seconds and try again
-      if len(error) > 0 and "fatal: destination path" not in error and \
+      error = self._cloneHandler.clone(repository['url'],
+          repository['uniqueName'], "%s/%s" %(repository['owner'],
+                                              repository['name']))
+
+      # If the clone doesn't succeed back off and try again
+      if error != None and "fatal: destination path" not in error and \
          "error: unable to write sha1" not in error:
-        self._logger.warn("Unsuccessful clone -> Error (%s " %error)
+        self._logger.warn("Unsuccessful clone -> Error (%s " %error,
+                          extra={'repo': repository['uniqueName'],
+                                 'stage': "clone"})
         currentAttempt += 1
         if currentAttempt <= maxAttempts:
           self._logger.info("Retrying clone %d/%d" %(currentAttempt,
                             maxAttempts))
-          self._logger.info("Waiting 60 seconds")
-          time.sleep(60)
+          self._rateHandler.backoff(currentAttempt,
+                                    rate_handler.NETWORK_ERROR, apiCall=False)
         else:
           self._logger.warn("Max clone attempts exceeded")
           break
@@ -223,9 +1258,6 @@ class RepositoryHandler():
     located under the present working directory with the name found from
     repository['uniqueName'].
 
-    Performs a shallow git clone of the specified repository into the present
-    working directory of the file system.
-
     Args:
       repository: The repository information in a JSON format (dictionary)
 
@@ -238,7 +1270,8 @@ class RepositoryHandler():
   def _isStatementInRepository(self, repository):
     """Searches within the repository for the source statements
 
-    Searches for the source statements using a recursive egrep command.
+    Searches for the source statements within this process (or with the
+    scan processes, for a large clone), stopping at the first hit.
 
     Args:
       repository: The repository information in a JSON format (dictionary)
@@ -248,19 +1281,19 @@ class RepositoryHandler():
 
     """
 
-    self._logger.info("Grepping for sourceStatements (%s)"
-                      %self._sourceStatements)
-    process = subprocess.Popen(['egrep', self._sourceStatements, '-riswl',
-                                repository['uniqueName'],
-                                '--exclude-dir=*/.git/*'],
-                                stdout=subprocess.PIPE, shell=False)
-    output, error = process.communicate()
-
-    if len(output) > 0:
-      self._logger.info("Statements found")
+    self._logger.debug("Searching for sourceStatements (%s)"
+                       %self._sourceStatements,
+                       extra={'repo': repository['uniqueName'],
+                              'stage': "scan"})
+    hits = self._statementHandler.findStatements(repository['uniqueName'])
+
+    if len(hits) > 0:
+      self._logger.info("Statements found (%s in %s)" %(hits[0][1],
+                                                        hits[0][0]),
+                        extra={'repo': repository['uniqueName'],
+                               'stage': "scan"})
       return True
     else:
-      self._logger.info("Statements not found")
       return False
 
   def _cleanRepository(self, repository):
@@ -276,43 +1309,48 @@ class RepositoryHandler():
     process = subprocess.Popen(['rm', '-rf', repository['uniqueName']],
                                 stdout=subprocess.PIPE, shell=False)
     output, error = process.communicate()
-    self._logger.info("Removed cloned repository")
 
-  def _examineRepository(self, repository):
+  def _examineRepository(self, repository, repositoryLanguages):
     """Examines the repository and acquires all the information from it
 
     An individual repository is handled here by acquiring all of its general
-    information. To acquire the language information, another GitHub API call
-    is needed. The total size of the repository is also calculated here based
-    on the individual languages.
+    information. The language information comes from another GitHub API call,
+    which is made ahead of time for the whole page. The total size of the
+    repository is also calculated here based on the individual languages.
 
     Args:
       repository: The repository that will be examined to acquire information
+      repositoryLanguages: The language->size values of the repository (None
+                           if the language API call failed)
 
     Returns:
-      List of language size for repository.
       Total size of the repository (in terms of languages)
+      The RepositoryRecord of the repository (without header fields when the
+      repository has no content)
     """
     totalSize = 0
-    allInfo = []
-    repositoryLanguages = self._apiHandler.getLanguages(repository)
+    languageIndexes = array.array('H')
+    languageSizes = array.array('L')
+    fields = []
 
     if repositoryLanguages == None:
       return None, None
 
-    for language in self._languages:
-      try:
-        allInfo.append(repositoryLanguages[language])
-        totalSize += repositoryLanguages[language]
-      except KeyError: allInfo.append(0)
+    for index, language in enumerate(self._languages):
+      size = repositoryLanguages.get(language, 0)
+      if size > 0:
+        languageIndexes.append(index)
+        languageSizes.append(size)
+        totalSize += size
 
     # If there is content in the repository then the data is useful
     if totalSize > 0:
 
       # Acquire list of all the repository information
       for info in self._headers:
-        try: allInfo.append(repository[info].encode("utf-8"))
-        except KeyError: allInfo.append(0)
-        except AttributeError: allInfo.append(repository[info])
+        try: fields.append(repository[info].encode("utf-8"))
+        except KeyError: fields.append(0)
+        except AttributeError: fields.append(repository[info])
 
-    return totalSize, allInfo
+    return totalSize, report_handler.RepositoryRecord(languageIndexes,
+        languageSizes, tuple(fields))
@@ -0,0 +1,245 @@
+import fcntl
+import hashlib
+import multiprocessing
+import os
+import threading
+try: import simplejson as json
+except ImportError: import json
+
+
+class PageScheduler():
+
+  """This class hands out the repository pages to the concurrent executions
+
+  Instead of each execution being bound to a fixed stripe of pages, every
+  execution claims the next unclaimed page when it is ready for more work. So
+  an execution that is held up by a slow page doesn't hold up the rest of the
+  crawl. As soon as any execution finds the end of the search results, the
+  executions stop claiming pages past it. This scheduler is shared by the
+  executions (threads) of a single process.
+
+  """
+
+  # The next page that has not been claimed yet
+  _nextPage = None
+
+  # The first page known to be past the end of the search results (or None)
+  _endPage = None
+
+  # Lock guarding the page bookkeeping
+  _lock = None
+
+  def __init__(self):
+    """Constructor that starts the scheduling at the first page"""
+
+    self._nextPage = 1
+    self._endPage = None
+    self._lock = threading.Lock()
+
+  def claimPage(self):
+    """Claims the next unclaimed page
+
+    Returns:
+      The number of the claimed page, or None if the end of the search
+      results has been reached
+
+    """
+
+    with self._lock:
+      if self._endPage != None and self._nextPage >= self._endPage:
+        return None
+
+      page = self._nextPage
+      self._nextPage += 1
+      return page
+
+  def endOfResults(self, page):
+    """Records that the page is past the end of the search results
+
+    Args:
+      page: The number of the page that has no repositories
+
+    """
+
+    with self._lock:
+      if self._endPage == None or page < self._endPage:
+        self._endPage = page
+
+
+class SharedPageScheduler():
+
+  """This class hands out the repository pages to concurrent worker processes
+
+  This scheduler works like the PageScheduler, except that the bookkeeping is
+  kept in shared memory. It must be made before the worker processes are
+  started, which then inherit it.
+
+  """
+
+  # The next page that has not been claimed yet (shared memory)
+  _nextPage = None
+
+  # The first page past the end of the search results, 0 if unknown (shared)
+  _endPage = None
+
+  # Lock guarding the page bookkeeping across the processes
+  _lock = None
+
+  def __init__(self):
+    """Constructor that starts the scheduling at the first page"""
+
+    self._lock = multiprocessing.Lock()
+    self._nextPage = multiprocessing.Value('i', 1, lock=False)
+    self._endPage = multiprocessing.Value('i', 0, lock=False)
+
+  def claimPage(self):
+    """Claims the next unclaimed page
+
+    Returns:
+      The number of the claimed page, or None if the end of the search
+      results has been reached
+
+    """
+
+    with self._lock:
+      if self._endPage.value != 0 and \
+         self._nextPage.value >= self._endPage.value:
+        return None
+
+      page = self._nextPage.value
+      self._nextPage.value += 1
+      return page
+
+  def endOfResults(self, page):
+    """Records that the page is past the end of the search results
+
+    Args:
+      page: The number of the page that has no repositories
+
+    """
+
+    with self._lock:
+      if self._endPage.value == 0 or page < self._endPage.value:
+        self._endPage.value = page
+
+
+class FilePageScheduler():
+
+  """This class hands out the repository pages to manually started processes
+
+  This scheduler works like the PageScheduler, except that the bookkeeping is
+  kept in a small state file that is locked while it is being updated. This
+  lets separately started processes (using the -p and -m parameters) share the
+  pages of a crawl. The state file is tied to the search criteria and the
+  crawl identifier that every process of the crawl is given, a state file of
+  a different search or crawl is started over by whichever process comes
+  first. Without a crawl identifier, a process starts the pages of the search
+  over only when its first claim finds them all claimed, so a later crawl of
+  the search doesn't stop at the end found by an earlier one.
+
+  """
+
+  # The path of the state file
+  _path = None
+
+  # The identifier of the search criteria the state file belongs to
+  _search = None
+
+  # The identifier of the crawl the state file belongs to (or None)
+  _crawl = None
+
+  # Flag that indicates this process claimed a page already
+  _claimed = False
+
+  def __init__(self, path, language, keywords, crawl=None):
+    """Constructor that sets the state file and the search criteria
+
+    Args:
+      path: The path of the state file shared by the processes
+      language: The language for the search being conducted
+      keywords: The keywords for the search being conducted
+      crawl: The identifier of the crawl shared by its processes (or None)
+
+    """
+
+    self._path = path
+    self._search = hashlib.sha1(language + "\n" + keywords).hexdigest()
+    self._crawl = crawl
+
+  def claimPage(self):
+    """Claims the next unclaimed page
+
+    Returns:
+      The number of the claimed page, or None if the end of the search
+      results has been reached
+
+    """
+
+    def claim(state):
+      finished = state['endPage'] != None and \
+                 state['nextPage'] >= state['endPage']
+
+      # A new process without a crawl identifier starts a finished crawl over
+      if finished and not self._claimed and self._crawl == None:
+        state['nextPage'] = 1
+        state['endPage'] = None
+      elif finished:
+        return None
+
+      state['nextPage'] += 1
+      return state['nextPage'] - 1
+
+    page = self._update(claim)
+    self._claimed = True
+    return page
+
+  def endOfResults(self, page):
+    """Records that the page is past the end of the search results
+
+    Args:
+      page: The number of the page that has no repositories
+
+    """
+
+    def end(state):
+      if state['endPage'] == None or page < state['endPage']:
+        state['endPage'] = page
+
+    self._update(end)
+
+  def _update(self, function):
+    """Applies a function to the state while holding the lock on the file
+
+    Args:
+      function: The function that reads and modifies the state dictionary
+
+    Returns:
+      The result of the function
+
+    """
+
+    descriptor = os.open(self._path, os.O_RDWR | os.O_CREAT, 0644)
+
+    try:
+      fcntl.flock(descriptor, fcntl.LOCK_EX)
+      stateFile = os.fdopen(os.dup(descriptor), 'r+')
+
+      try:
+        state = json.loads(stateFile.read())
+        if state['search'] != self._search or \
+           state.get('crawl') != self._crawl:
+          raise ValueError("State file belongs to another search or crawl")
+      except (ValueError, KeyError):
+        state = {'search': self._search, 'crawl': self._crawl,
+                 'nextPage': 1, 'endPage': None}
+
+      result = function(state)
+
+      stateFile.seek(0)
+      stateFile.truncate()
+      stateFile.write(json.dumps(state))
+      stateFile.close()
+
+      return result
+    finally:
+      os.close(descriptor)  # Closing the file releases the lock
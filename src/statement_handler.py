@@ -0,0 +1,711 @@
+import mmap
+import multiprocessing
+import os
+import Queue
+import re
+import threading
+from contextlib import contextmanager
+
+# The suffixes of the report headers of the statistics of a source statement
+_STATISTICS_SUFFIXES = ["_matches", "_files", "_first_hit"]
+
+# The number of bytes of the files in a task of the scan processes, larger
+# files are split into chunks of this size
+_CHUNK_BYTES = 4194304
+
+# The number of bytes a chunk reaches into the next one, so a match across the
+# boundary of the chunks is still found (by the chunk it starts in)
+_CHUNK_OVERLAP = 4096
+
+# The number of searches the scan processes work on at once (each has its own
+# stop flag)
+_STOP_SLOTS = 64
+
+# The pool of scan processes shared by everything in this process
+_sharedScanPool = None
+
+# Lock guarding the creation of the shared pool of scan processes
+_sharedLock = threading.Lock()
+
+# The stop flags of the searches (within a scan process)
+_stopFlags = None
+
+# The compiled expressions by their source (within a scan process)
+_patterns = {}
+
+
+def statisticsHeaders(statements):
+  """Forms the report headers of the statistics of the source statements
+
+  Args:
+    statements: The list of the source statements
+
+  Returns:
+    The list of the headers, the number of matches, the number of files and
+    the first hit of each source statement in turn (ex: synchronized_matches,
+    synchronized_files, synchronized_first_hit)
+
+  """
+
+  return [statement + suffix for statement in statements
+          for suffix in _STATISTICS_SUFFIXES]
+
+
+def _statementIndexes(match):
+  """Determines which source statements a match is of
+
+  Args:
+    match: The match of the compiled expression of the source statements
+
+  Returns:
+    The sorted list of the indexes of the source statements that matched at
+    its position
+
+  """
+
+  return sorted(int(name[1:]) for name, value in match.groupdict().iteritems()
+                if value != None)
+
+
+def _getScanPool(processes):
+  """Acquires the pool of scan processes that is shared by the whole process
+
+  The first caller creates the pool (with the given number of processes),
+  every later caller receives that same pool. A worker process (forked from
+  the driver) gets its own pool.
+
+  Args:
+    processes: The number of scan processes
+
+  Returns:
+    The _ScanPool shared by the whole process
+
+  """
+
+  global _sharedScanPool
+
+  with _sharedLock:
+    if _sharedScanPool == None or \
+       _sharedScanPool.processId != os.getpid():
+      _sharedScanPool = _ScanPool(processes)
+
+  return _sharedScanPool
+
+
+class _ScanPool():
+
+  """This class holds the scan processes and the stop flags of the searches
+
+  The stop flags are shared memory handed to the scan processes as they
+  start. A search claims one of the flags for its tasks, so a hit in one scan
+  process stops the tasks of that search in all the others, without touching
+  the other searches in progress.
+
+  """
+
+  # The ID of the process the pool belongs to
+  processId = None
+
+  # The pool of scan processes (multiprocessing.Pool)
+  pool = None
+
+  # The stop flags of the searches (multiprocessing.Array)
+  stopFlags = None
+
+  # The queue of the numbers of the stop flags that are free
+  _freeSlots = None
+
+  def __init__(self, processes):
+    """Constructor that starts the scan processes
+
+    Args:
+      processes: The number of scan processes
+
+    """
+
+    self.processId = os.getpid()
+    self.stopFlags = multiprocessing.Array('b', _STOP_SLOTS, lock=False)
+    self.pool = multiprocessing.Pool(processes, _initializeScanProcess,
+                                     (self.stopFlags,))
+    self._freeSlots = Queue.Queue()
+    for slot in range(_STOP_SLOTS):
+      self._freeSlots.put(slot)
+
+  def claimSlot(self):
+    """Claims a stop flag for a search, waiting for one to be free
+
+    Returns:
+      The number of the stop flag, which is cleared
+
+    """
+
+    slot = self._freeSlots.get()
+    self.stopFlags[slot] = 0
+    return slot
+
+  def releaseSlot(self, slot):
+    """Releases the stop flag of a search whose tasks are all done
+
+    Args:
+      slot: The number of the stop flag
+
+    """
+
+    self._freeSlots.put(slot)
+
+
+def _initializeScanProcess(stopFlags):
+  """Initializes a scan process with the stop flags of the searches
+
+  Args:
+    stopFlags: The stop flags of the searches (multiprocessing.Array)
+
+  """
+
+  global _stopFlags
+  _stopFlags = stopFlags
+
+
+def _scanPieces(task):
+  """Searches pieces of files for the source statements (in a scan process)
+
+  The pieces are skipped once the stop flag of the search is set, and a
+  search that stops at the first hit sets it.
+
+  Args:
+    task: A tuple of the number of the stop flag, the source of the
+          expression, the flag that indicates the search stops at the first
+          hit and the list of the pieces, as (file number, path, start, end)
+          tuples
+
+  Returns:
+    A list of (file number, counts) tuples of the pieces with hits, where the
+    counts are the [matches, offset of the first match] of the source
+    statements by their index
+
+  """
+
+  slot, source, firstOnly, pieces = task
+
+  pattern = _patterns.get(source)
+  if pattern == None:
+    pattern = _patterns[source] = re.compile(source, re.IGNORECASE)
+
+  results = []
+  for number, path, start, end in pieces:
+    if _stopFlags[slot]:
+      break
+
+    counts = _scanPiece(pattern, path, start, end, firstOnly)
+    if len(counts) > 0:
+      results.append((number, counts))
+      if firstOnly:
+        _stopFlags[slot] = 1
+        break
+
+  return results
+
+
+def _scanPiece(pattern, path, start, end, firstOnly):
+  """Searches a piece of a file for the source statements
+
+  Only the matches starting within the piece are counted, they can reach
+  into the next piece by up to _CHUNK_OVERLAP bytes.
+
+  Args:
+    pattern: The compiled expression of the source statements
+    path: The path of the file
+    start: The offset of the start of the piece
+    end: The offset of the end of the piece
+    firstOnly: Flag that indicates the search stops at the first hit
+
+  Returns:
+    A dictionary of the [matches, offset of the first match] of the source
+    statements found, by their index (binary files are never searched)
+
+  """
+
+  counts = {}
+
+  try:
+    with open(path, 'rb') as sourceFile:
+      if "\0" in sourceFile.read(StatementHandler._BINARY_CHECK_BYTES):
+        return counts
+
+      size = os.fstat(sourceFile.fileno()).st_size
+      if size == 0 or start >= size:
+        return counts
+
+      if size > StatementHandler._MMAP_THRESHOLD:
+        content = mmap.mmap(sourceFile.fileno(), 0, access=mmap.ACCESS_READ)
+      else:
+        sourceFile.seek(0)
+        content = sourceFile.read()
+
+      try:
+        for match in pattern.finditer(content, start,
+                                      min(size, end + _CHUNK_OVERLAP)):
+          if match.start() >= end:
+            break
+
+          for index in _statementIndexes(match):
+            if index in counts:
+              counts[index][0] += 1
+            else:
+              counts[index] = [1, match.start()]
+
+          if firstOnly:
+            break
+      finally:
+        if size > StatementHandler._MMAP_THRESHOLD:
+          content.close()
+  except (IOError, OSError, ValueError):
+    pass  # The file is left out, as in the search within this process
+
+  return counts
+
+
+class StatementHandler():
+
+  """This class searches cloned repositories for the source statements
+
+  The source statements ('|' separated, as egrep expressions) are compiled
+  once into a single case insensitive expression that only matches whole
+  words. A repository is searched by walking its directory tree within this
+  process, skipping the .git directory, symbolic links, binary files and
+  files above the maximum size. Large files are memory mapped instead of being
+  read. The search can stop at the first hit, or find every source statement
+  in every file. The statistics of a repository (the matches, files and first
+  hit of each source statement) are gathered in the same single pass over
+  each file, however many source statements there are.
+
+  A repository whose files add up to more than a threshold (ex: a monorepo)
+  is searched by a pool of scan processes instead, shared by the whole
+  process. Its files are split into tasks of a few megabytes, large files
+  into chunks that overlap a little, so the search takes about the size of
+  the repository divided by the number of processes. A search that stops at
+  the first hit stops the tasks of every scan process through a shared flag.
+
+  """
+
+  # The number of leading bytes checked for a NUL byte to detect binary files
+  _BINARY_CHECK_BYTES = 8192
+
+  # The size above which files are memory mapped instead of being read
+  _MMAP_THRESHOLD = 1048576
+
+  # The list of source statements
+  _statements = None
+
+  # The compiled expression matching any of the source statements
+  _pattern = None
+
+  # The maximum size of the files that are searched (in bytes)
+  _maxFileSize = None
+
+  # The size of the repositories above which they are searched by the scan
+  # processes (in bytes)
+  _parallelBytes = None
+
+  # The pool of scan processes (None if there are none)
+  _scanPool = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, sourceStatements, logger, maxFileSize=10485760,
+               scanProcesses=1, parallelBytes=67108864):
+    """Constructor that compiles the source statements
+
+    Args:
+      sourceStatements: The '|' separated source statements
+      logger: The custom logger to be used for this executing process
+      maxFileSize: The maximum size of the files that are searched (in bytes)
+      scanProcesses: The number of scan processes searching the large
+                     repositories (1 disables them)
+      parallelBytes: The size of the repositories above which they are
+                     searched by the scan processes (in bytes)
+
+    """
+
+    self._statements = sourceStatements.split('|')
+    self._maxFileSize = maxFileSize
+    self._parallelBytes = parallelBytes
+    self._logger = logger
+
+    # Started before any clone, as a scan process forked while a git process
+    # runs would keep its pipes open (and the clone would never end)
+    if scanProcesses > 1:
+      self._scanPool = _getScanPool(scanProcesses)
+
+    # The expression matches (without consuming) at the start of any of the
+    # statements, and each statement gets a named group within a lookahead of
+    # its own, so every statement matching at that position is told apart
+    # (even when one statement is a prefix of another)
+    anyStatement = "|".join("(?:%s)" %statement
+                            for statement in self._statements)
+    lookaheads = "".join(r"(?:(?=(?P<s%d>%s)(?!\w))|)" %(index, statement)
+                         for index, statement in enumerate(self._statements))
+    self._pattern = re.compile(r"(?<!\w)(?=(?:%s)(?!\w))%s"
+                               %(anyStatement, lookaheads), re.IGNORECASE)
+
+  def findStatements(self, directory, firstOnly=True):
+    """Searches the files of a directory tree for the source statements
+
+    Args:
+      directory: The root of the directory tree to search
+      firstOnly: Flag that indicates the search stops at the first hit
+
+    Returns:
+      A list of (file path, source statement) tuples of the hits, where the
+      file path is relative to the directory
+
+    """
+
+    files = self._files(directory)
+    if self._scanPool != None:
+      files = list(files)
+      if sum(size for path, size in files) > self._parallelBytes:
+        return self._findInParallel(directory, files, firstOnly)
+
+    hits = []
+
+    for path, size in files:
+      for statement in self._searchFile(path, firstOnly):
+        hits.append((os.path.relpath(path, directory), statement))
+
+        if firstOnly:
+          return hits
+
+    return hits
+
+  def scanStatistics(self, directory):
+    """Gathers the statistics of the source statements in a directory tree
+
+    Args:
+      directory: The root of the directory tree to search
+
+    Returns:
+      A list of (matches, files, first hit) tuples, one for each source
+      statement in order, where the first hit is the relative file path and
+      line number of the first match found (ex: src/Lock.java:12), or None
+
+    """
+
+    matches = [0] * len(self._statements)
+    files = [0] * len(self._statements)
+    firstHits = [None] * len(self._statements)
+
+    paths = self._files(directory)
+    if self._scanPool != None:
+      paths = list(paths)
+      if sum(size for path, size in paths) > self._parallelBytes:
+        return self._scanStatisticsInParallel(directory, paths)
+
+    for path, size in paths:
+      for index, (count, line) in self._countFile(path, firstHits).iteritems():
+        matches[index] += count
+        files[index] += 1
+        if firstHits[index] == None:
+          firstHits[index] = "%s:%d" %(os.path.relpath(path, directory), line)
+
+    return zip(matches, files, firstHits)
+
+  def _findInParallel(self, directory, files, firstOnly):
+    """Searches the files for the source statements with the scan processes
+
+    Args:
+      directory: The root of the directory tree searched
+      files: The list of the (path, size) tuples of the files
+      firstOnly: Flag that indicates the search stops at the first hit
+
+    Returns:
+      A list of (file path, source statement) tuples of the hits (see
+      findStatements), only the first one by file when the search stops at
+      the first hit
+
+    """
+
+    hits = []
+    countsOfFiles = self._scanInParallel(files, firstOnly)
+
+    for number in sorted(countsOfFiles):
+      counts = countsOfFiles[number]
+      path = os.path.relpath(files[number][0], directory)
+      for index in sorted(counts, key=lambda index: counts[index][1]):
+        hits.append((path, self._statements[index]))
+
+        if firstOnly:
+          return hits
+
+    return hits
+
+  def _scanStatisticsInParallel(self, directory, files):
+    """Gathers the statistics of the source statements with the scan
+    processes
+
+    Args:
+      directory: The root of the directory tree searched
+      files: The list of the (path, size) tuples of the files
+
+    Returns:
+      The list of the (matches, files, first hit) tuples of the source
+      statements (see scanStatistics)
+
+    """
+
+    matches = [0] * len(self._statements)
+    fileCounts = [0] * len(self._statements)
+    firstHits = [None] * len(self._statements)
+    countsOfFiles = self._scanInParallel(files, False)
+
+    for number in sorted(countsOfFiles):
+      path = files[number][0]
+      for index, (count, offset) in countsOfFiles[number].iteritems():
+        matches[index] += count
+        fileCounts[index] += 1
+        if firstHits[index] == None:
+          firstHits[index] = "%s:%d" %(os.path.relpath(path, directory),
+                                       self._lineOf(path, offset))
+
+    return zip(matches, fileCounts, firstHits)
+
+  def _scanInParallel(self, files, firstOnly):
+    """Searches the files with the scan processes
+
+    Every task is waited for, even after the search is stopped (the stopped
+    tasks return right away), before the stop flag is released.
+
+    Args:
+      files: The list of the (path, size) tuples of the files
+      firstOnly: Flag that indicates the search stops at the first hit
+
+    Returns:
+      A dictionary of the counts of the files with hits by their number (see
+      _scanPieces), where the counts of the chunks of a file are merged
+
+    """
+
+    scanPool = self._scanPool
+    slot = scanPool.claimSlot()
+    countsOfFiles = {}
+
+    try:
+      tasks = ((slot, self._pattern.pattern, firstOnly, pieces)
+               for pieces in self._pieces(files))
+
+      for results in scanPool.pool.imap_unordered(_scanPieces, tasks):
+        for number, counts in results:
+          merged = countsOfFiles.setdefault(number, {})
+          for index, (count, offset) in counts.iteritems():
+            if index in merged:
+              merged[index][0] += count
+              merged[index][1] = min(merged[index][1], offset)
+            else:
+              merged[index] = [count, offset]
+
+        if firstOnly and len(countsOfFiles) > 0:
+          scanPool.stopFlags[slot] = 1  # The tasks yet to start are skipped
+    finally:
+      scanPool.releaseSlot(slot)
+
+    return countsOfFiles
+
+  def _pieces(self, files):
+    """Splits the files into the pieces of the tasks of the scan processes
+
+    Args:
+      files: The list of the (path, size) tuples of the files
+
+    Returns:
+      A generator of the lists of the (file number, path, start, end) tuples
+      of the pieces of each task, which add up to about _CHUNK_BYTES
+
+    """
+
+    pieces = []
+    taskBytes = 0
+
+    for number, (path, size) in enumerate(files):
+      for start in range(0, max(size, 1), _CHUNK_BYTES):
+        end = min(size, start + _CHUNK_BYTES)
+        pieces.append((number, path, start, end))
+        taskBytes += end - start
+
+        if taskBytes >= _CHUNK_BYTES:
+          yield pieces
+          pieces = []
+          taskBytes = 0
+
+    if len(pieces) > 0:
+      yield pieces
+
+  def _lineOf(self, path, offset):
+    """Determines the line number of an offset in a file
+
+    Args:
+      path: The path of the file
+      offset: The offset in the file
+
+    Returns:
+      The line number (starting at 1)
+
+    """
+
+    line = 1
+
+    try:
+      with open(path, 'rb') as sourceFile:
+        while offset > 0:
+          block = sourceFile.read(min(offset, 1048576))
+          if block == "":
+            break
+          line += block.count("\n")
+          offset -= len(block)
+    except (IOError, OSError), e:
+      self._logger.debug("Unable to read %s: %s" %(path, e))
+
+    return line
+
+  def _files(self, directory):
+    """Lists the files of a directory tree that are worth searching
+
+    Args:
+      directory: The root of the directory tree
+
+    Returns:
+      A generator of the (path, size) tuples of the regular files that are
+      not within a .git directory and not above the maximum size
+
+    """
+
+    for root, directories, files in os.walk(directory):
+      if ".git" in directories:
+        directories.remove(".git")
+
+      for name in files:
+        path = os.path.join(root, name)
+
+        try:
+          if os.path.islink(path):
+            continue
+          size = os.path.getsize(path)
+        except OSError:
+          continue
+
+        if size <= self._maxFileSize:
+          yield path, size
+
+  def _searchFile(self, path, firstOnly):
+    """Searches a single file for the source statements
+
+    Args:
+      path: The path of the file
+      firstOnly: Flag that indicates the search stops at the first hit
+
+    Returns:
+      The list of source statements found in the file (binary files are
+      never searched)
+
+    """
+
+    try:
+      with self._content(path) as content:
+        if content == None:
+          return []
+
+        if firstOnly:
+          match = self._pattern.search(content)
+          return [] if match == None else self._statementsOf(match)
+
+        found = []
+        for match in self._pattern.finditer(content):
+          for statement in self._statementsOf(match):
+            if statement not in found:
+              found.append(statement)
+        return found
+    except (IOError, OSError, ValueError), e:
+      self._logger.debug("Unable to search %s: %s" %(path, e))
+      return []
+
+  def _countFile(self, path, firstHits):
+    """Counts the matches of the source statements in a single file
+
+    Args:
+      path: The path of the file
+      firstHits: The list of the first hits of the source statements so far
+                 (the line of a match is only determined while it has none)
+
+    Returns:
+      A dictionary of the (matches, line of the first match) of the source
+      statements found in the file, by their index
+
+    """
+
+    counts = {}
+
+    try:
+      with self._content(path) as content:
+        if content == None:
+          return counts
+
+        for match in self._pattern.finditer(content):
+          for index in _statementIndexes(match):
+            if index in counts:
+              counts[index][0] += 1
+            else:
+              line = 0
+              if firstHits[index] == None:
+                line = content[:match.start()].count("\n") + 1
+              counts[index] = [1, line]
+    except (IOError, OSError, ValueError), e:
+      self._logger.debug("Unable to search %s: %s" %(path, e))
+
+    return counts
+
+  @contextmanager
+  def _content(self, path):
+    """Opens the content of a file for searching (a context manager)
+
+    Args:
+      path: The path of the file
+
+    Returns:
+      The content of the file (memory mapped when it is large), or None for
+      empty and binary files
+
+    """
+
+    with open(path, 'rb') as sourceFile:
+      if "\0" in sourceFile.read(self._BINARY_CHECK_BYTES):
+        yield None
+        return
+
+      size = os.fstat(sourceFile.fileno()).st_size
+      if size == 0:
+        yield None
+        return
+
+      if size <= self._MMAP_THRESHOLD:
+        sourceFile.seek(0)
+        yield sourceFile.read()
+        return
+
+      content = mmap.mmap(sourceFile.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        yield content
+      finally:
+        content.close()
+
+  def _statementsOf(self, match):
+    """Determines which source statements a match is of
+
+    Args:
+      match: The match of the compiled expression
+
+    Returns:
+      The list of the source statements that matched at its position
+
+    """
+
+    return [self._statements[index] for index in _statementIndexes(match)]
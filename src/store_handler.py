@@ -0,0 +1,263 @@
+import sqlite3
+import threading
+import time
+import report_handler
+try: import simplejson as json
+except ImportError: import json
+
+
+class StoreHandler():
+
+  """This class handles the SQLite store of the examined repositories
+
+  The store keeps the report data of every examined repository, keyed by its
+  'owner/name', so the repositories that appear on several pages of a crawl,
+  or again in later crawls, are only examined once. Before the language API
+  call of a repository is made, the repository is claimed for the crawl: a
+  repository the crawl already claimed (on another page, by any of its
+  executions) is a duplicate and left out, and a repository examined within
+  the freshness window reuses its stored data, without API calls or a clone.
+  The examined repositories of a page are stored in a single transaction.
+  Besides the report record (which keeps the header fields exactly), the
+  header fields are columns of the repositories table and the language sizes
+  are rows of the languages table, so the store can be queried directly. The
+  database is in WAL mode, which lets the executions (threads or processes)
+  read while another one writes; each thread has its own connection.
+
+  """
+
+  # The number of seconds an execution waits for the database to be unlocked
+  _TIMEOUT = 60
+
+  # The path of the database file
+  _path = None
+
+  # The CSV column headers
+  _headers = None
+
+  # List of all recognized GitHub languages
+  _languages = None
+
+  # The number of seconds the stored data of a repository is reused
+  _freshness = None
+
+  # The identifier of the crawl the repositories are claimed for
+  _crawl = None
+
+  # The connections of each thread
+  _local = None
+
+  # Logger being used for this execution
+  _logger = None
+
+  def __init__(self, path, headers, languages, freshness, crawl, logger):
+    """Constructor that prepares the database
+
+    Args:
+      path: The path of the database file
+      headers: The list of headers as fields for the report
+      languages: The list of languages as fields for the report
+      freshness: The number of seconds the stored data of a repository is
+                 reused
+      crawl: The identifier of the crawl the repositories are claimed for
+             (shared by the concurrent executions of the crawl)
+      logger: The custom logger to be used for this executing process
+
+    """
+
+    self._path = path
+    self._headers = headers
+    self._languages = languages
+    self._freshness = freshness
+    self._crawl = crawl
+    self._local = threading.local()
+    self._logger = logger
+
+    connection = self._connection()
+    connection.execute("PRAGMA journal_mode=WAL")
+
+    with connection:
+      connection.execute("CREATE TABLE IF NOT EXISTS repositories (repository "
+                         "TEXT PRIMARY KEY, examined REAL, languages_size "
+                         "INTEGER, record TEXT, %s)"
+                         %", ".join(self._quote(header) for header in headers))
+      connection.execute("CREATE TABLE IF NOT EXISTS languages (repository "
+                         "TEXT, language TEXT, size INTEGER, PRIMARY KEY "
+                         "(repository, language))")
+      connection.execute("CREATE INDEX IF NOT EXISTS languages_language ON "
+                         "languages (language)")
+      connection.execute("CREATE TABLE IF NOT EXISTS claims (repository TEXT, "
+                         "crawl TEXT, claimed REAL, PRIMARY KEY "
+                         "(repository, crawl))")
+
+      # The claims of the earlier crawls are of no more use
+      connection.execute("DELETE FROM claims WHERE claimed < ?",
+                         (time.time() - max(freshness, 86400),))
+
+    self._logger.info("Store Handler is ready for use (%s)" %path)
+
+  def claim(self, name):
+    """Claims a repository for the crawl
+
+    Args:
+      name: The name of the repository as 'owner/name'
+
+    Returns:
+      A tuple of the outcome, which is 'duplicate' (the crawl already claimed
+      the repository), 'fresh' (the stored data is reused) or 'claimed' (the
+      repository is to be examined), and the stored RepositoryRecord (or None)
+
+    """
+
+    connection = self._connection()
+    cursor = connection.execute("INSERT OR IGNORE INTO claims (repository, "
+                                "crawl, claimed) VALUES (?, ?, ?)",
+                                (name, self._crawl, time.time()))
+    if cursor.rowcount == 0:
+      return "duplicate", None
+
+    row = connection.execute("SELECT record FROM repositories WHERE "
+                             "repository = ? AND examined >= ?",
+                             (name, time.time() - self._freshness)).fetchone()
+    if row == None:
+      return "claimed", None
+
+    return "fresh", report_handler.RepositoryRecord.fromJournal(
+        json.loads(row[0]))
+
+  def release(self, name):
+    """Releases the claim of a repository that couldn't be examined
+
+    Args:
+      name: The name of the repository as 'owner/name'
+
+    """
+
+    self._connection().execute("DELETE FROM claims WHERE repository = ? "
+                               "AND crawl = ?", (name, self._crawl))
+
+  def store(self, namesAndRecords):
+    """Stores (or replaces) the data of the examined repositories of a page
+
+    Args:
+      namesAndRecords: The list of (name, RepositoryRecord) tuples, the
+                       records of repositories without content have no
+                       header fields
+
+    """
+
+    if len(namesAndRecords) == 0:
+      return
+
+    examined = time.time()
+    repositoryRows = []
+    languageRows = []
+
+    for name, record in namesAndRecords:
+      fields = list(record.fields)
+      fields.extend([None] * (len(self._headers) - len(fields)))
+      repositoryRows.append([name, examined, record.totalSize(),
+                             json.dumps(record.toJournal())] +
+                            [self._column(field) for field in fields])
+
+      for index, size in zip(record.languageIndexes, record.languageSizes):
+        languageRows.append((name, self._languages[index], size))
+
+    connection = self._connection()
+    with connection:
+      connection.execute("BEGIN IMMEDIATE")
+      connection.executemany("INSERT OR REPLACE INTO repositories VALUES "
+                             "(%s)" %", ".join("?" * len(repositoryRows[0])),
+                             repositoryRows)
+      connection.executemany("DELETE FROM languages WHERE repository = ?",
+                             [(name,) for name, record in namesAndRecords])
+      connection.executemany("INSERT INTO languages VALUES (?, ?, ?)",
+                             languageRows)
+
+    self._logger.info("Stored %d repositories" %len(namesAndRecords))
+
+  def exportCSV(self, fileName, crawl=None):
+    """Exports the repositories with content as a CSV report
+
+    Args:
+      fileName: The file name of the report
+      crawl: The identifier of the crawl whose repositories are exported (by
+             default every repository in the store is exported)
+
+    Returns:
+      The number of repositories exported
+
+    """
+
+    query = "SELECT record FROM repositories WHERE languages_size > 0"
+    arguments = ()
+    if crawl != None:
+      query += (" AND repository IN (SELECT repository FROM claims WHERE "
+                "crawl = ?)")
+      arguments = (crawl,)
+
+    reportFormat = report_handler.CSVReportFormat(self._headers,
+                                                  self._languages)
+    reportFormat.open(fileName, False)
+    exported = 0
+
+    cursor = self._connection().execute(query + " ORDER BY repository",
+                                        arguments)
+    while True:
+      rows = cursor.fetchmany(1000)
+      if len(rows) == 0:
+        break
+
+      reportFormat.write([report_handler.RepositoryRecord.fromJournal(
+          json.loads(row[0])) for row in rows])
+      exported += len(rows)
+
+    reportFormat.close()
+    self._logger.info("Exported %d repositories to %s" %(exported, fileName))
+    return exported
+
+  def _connection(self):
+    """Acquires the connection of the current thread
+
+    Returns:
+      The sqlite3 connection
+
+    """
+
+    if not hasattr(self._local, 'connection'):
+      connection = sqlite3.connect(self._path, self._TIMEOUT,
+                                   isolation_level=None)
+      connection.text_factory = str  # The report fields are utf-8 strings
+      connection.execute("PRAGMA synchronous=NORMAL")
+      self._local.connection = connection
+
+    return self._local.connection
+
+  def _column(self, field):
+    """Converts a header field to the value of its column
+
+    Args:
+      field: The header field
+
+    Returns:
+      The field if SQLite takes its type, otherwise its string
+
+    """
+
+    if field == None or isinstance(field, (str, int, long, float)):
+      return field
+
+    return str(field)
+
+  def _quote(self, identifier):
+    """Quotes an identifier of the database (ex: a column name)
+
+    Args:
+      identifier: The identifier
+
+    Returns:
+      The quoted identifier
+
+    """
+
+    return '"%s"' %identifier.replace('"', '""')
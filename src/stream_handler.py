@@ -0,0 +1,161 @@
+import re
+try: import simplejson as json
+except ImportError: import json
+
+
+class ArrayStreamDecoder():
+
+  """This class decodes the elements of a JSON array as the document arrives
+
+  The document is fed in chunks, in the order they are received. Once the
+  array under the given key is reached, each of its elements is decoded as
+  soon as its last byte has been fed, and the bytes of decoded elements are
+  dropped. So only the element being received is held, never the whole
+  document. The elements must be objects or arrays, and the key must not
+  appear in the document before the array (as in the search results of the
+  GitHub API).
+
+  """
+
+  # The characters that change the nesting outside of strings
+  _STRUCTURE = re.compile(r'[{}\[\]"]')
+
+  # The characters that end (or escape within) a string
+  _STRING = re.compile(r'["\\]')
+
+  # The characters between the elements of an array
+  _SEPARATOR = re.compile(r'[\s,]*')
+
+  # The expression that finds the start of the array
+  _arrayStart = None
+
+  # The data fed but not decoded yet
+  _buffer = ""
+
+  # The position in the buffer the scanning continues from
+  _position = 0
+
+  # Flag that indicates the start of the array was found
+  _inArray = False
+
+  # Flag that indicates an element is being scanned
+  _inElement = False
+
+  # Flag that indicates the scanning is within a string
+  _inString = False
+
+  # The nesting depth within the element being scanned
+  _depth = 0
+
+  # Flag that indicates the end of the array was found
+  done = False
+
+  def __init__(self, key):
+    """Constructor that sets the key of the array
+
+    Args:
+      key: The key of the array within the document
+
+    """
+
+    self._arrayStart = re.compile(r'"%s"\s*:\s*\[' %re.escape(key))
+
+  def feed(self, data):
+    """Feeds the next chunk of the document
+
+    Args:
+      data: The chunk of the document
+
+    Returns:
+      The list of the elements completed by the chunk, decoded
+
+    Raises:
+      ValueError: An element isn't valid JSON, or isn't an object or array
+
+    """
+
+    if self.done:
+      return []
+
+    self._buffer += data
+    elements = []
+
+    if not self._inArray:
+      match = self._arrayStart.search(self._buffer)
+
+      if match == None:
+        return elements
+
+      self._buffer = self._buffer[match.end():]
+      self._inArray = True
+
+    while True:
+      if not self._inElement:
+        self._position = self._SEPARATOR.match(self._buffer,
+                                               self._position).end()
+        if self._position >= len(self._buffer):
+          break
+
+        character = self._buffer[self._position]
+        if character == "]":
+          self.done = True
+          self._buffer = ""
+          break
+        elif character not in "{[":
+          raise ValueError("Array element at %d is not an object or array"
+                           %self._position)
+
+        # Drop the bytes of the earlier elements
+        self._buffer = self._buffer[self._position:]
+        self._position = 0
+        self._inElement = True
+
+      if self._inString:
+        match = self._STRING.search(self._buffer, self._position)
+
+        if match == None:
+          self._position = len(self._buffer)
+          break
+        elif match.group() == "\\":
+          if match.end() >= len(self._buffer):
+            self._position = match.start()  # The escaped byte is to come
+            break
+          self._position = match.end() + 1
+        else:
+          self._inString = False
+          self._position = match.end()
+
+        continue
+
+      match = self._STRUCTURE.search(self._buffer, self._position)
+
+      if match == None:
+        self._position = len(self._buffer)
+        break
+
+      self._position = match.end()
+      character = match.group()
+
+      if character == '"':
+        self._inString = True
+      elif character in "{[":
+        self._depth += 1
+      else:
+        self._depth -= 1
+
+        if self._depth == 0:
+          elements.append(json.loads(self._buffer[:self._position]))
+          self._inElement = False
+
+    return elements
+
+  def close(self):
+    """Checks that the whole array was fed
+
+    Raises:
+      ValueError: The document ended before the end of the array
+
+    """
+
+    if not self.done:
+      raise ValueError("The document ended within the array")